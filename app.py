@@ -1,7 +1,27 @@
 import os
+import sys
+import abc
 import csv
 import re
+import bisect
+import time
+import signal
+import socket
+import itertools
+import argparse
+import contextlib
+import decimal
+import hashlib
+import io
+import json
+import queue
+import threading
 import subprocess
+import tempfile
+import zlib
+import zipfile
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
 import customtkinter as ctk
 import shutil
 from TexSoup import TexSoup
@@ -9,51 +29,163 @@ import tkinter as tk
 from tkinter import messagebox, filedialog, simpledialog
 from datetime import datetime
 
+try:
+    import resource
+except ImportError:  # Windows: no rlimits, the wall-clock timeout still applies
+    resource = None
+
+try:
+    import fcntl
+except ImportError:  # Windows locks registries with msvcrt instead
+    fcntl = None
+    import msvcrt
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # Optional, only needed to split mail-merge output per record
+    PdfReader = PdfWriter = None
+
 # Constants
 TEMPLATE_FOLDER = "templates"
 TEMP_TEX_DIR = "temp"
 DOCUMENTS_DIR = "documents"
+DATA_DIR = "data"
+PARTIALS_FOLDER = "partials"
+ARCHIVE_DIR = "archive"
+# Per-template compiled artifacts (expanded sources, ...), invalidated via the dependency graph
+TEMPLATE_CACHE_DIR = os.path.join("cache", "templates")
 # CSV_FILE = "index.csv"
 TEMPLATES_CSV = "templates.csv"
 DOCUMENTS_CSV = "documents.csv"
+TEMPLATE_HEADERS = [
+    "Template Index",
+    "Template Type Name",
+    "Date of Import",
+    "Short Description",
+    "Path to Template File"
+]
+DOCUMENT_HEADERS = [
+    "Document Index Number",
+    "Template Type Name",
+    "Date of Generation",
+    "Short Description",
+    "Path to Parameter File",
+    "Path to Generated PDF"
+]
+# Document IDs handed out but not registered yet (a compile is running)
+RESERVED_IDS_CSV = "reserved_ids.csv"
+RESERVED_IDS_HEADERS = ["Document Index Number", "Holder", "Reserved"]
+TEMPLATE_DEPS_CSV = "template_deps.csv"
+TEMPLATE_DEPS_HEADERS = ["Template Type Name", "Partial Name", "Partial Hash"]
+COMPILE_STATS_CSV = "compile_stats.csv"
+COMPILE_STATS_HEADERS = ["Finished", "Job", "Label", "Priority", "Template Type Name", "Outcome",
+                         "Queue Seconds", "Wall Seconds", "CPU Seconds"]
+CONTENT_HASHES_CSV = "content_hashes.csv"
+CONTENT_HASHES_HEADERS = ["SHA-256", "Kind", "Path"]
+# Source commands whose output depends on the compile date (part of the render key)
+DATE_DEPENDENT_MACROS = ("\\today", "\\year", "\\month", "\\day", "\\time")
+ARCHIVE_INDEX_CSV = os.path.join(ARCHIVE_DIR, "index.csv")
+ARCHIVE_INDEX_HEADERS = ["Member", "Pack File", "Offset", "Length", "Size", "SHA-256"]
+ARCHIVE_PACK_SIZE = 1024 * 1024 * 1024  # start a new pack file after ~1 GiB
+ARCHIVE_CHUNK_SIZE = 1024 * 1024
+EXPORT_FORMATS = ("csv", "jsonl")
+# Incremental backups: what a snapshot holds, and its manifest and verification files
+SNAPSHOT_DIRS = (TEMPLATE_FOLDER, PARTIALS_FOLDER, DOCUMENTS_DIR, DATA_DIR, ARCHIVE_DIR)
+SNAPSHOT_REGISTRIES = (TEMPLATES_CSV, DOCUMENTS_CSV, TEMPLATE_DEPS_CSV, CONTENT_HASHES_CSV, ARCHIVE_INDEX_CSV)
+SNAPSHOT_MANIFEST_HEADERS = ["Path", "Kind", "SHA-256", "Size", "Modified"]
+SNAPSHOT_VERIFIED_CSV = "verified.csv"
+SNAPSHOT_VERIFIED_HEADERS = ["SHA-256", "Size", "Modified", "Verified"]
+# Lock files, journals and half-written files are never backed up
+SNAPSHOT_SKIP_SUFFIXES = (".lock", ".journal", ".tmp")
+SNAPSHOT_WORKERS = 8
+EXPORT_PROGRESS_EVERY = 200
 CTK_FRAME_PAD = 20
+MERGE_MARKER = "LAXDOC-RECORD"
+# Set up right after \begin{document} of a merge run: LaxDocResetRecord puts every
+# counter and the title macros (which \maketitle clears) back as they were there
+MERGE_TITLE_MACROS = ("maketitle", "@maketitle", "thanks", "@thanks", "title", "@title",
+                      "author", "@author", "date", "@date", "and")
+MERGE_RECORD_SETUP = (
+    "\\makeatletter\n"
+    "\\begingroup\\def\\@elt#1{\\global\\value{#1}\\the\\value{#1}\\relax}"
+    "\\xdef\\laxdoc@counters{\\cl@@ckpt}\\endgroup\n"
+    + "".join(f"\\let\\laxdoc@saved{name}\\{name}\n" for name in MERGE_TITLE_MACROS)
+    + "\\def\\LaxDocResetRecord{\\laxdoc@counters"
+    + "".join(f"\\global\\let\\{name}\\laxdoc@saved{name}" for name in MERGE_TITLE_MACROS)
+    + "}\n\\makeatother\n"
+)
+# Directory layout for generated PDFs and parameter files: flat, template, month or hash
+STORAGE_LAYOUTS = ("flat", "template", "month", "hash")
+STORAGE_LAYOUT = os.environ.get("LAXDOC_STORAGE_LAYOUT", "flat")
+MIGRATION_CHECKPOINT_ROWS = 500
+# Files pdflatex leaves next to the PDF that the registry never references
+LATEX_BYPRODUCT_EXTENSIONS = (".aux", ".log", ".out", ".toc", ".fls", ".fdb_latexmk", ".synctex.gz")
+RECONCILE_WORKERS = 8
+REBUILD_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+# Stop pdflatex at the first error instead of grinding through the rest of the document
+COMPILE_FAIL_FAST = True
+COMPILE_LOG_TAIL = 3000
+# Per-job limits; a job over any of them has its whole process group killed
+COMPILE_TIMEOUT = 300  # wall-clock seconds
+COMPILE_CPU_LIMIT = 240  # CPU seconds
+COMPILE_MEMORY_LIMIT = 2 * 1024 * 1024 * 1024  # address space, bytes
+COMPILE_FILE_LIMIT = 256 * 1024 * 1024  # largest file a job may write, bytes
+COMPILE_LOG_LIMIT = 16 * 1024 * 1024  # terminal output read before the job is stopped, bytes
+JOBS_DIR = os.path.join(TEMP_TEX_DIR, "jobs")
+REGISTRY_LOCK_TIMEOUT = 30  # seconds to wait for another instance's registry write
+# Live preview: recompile this long after typing stops, render page 1 at this resolution
+PREVIEW_DEBOUNCE_MS = 700
+PREVIEW_TIMEOUT = 60
+PREVIEW_DPI = 40
+# As-you-type search: delay after the last keystroke, rows shown, further candidates
+# counted, suggestions offered
+LIVE_FILTER_DELAY_MS = 250
+LIVE_FILTER_ROWS = 50
+LIVE_FILTER_COUNT_LIMIT = 1000
+SUGGESTION_LIMIT = 8
+# Parameter sweeps: several values per field
+# In a sweep field LaTeX's \| is kept, || is a literal bar and any other | separates values
+SWEEP_LIST_TOKEN = re.compile(r"\\\||\|\||\|")
+SWEEP_RANGE_PATTERN = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*\.\.\s*(-?\d+(?:\.\d+)?)(?:\s*\.\.\s*(-?\d+(?:\.\d+)?))?\s*$")
+# Compile scheduling: classes in priority order, and workers only interactive jobs may use
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+PRIORITY_BACKGROUND = "background"
+PRIORITY_CLASSES = (PRIORITY_INTERACTIVE, PRIORITY_BATCH, PRIORITY_BACKGROUND)
+COMPILE_WORKERS = max(2, os.cpu_count() or 2)
+RESERVED_INTERACTIVE_WORKERS = 1
+SWEEP_WINDOW = 2 * COMPILE_WORKERS  # sweep compiles kept in flight at once
+# Durable per-row state of merge and sweep batches; failed rows wait before a retry
+BATCH_JOURNAL_DIR = "batches"
+BATCH_RETRY_BACKOFF = 60  # seconds after the first failure, doubling with each one
+BATCH_RETRY_BACKOFF_MAX = 6 * 3600
+# A batch journal untouched this long is abandoned: its rows' IDs may be given to others
+BATCH_ABANDON_DAYS = 30
 
 # Helper functions
 def check_and_create_index():
     """
     Checks if the templates.csv and documents.csv files exist. If not, creates them with appropriate headers.
     """
-    template_headers = [
-        "Template Index",
-        "Template Type Name",
-        "Date of Import",
-        "Short Description",
-        "Path to Template File"
-    ]
-    document_headers = [
-        "Document Index Number",
-        "Template Type Name",
-        "Date of Generation",
-        "Short Description",
-        "Path to Parameter File",
-        "Path to Generated PDF"
-    ]
+    # Taking a registry's lock replays a write a crashed instance left in its journal
+    with RegistryLock(TEMPLATES_CSV):
+        if not os.path.exists(TEMPLATES_CSV):
+            rewrite_csv(TEMPLATES_CSV, TEMPLATE_HEADERS, [])
+            print(f"'{TEMPLATES_CSV}' created with headers.")
+        else:
+            print(f"'{TEMPLATES_CSV}' already exists.")
 
-    if not os.path.exists(TEMPLATES_CSV):
-        with open(TEMPLATES_CSV, "w", newline="") as file:
-            writer = csv.writer(file)
-            writer.writerow(template_headers)
-        print(f"'{TEMPLATES_CSV}' created with headers.")
-    else:
-        print(f"'{TEMPLATES_CSV}' already exists.")
+    with RegistryLock(DOCUMENTS_CSV):
+        if not os.path.exists(DOCUMENTS_CSV):
+            rewrite_csv(DOCUMENTS_CSV, DOCUMENT_HEADERS, [])
+            print(f"'{DOCUMENTS_CSV}' created with headers.")
+        else:
+            print(f"'{DOCUMENTS_CSV}' already exists.")
 
-    if not os.path.exists(DOCUMENTS_CSV):
-        with open(DOCUMENTS_CSV, "w", newline="") as file:
-            writer = csv.writer(file)
-            writer.writerow(document_headers)
-        print(f"'{DOCUMENTS_CSV}' created with headers.")
-    else:
-        print(f"'{DOCUMENTS_CSV}' already exists.")
+    for csv_file in (TEMPLATE_DEPS_CSV, CONTENT_HASHES_CSV, ARCHIVE_INDEX_CSV, COMPILE_STATS_CSV):
+        if os.path.exists(journal_path(csv_file)):
+            with RegistryLock(csv_file):
+                print(f"'{csv_file}' recovered from its journal.")
 
 def is_valid_filename(name):
     """Validate filename doesn't contain special characters"""
@@ -63,6 +195,149 @@ def parse_placeholders(content):
     """Detect placeholders in the LaTeX template using regex."""
     return re.findall(r'\{\{(\w+)\}\}', content)
 
+def parse_partials(content):
+    """Detect shared partial includes ({{> name}}) in a template or partial."""
+    return re.findall(r'\{\{>\s*(\w+)\s*\}\}', content)
+
+def partial_path(name):
+    return os.path.join(PARTIALS_FOLDER, f"{name}.tex")
+
+def expand_partial_lines(content, origin, used, _stack=()):
+    """
+    Expand {{> name}} includes line by line, keeping where each line came from.
+    Returns a list of (line text, origin file, origin line number); every
+    partial used (nested ones included) is appended to used.
+    """
+    lines = []
+    for lineno, line in enumerate(content.split("\n"), start=1):
+        current = ["", origin, lineno]
+        pos = 0
+        for match in re.finditer(r'\{\{>\s*(\w+)\s*\}\}', line):
+            name = match.group(1)
+            if name in _stack:
+                raise ValueError(f"Partial include cycle: {' -> '.join(_stack + (name,))}")
+            path = partial_path(name)
+            if not os.path.exists(path):
+                raise ValueError(f"Partial '{name}' not found in '{PARTIALS_FOLDER}'.")
+            if name not in used:
+                used.append(name)
+            with open(path, "r") as f:
+                included = expand_partial_lines(f.read(), path, used, _stack + (name,))
+
+            current[0] += line[pos:match.start()]
+            first_text, first_origin, first_lineno = included[0]
+            if not current[0].strip():
+                # The line effectively starts inside the partial
+                current[1:] = [first_origin, first_lineno]
+            current[0] += first_text
+            for included_line in included[1:]:
+                lines.append(tuple(current))
+                current = list(included_line)
+            pos = match.end()
+        current[0] += line[pos:]
+        lines.append(tuple(current))
+    return lines
+
+def expand_partials(content, _stack=()):
+    """
+    Replace every {{> name}} include with partials/<name>.tex, recursively.
+    Returns (expanded content, list of every partial used, nested ones included).
+    """
+    used = []
+    lines = expand_partial_lines(content, "template", used, _stack)
+    return "\n".join(text for text, _, _ in lines), used
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Hex SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def template_cache_dir(template_name):
+    return os.path.join(TEMPLATE_CACHE_DIR, template_name)
+
+def load_template_source(template_name, template_path, record=True):
+    """
+    Return the template with its partials expanded.
+    The expansion is cached per template and reused while it is newer than
+    the template and every partial it depends on. With record=False (drafts)
+    a stale cache is neither rewritten nor recorded in template_deps.csv;
+    the next real compile does both.
+    """
+    cache_path = os.path.join(template_cache_dir(template_name), "expanded.tex")
+    try:
+        cached_mtime = os.path.getmtime(cache_path)
+        sources = [template_path] + [partial_path(name) for name in load_template_dependencies().get(template_name, {})]
+        if all(os.path.getmtime(path) <= cached_mtime for path in sources):
+            with open(cache_path, "r") as f:
+                return f.read()
+    except OSError:
+        pass
+
+    with open(template_path, "r") as f:
+        expanded, used = expand_partials(f.read())
+    if not record:
+        return expanded
+    record_template_dependencies(template_name, used, keep_hashes=True)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with open(cache_path, "w") as f:
+        f.write(expanded)
+    return expanded
+
+def load_template_dependencies(csv_file=TEMPLATE_DEPS_CSV):
+    """Return {template name: {partial name: partial hash at last build}}."""
+    graph = {}
+    _, rows = read_registry(csv_file)
+    for row in rows:
+        graph.setdefault(row["Template Type Name"], {})[row["Partial Name"]] = row["Partial Hash"]
+    return graph
+
+def record_template_dependencies(template_name, partials, keep_hashes=False, csv_file=TEMPLATE_DEPS_CSV):
+    """
+    Store which partials a template uses, with each partial's current hash.
+    The hash marks the version its documents were built with, so keep_hashes
+    (used when only the cached expansion is refreshed) leaves the recorded
+    hash of already-known partials alone until a rebuild has run.
+    """
+    with RegistryLock(csv_file):
+        _, rows = read_registry(csv_file)
+        current = {row["Partial Name"]: row["Partial Hash"] for row in rows
+                   if row["Template Type Name"] == template_name}
+        new = {
+            name: current[name] if keep_hashes and name in current else file_sha256(partial_path(name))
+            for name in partials
+        }
+        if current == new and os.path.exists(csv_file):
+            return
+        rows = [row for row in rows if row["Template Type Name"] != template_name]
+        rows.extend({"Template Type Name": template_name, "Partial Name": name, "Partial Hash": digest}
+                    for name, digest in new.items())
+        rewrite_csv(csv_file, TEMPLATE_DEPS_HEADERS, rows)
+
+def find_changed_partials():
+    """Names of partials whose content differs from the hash recorded at the last build."""
+    changed = set()
+    for deps in load_template_dependencies().values():
+        for name, recorded in deps.items():
+            if name in changed:
+                continue
+            path = partial_path(name)
+            if not os.path.exists(path) or file_sha256(path) != recorded:
+                changed.add(name)
+    return changed
+
+def templates_affected_by(partials):
+    """Templates that include any of the given partials, directly or through another partial."""
+    partials = set(partials)
+    return {template for template, deps in load_template_dependencies().items() if partials & set(deps)}
+
+def invalidate_template_artifacts(template_names):
+    """Drop the cached compiled artifacts of just these templates."""
+    for template_name in template_names:
+        shutil.rmtree(template_cache_dir(template_name), ignore_errors=True)
+
 def validate_latex(content, placeholders):
     """
     Validate LaTeX structure and ensure placeholders are present.
@@ -106,14 +381,12 @@ def add_csv_entry(index, name, desc, template_path):
         template_path
     ]
     
-    with open(TEMPLATES_CSV, 'a', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(new_row)
+    append_registry_rows(TEMPLATES_CSV, TEMPLATE_HEADERS, [new_row])
 
-def generate_document_id(template_type,template_index, csv_path, custom_format=None):
+def iter_document_ids(template_index, *taken_ids, custom_format=None, max_seq=None):
     """
-    Generate document ID from a tokenized format string.
-    Supported tokens: {TEMPLATE}, {YYMMDD}, {DDMMYYYY}, {YYYYMMDD}, {seq}
+    Yield unused document IDs in {seq} order, skipping any in one of the
+    taken_ids sets (passed separately, so large ones are never copied to merge them).
     """
     now = datetime.now()
     token_map = {
@@ -130,28 +403,110 @@ def generate_document_id(template_type,template_index, csv_path, custom_format=N
         "{DD}": now.strftime("%d"),
     }
 
+    if not custom_format:
+        # fallback format
+        custom_format = "{TEMPLATE}-{YYYYMMDD}-{seq}"
+
+    base_id = custom_format
+    for key, val in token_map.items():
+        base_id = base_id.replace(key, val)
+
+    i = 1
+    while max_seq is None or i <= max_seq:
+        doc_id = base_id.replace("{seq}", f"{i:02d}")
+        if not any(doc_id in ids for ids in taken_ids):
+            yield doc_id
+        i += 1
+
+def load_document_ids(csv_path=DOCUMENTS_CSV):
+    """Return the set of document IDs already registered in documents.csv."""
     existing_ids = set()
     if os.path.exists(csv_path):
         with open(csv_path, newline='') as f:
             reader = csv.DictReader(f)
             for row in reader:
                 existing_ids.add(row["Document Index Number"])
+    return existing_ids
 
-    if not custom_format:
-        # fallback format
-        custom_format = "{TEMPLATE}-{YYYYMMDD}-{seq}"
-
-    for i in range(1, 1000):
-        seq_str = f"{i:02d}"
-        doc_id = custom_format
-        for key, val in token_map.items():
-            doc_id = doc_id.replace(key, val)
-        doc_id = doc_id.replace("{seq}", seq_str)
-
-        if doc_id not in existing_ids:
-            return doc_id
+def generate_document_id(template_type,template_index, custom_format=None):
+    """
+    Generate document ID from a tokenized format string.
+    Supported tokens: {TEMPLATE}, {YYMMDD}, {DDMMYYYY}, {YYYYMMDD}, {seq}
+    The ID stays reserved for this process until it is registered or released.
+    """
+    return reserve_document_ids(template_index, process_holder(), [None], custom_format, max_seq=999)[0]
+
+def process_holder():
+    """Reservation holder for the documents this process generates one at a time."""
+    return f"pid:{socket.gethostname()}:{os.getpid()}"
+
+def reservation_stale(holder):
+    """A reservation whose holder can no longer register it: its process or batch is gone."""
+    kind, _, rest = holder.partition(":")
+    if kind == "pid":
+        host, _, pid = rest.rpartition(":")
+        return not owner_alive(int(pid), host)
+    if kind == "batch":
+        # Its journal was discarded, or the batch was abandoned
+        try:
+            return time.time() - os.path.getmtime(os.path.join(BATCH_JOURNAL_DIR, rest)) > BATCH_ABANDON_DAYS * 86400
+        except OSError:
+            return True
+    return False
 
-    raise ValueError("Exceeded max document ID attempts.")
+def reserve_document_ids(template_index, holder, wanted, custom_format=None, max_seq=None):
+    """
+    Reserve one document ID per entry of wanted for holder in reserved_ids.csv.
+    IDs are picked under the documents.csv lock, against the registered IDs
+    and every live reservation, so no two generates, merges or sweeps, in
+    this or another instance, get the same one. An entry of wanted that
+    holder already reserved, or that is still free, is kept; None (or an ID
+    taken meanwhile) gets the next free ID. Returns the IDs.
+    """
+    with RegistryLock(DOCUMENTS_CSV), RegistryLock(RESERVED_IDS_CSV):
+        _, rows = read_registry(RESERVED_IDS_CSV)
+        stale = {holder: reservation_stale(holder) for holder in {row["Holder"] for row in rows}}
+        live = [row for row in rows if not stale[row["Holder"]]]
+        held = {row["Document Index Number"]: row["Holder"] for row in live}
+        document_id_catalog.refresh()
+        registered, picked = document_id_catalog.ids, set()
+        id_source = iter_document_ids(template_index, registered, held, picked,
+                                      custom_format=custom_format, max_seq=max_seq)
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        doc_ids, new_rows = [], []
+        for doc_id in wanted:
+            if doc_id and held.get(doc_id) == holder:
+                doc_ids.append(doc_id)
+                continue
+            if not doc_id or doc_id in registered or doc_id in held or doc_id in picked:
+                doc_id = next(id_source, None)
+                if doc_id is None:
+                    raise ValueError("Exceeded max document ID attempts.")
+            picked.add(doc_id)
+            doc_ids.append(doc_id)
+            new_rows.append([doc_id, holder, now])
+        if len(live) < len(rows):
+            rewrite_csv(RESERVED_IDS_CSV, RESERVED_IDS_HEADERS,
+                        live + [dict(zip(RESERVED_IDS_HEADERS, row)) for row in new_rows])
+        else:
+            append_registry_rows(RESERVED_IDS_CSV, RESERVED_IDS_HEADERS, new_rows)
+    return doc_ids
+
+def live_reserved_ids():
+    """IDs reserved by a generate, merge or sweep that may still register them."""
+    _, rows = read_registry(RESERVED_IDS_CSV)
+    stale = {holder: reservation_stale(holder) for holder in {row["Holder"] for row in rows}}
+    return {row["Document Index Number"] for row in rows if not stale[row["Holder"]]}
+
+def release_document_ids(doc_ids):
+    """Give reserved IDs back, once registered or when their document was not generated."""
+    doc_ids = set(doc_ids)
+    if doc_ids and os.path.exists(RESERVED_IDS_CSV):
+        with RegistryLock(RESERVED_IDS_CSV):
+            _, rows = read_registry(RESERVED_IDS_CSV)
+            if any(row["Document Index Number"] in doc_ids for row in rows):
+                rewrite_csv(RESERVED_IDS_CSV, RESERVED_IDS_HEADERS,
+                            [row for row in rows if row["Document Index Number"] not in doc_ids])
 
 def acronymize(name):
     words = name.strip().split()
@@ -163,61 +518,3228 @@ def acronymize(name):
         # Multi-word → acronym (first letters)
         return ''.join(word[0] for word in words).upper()
 
-def validate_custom_id_format(fmt):
+def validate_custom_id_format(fmt):
+    """
+    Validates that the custom format:
+    - Uses only supported tokens
+    - Contains {seq}
+    """
+    allowed_tokens = {
+        "{TEMPLATE}", "{seq}",
+        "{YYYY}", "{YY}", "{MM}", "{DD}",
+        "{YYYYMMDD}", "{DDMMYYYY}", "{YYMMDD}"," {DDMMYY}","{YYYYMM}","{YYMM}"
+    }
+
+    used_tokens = set(re.findall(r"\{[A-Z]+\}", fmt))
+    unknown = used_tokens - allowed_tokens
+
+    if unknown:
+        raise ValueError(f"Invalid token(s) in format: {', '.join(unknown)}")
+
+    if "{seq}" not in fmt:
+        raise ValueError("Format must include the {seq} token to ensure uniqueness.")
+    
+    if "{TEMPLATE}" not in fmt:
+        raise ValueError("Format must include the {TEMPLATE} token.")
+    
+def generate_unique_template_index(name, csv_file=TEMPLATES_CSV):
+    """
+    Generate a unique abbreviation (acronym or prefix) for the template.
+    Avoids duplication with existing entries in templates.csv.
+    """
+    # Step 1: Load existing index codes
+    existing = set()
+    if os.path.exists(csv_file):
+        with open(csv_file, newline="") as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                existing.add(row["Template Index"])
+
+    # Step 2: Start with acronym logic
+    words = name.strip().split()
+    print(words)
+    if len(words) == 1:
+        base_code = words[0][:3].upper()
+    else:
+        base_code = ''.join(word[0] for word in words).upper()
+
+    # Step 3: Check for uniqueness
+    code = base_code
+    suffix = 2
+    while code in existing:
+        code = f"{base_code}{suffix}"
+        suffix += 1
+
+    return code
+
+
+def storage_path(base_dir, filename, template_index="", doc_id="", when=None, layout=None):
+    """
+    Return where a generated file lives under base_dir for the given storage layout.
+      flat     -> base_dir/filename
+      template -> base_dir/<template index>/filename
+      month    -> base_dir/<YYYY>/<MM>/filename
+      hash     -> base_dir/<ab>/<cd>/filename, from a hash of the document ID
+    """
+    layout = layout or STORAGE_LAYOUT
+    if layout not in STORAGE_LAYOUTS:
+        raise ValueError(f"Unknown storage layout '{layout}' (use one of: {', '.join(STORAGE_LAYOUTS)})")
+
+    if layout == "template":
+        return os.path.join(base_dir, template_index or "unknown", filename)
+    if layout == "month":
+        when = when or datetime.now()
+        return os.path.join(base_dir, when.strftime("%Y"), when.strftime("%m"), filename)
+    if layout == "hash":
+        digest = hashlib.sha1((doc_id or filename).encode("utf-8")).hexdigest()
+        return os.path.join(base_dir, digest[:2], digest[2:4], filename)
+    return os.path.join(base_dir, filename)
+
+def document_paths(doc_id, template_name, template_index, when=None, layout=None):
+    """Return the (parameter file, PDF) paths for a document under the storage layout."""
+    param_file_path = storage_path(DATA_DIR, f"{template_name}_{doc_id}.txt",
+                                   template_index, doc_id, when, layout)
+    pdf_path = storage_path(DOCUMENTS_DIR, f"{doc_id}.pdf", template_index, doc_id, when, layout)
+    return param_file_path, pdf_path
+
+def load_template_paths(csv_file=TEMPLATES_CSV):
+    """Map template names to their .tex paths (safe to call off the Tk thread)."""
+    _, rows = read_registry(csv_file)
+    return {row["Template Type Name"]: row["Path to Template File"] for row in rows}
+
+def load_template_indices(csv_file=TEMPLATES_CSV):
+    """Map template names to their template index codes."""
+    indices = {}
+    if os.path.exists(csv_file):
+        with open(csv_file, newline="") as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                indices[row["Template Type Name"]] = row["Template Index"]
+    return indices
+
+def read_parameter_file(param_file_path):
+    """Load a key = value parameter file (loose or archived) back into a dict."""
+    parameters = {}
+    text = read_stored_bytes(param_file_path).decode("utf-8", errors="replace")
+    for line in text.splitlines():
+        if "=" in line:
+            key, val = line.split("=", 1)
+            parameters[key.strip()] = val.strip()
+    return parameters
+
+def acquire_file_lock(lock_path, timeout):
+    """Open and exclusively lock lock_path, retrying until timeout; returns the open file."""
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    f = open(lock_path, "a+b")
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return f
+        except OSError:
+            if time.monotonic() >= deadline:
+                f.close()
+                raise TimeoutError(f"'{lock_path}' is held by another LaxDoc instance; try again shortly.")
+            time.sleep(0.05)
+
+def release_file_lock(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    f.close()
+
+
+class RegistryLock:
+    """
+    Exclusive lock on one registry CSV, shared by every LaxDoc process and
+    thread using the folder (a <csv>.lock file locked with flock/msvcrt), and
+    re-entrant within a thread. Whoever takes the lock first completes any
+    write a crashed instance left in the registry's journal.
+    """
+    _states = {}
+    _guard = threading.Lock()
+
+    def __init__(self, csv_file, timeout=REGISTRY_LOCK_TIMEOUT):
+        self.csv_file = csv_file
+        self.timeout = timeout
+        with RegistryLock._guard:
+            self._state = RegistryLock._states.setdefault(
+                os.path.abspath(csv_file), {"lock": threading.RLock(), "depth": 0, "file": None})
+
+    def __enter__(self):
+        state = self._state
+        if not state["lock"].acquire(timeout=self.timeout):
+            raise TimeoutError(f"'{self.csv_file}' is busy; try again shortly.")
+        if state["depth"] == 0:
+            try:
+                state["file"] = acquire_file_lock(f"{self.csv_file}.lock", self.timeout)
+                replay_registry_journal(self.csv_file)
+            except BaseException:
+                if state["file"] is not None:
+                    release_file_lock(state["file"])
+                    state["file"] = None
+                state["lock"].release()
+                raise
+        state["depth"] += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        state = self._state
+        state["depth"] -= 1
+        if state["depth"] == 0:
+            release_file_lock(state["file"])
+            state["file"] = None
+        state["lock"].release()
+
+
+def journal_path(csv_file):
+    return f"{csv_file}.journal"
+
+def write_journal(csv_file, entry):
+    """Durably record the write about to be made to csv_file."""
+    path = journal_path(csv_file)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(entry, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{path}.tmp", path)
+
+def apply_append(csv_file, size, headers, rows):
+    """
+    Append rows at byte offset size, first cutting off anything beyond it
+    (a torn earlier attempt), so that replaying an append is idempotent.
+    """
+    if os.path.exists(csv_file):
+        os.truncate(csv_file, size)
+    with open(csv_file, "a", newline="") as f:
+        writer = csv.writer(f)
+        if size == 0:
+            writer.writerow(headers)
+        writer.writerows(rows)
+        f.flush()
+        os.fsync(f.fileno())
+
+def replay_registry_journal(csv_file):
+    """Finish (or discard) a write interrupted by a crash. Call with the registry lock held."""
+    path = journal_path(csv_file)
+    if os.path.exists(path):
+        with open(path) as f:
+            entry = json.load(f)
+        if entry["op"] == "append":
+            apply_append(csv_file, entry["size"], entry["headers"], entry["rows"])
+        elif entry["op"] == "replace" and os.path.exists(entry["tmp"]):
+            os.replace(entry["tmp"], csv_file)
+        os.remove(path)
+    # Temporary files of writes that crashed before reaching the journal
+    for leftover in (f"{csv_file}.tmp", f"{path}.tmp"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+
+def append_registry_rows(csv_file, headers, rows):
+    """
+    Append rows (lists of values) to a registry under its lock, creating it
+    with headers if needed. The rows are journaled first, so a writer that
+    dies mid-append leaves neither a torn row nor a lost one.
+    """
+    rows = [["" if value is None else str(value) for value in row] for row in rows]
+    if not rows:
+        return
+    with RegistryLock(csv_file):
+        size = os.path.getsize(csv_file) if os.path.exists(csv_file) else 0
+        write_journal(csv_file, {"op": "append", "size": size, "headers": headers, "rows": rows})
+        apply_append(csv_file, size, headers, rows)
+        os.remove(journal_path(csv_file))
+
+def rewrite_csv(csv_file, fieldnames, rows):
+    """
+    Replace a registry CSV with the given rows via a temporary file and
+    rename, journaled and under the registry lock. Callers that read the
+    rows first should hold the lock across both (see update_registry).
+    """
+    with RegistryLock(csv_file):
+        tmp_path = f"{csv_file}.tmp"
+        with open(tmp_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+            f.flush()
+            os.fsync(f.fileno())
+        write_journal(csv_file, {"op": "replace", "tmp": tmp_path})
+        os.replace(tmp_path, csv_file)
+        os.remove(journal_path(csv_file))
+
+def update_registry(csv_file, change):
+    """
+    Read-modify-write a registry under its lock, so rows other instances
+    appended or removed since the caller last looked are not lost.
+    change(rows) returns the new rows. Returns (rows before, rows after).
+    """
+    with RegistryLock(csv_file):
+        fieldnames, rows = read_registry(csv_file)
+        if fieldnames is None:
+            return [], []
+        updated = change(rows)
+        rewrite_csv(csv_file, fieldnames, updated)
+    return rows, updated
+
+def apply_row_updates(csv_file, key, updates):
+    """Replace the rows whose key column is in updates ({key: new row}), keeping all others."""
+    if updates:
+        update_registry(csv_file, lambda rows: [updates.get(row[key], row) for row in rows])
+
+def move_into_layout(current_path, target_path):
+    """
+    Move one file to its sharded location and return the path that now holds it.
+    A file already at the target (an interrupted earlier run) counts as moved.
+    """
+    if not current_path or os.path.normcase(current_path) == os.path.normcase(target_path):
+        return current_path
+    if os.path.exists(current_path):
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        shutil.move(current_path, target_path)
+        return target_path
+    if os.path.exists(target_path):
+        return target_path
+    return current_path
+
+def migrate_storage_layout(layout, csv_file=DOCUMENTS_CSV, checkpoint_rows=MIGRATION_CHECKPOINT_ROWS):
+    """
+    Move existing PDFs and parameter files into the given layout and repoint documents.csv.
+    A file several rows share is moved once, with its first row, and all
+    of them are repointed together. The registry is rewritten every
+    checkpoint_rows rows, and files already at their target are recognised,
+    so an interrupted migration can simply be rerun.
+    Returns the number of rows whose paths changed.
+    """
+    if layout not in STORAGE_LAYOUTS:
+        raise ValueError(f"Unknown storage layout '{layout}' (use one of: {', '.join(STORAGE_LAYOUTS)})")
+    if not os.path.exists(csv_file):
+        return 0
+
+    _, rows = read_registry(csv_file)
+
+    path_keys = (("Path to Parameter File", DATA_DIR), ("Path to Generated PDF", DOCUMENTS_DIR))
+    users = defaultdict(list)  # normalized path -> (row, column) pairs referencing it
+    for row in rows:
+        for path_key, _ in path_keys:
+            if row[path_key]:
+                users[normalize_path(row[path_key])].append((row, path_key))
+
+    template_indices = load_template_indices()
+    changed = set()
+    pending = {}
+    for row in rows:
+        doc_id = row["Document Index Number"]
+        template_name = row["Template Type Name"]
+        template_index = template_indices.get(template_name) or doc_id.split("-")[0]
+        try:
+            when = datetime.strptime(row["Date of Generation"], "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            when = None
+
+        for path_key, directory in path_keys:
+            old_path = row[path_key]
+            sharing = users.pop(normalize_path(old_path), None) if old_path else None
+            if sharing is None:
+                continue  # empty, or already moved with an earlier row
+            target = storage_path(directory, os.path.basename(old_path), template_index, doc_id, when, layout)
+            new_path = move_into_layout(old_path, target)
+            for other, other_key in sharing:
+                if other[other_key] != new_path:
+                    other[other_key] = new_path
+                    changed.add(other["Document Index Number"])
+                    pending[other["Document Index Number"]] = other
+
+        if len(pending) >= checkpoint_rows:
+            # Only moved rows are written back; rows added meanwhile are kept
+            apply_row_updates(csv_file, "Document Index Number", pending)
+            print(f"Checkpoint: {len(changed)} documents moved.")
+            pending = {}
+
+    apply_row_updates(csv_file, "Document Index Number", pending)
+    return len(changed)
+
+def normalize_path(path):
+    """Comparable form of a registry or on-disk path."""
+    return os.path.normcase(os.path.normpath(path)) if path else ""
+
+def scan_tree_parallel(root, executor):
+    """
+    List every file below root, scanning each directory as its own task so
+    sharded trees are walked in parallel. Returns normalized relative paths.
+    """
+    def scan(directory):
+        files, subdirs = [], []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    else:
+                        files.append(normalize_path(entry.path))
+        except OSError:
+            pass
+        return files, subdirs
+
+    found = set()
+    if not os.path.isdir(root):
+        return found
+
+    pending = {executor.submit(scan, root)}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            files, subdirs = future.result()
+            found.update(files)
+            pending.update(executor.submit(scan, subdir) for subdir in subdirs)
+    return found
+
+def read_registry(csv_file):
+    """Return (fieldnames, rows) of a registry CSV, or (None, []) if it is missing."""
+    if not os.path.exists(csv_file):
+        return None, []
+    with open(csv_file, newline="") as f:
+        reader = csv.DictReader(f)
+        return reader.fieldnames, list(reader)
+
+def scan_registry_drift(workers=RECONCILE_WORKERS):
+    """
+    Compare documents.csv and templates.csv with the files on disk.
+    The registries and the documents/, data/ and templates/ trees are all read
+    concurrently. Returns a dict of findings, each a list of rows or paths.
+    """
+    # "readers" parse the registries and coordinate each tree walk, while the
+    # walks fan their per-directory scans out over "scanners".
+    with ThreadPoolExecutor(max_workers=workers) as scanners, ThreadPoolExecutor(max_workers=5) as readers:
+        documents_future = readers.submit(read_registry, DOCUMENTS_CSV)
+        templates_future = readers.submit(read_registry, TEMPLATES_CSV)
+        document_files = readers.submit(scan_tree_parallel, DOCUMENTS_DIR, scanners)
+        data_files = readers.submit(scan_tree_parallel, DATA_DIR, scanners)
+        template_files = readers.submit(scan_tree_parallel, TEMPLATE_FOLDER, scanners)
+
+        _, documents = documents_future.result()
+        _, templates = templates_future.result()
+        document_files = document_files.result()
+        data_files = data_files.result()
+        template_files = template_files.result()
+
+    template_names = {row["Template Type Name"] for row in templates}
+    referenced = set()
+    report = {
+        "missing_pdf": [],
+        "missing_params": [],
+        "missing_template": [],
+        "template_file_missing": [],
+        "orphan_pdfs": [],
+        "orphan_params": [],
+        "byproducts": [],
+    }
+
+    for row in documents:
+        pdf_path = normalize_path(row["Path to Generated PDF"])
+        param_path = normalize_path(row["Path to Parameter File"])
+        referenced.update((pdf_path, param_path))
+        if pdf_path not in document_files and not stored_file_exists(row["Path to Generated PDF"]):
+            report["missing_pdf"].append(row)
+        if param_path and param_path not in data_files and not stored_file_exists(row["Path to Parameter File"]):
+            report["missing_params"].append(row)
+        if row["Template Type Name"] not in template_names:
+            report["missing_template"].append(row)
+
+    for row in templates:
+        if normalize_path(row["Path to Template File"]) not in template_files:
+            report["template_file_missing"].append(row)
+
+    for path in sorted(document_files - referenced):
+        name = os.path.basename(path)
+        if name.endswith(LATEX_BYPRODUCT_EXTENSIONS):
+            report["byproducts"].append(path)
+        elif name.endswith(".pdf") and not name.upper().startswith("MERGE-"):
+            # MERGE-* files are unregistered print runs, not orphans
+            report["orphan_pdfs"].append(path)
+    report["orphan_params"] = sorted(data_files - referenced)
+    return report
+
+def fix_registry_drift(report, remove_dead_rows=False, purge_byproducts=False, reregister_orphans=False):
+    """
+    Repair the findings of scan_registry_drift().
+      remove_dead_rows   -> drop document rows whose PDF and parameter file are
+                            both gone, and template rows whose .tex is gone
+      purge_byproducts   -> delete leftover .aux/.log/... files in documents/
+      reregister_orphans -> add a documents.csv row for every unregistered PDF
+                            whose template is known and whose unregistered
+                            parameter file (<template>_<ID>.txt) is found;
+                            the others could never be rebuilt and are left,
+                            as are IDs still reserved by a running generate
+    Returns a dict of how many items each step changed.
+    """
+    changes = {"rows_removed": 0, "byproducts_purged": 0, "pdfs_reregistered": 0, "orphans_left": 0}
+
+    if remove_dead_rows:
+        missing_params = {row["Document Index Number"] for row in report["missing_params"]}
+        dead_documents = {row["Document Index Number"] for row in report["missing_pdf"]
+                          if row["Document Index Number"] in missing_params}
+        if dead_documents:
+            rows, kept = update_registry(DOCUMENTS_CSV, lambda rows: [
+                row for row in rows if row["Document Index Number"] not in dead_documents])
+            changes["rows_removed"] += len(rows) - len(kept)
+
+        dead_templates = {row["Template Type Name"] for row in report["template_file_missing"]}
+        if dead_templates:
+            rows, kept = update_registry(TEMPLATES_CSV, lambda rows: [
+                row for row in rows if row["Template Type Name"] not in dead_templates])
+            changes["rows_removed"] += len(rows) - len(kept)
+
+    if purge_byproducts:
+        for path in report["byproducts"]:
+            try:
+                os.remove(path)
+                changes["byproducts_purged"] += 1
+            except OSError as e:
+                print(f"Could not remove {path}: {e}")
+
+    if reregister_orphans and report["orphan_pdfs"]:
+        names_by_index = {index: name for name, index in load_template_indices().items()}
+        params_by_name = {os.path.basename(path): path for path in report["orphan_params"]}
+        # Under the lock a generate registers (and unreserves) under, so an
+        # orphan whose ID is not reserved now is not about to be registered
+        with RegistryLock(DOCUMENTS_CSV):
+            reserved = live_reserved_ids()
+            document_id_catalog.refresh()
+            entries, seen = [], set()
+            for path in report["orphan_pdfs"]:
+                doc_id = os.path.splitext(os.path.basename(path))[0]
+                template_name = names_by_index.get(doc_id.split("-")[0])
+                param_path = template_name and params_by_name.get(os.path.normcase(f"{template_name}_{doc_id}.txt"))
+                if (not param_path or doc_id in reserved or doc_id in seen
+                        or doc_id in document_id_catalog.ids):
+                    changes["orphans_left"] += 1
+                    continue
+                seen.add(doc_id)
+                generated_at = datetime.fromtimestamp(os.path.getmtime(path))
+                entries.append((doc_id, template_name, "Recovered by reconcile", param_path, path, generated_at))
+            add_document_entries(entries)
+        changes["pdfs_reregistered"] = len(entries)
+
+    return changes
+
+def document_matches(row, filters):
+    """
+    Test a documents.csv row against search filters. The index, type, date and
+    desc filters match substrings (as in the search view); template matches the
+    template name exactly; date_from/date_to bound the generation date inclusively.
+    """
+    idx = (filters.get("index") or "").strip().lower()
+    typ = (filters.get("type") or "").strip().lower()
+    date = (filters.get("date") or "").strip()
+    desc = (filters.get("desc") or "").strip().lower()
+    template = filters.get("template")
+    generated_on = row["Date of Generation"][:10]
+
+    return all([
+        (not idx or idx in row["Document Index Number"].lower()),
+        (not typ or typ in row["Template Type Name"].lower()),
+        (not date or date in row["Date of Generation"]),
+        (not desc or desc in row["Short Description"].lower()),
+        (not template or template == row["Template Type Name"]),
+        (not filters.get("date_from") or generated_on >= filters["date_from"]),
+        (not filters.get("date_to") or generated_on <= filters["date_to"]),
+    ])
+
+def iter_matching_documents(filters, csv_file=DOCUMENTS_CSV):
+    """Stream the documents.csv rows that match filters, one at a time."""
+    if not os.path.exists(csv_file):
+        return
+    with open(csv_file, newline="") as f:
+        for row in csv.DictReader(f):
+            if document_matches(row, filters):
+                yield row
+
+def add_stored_file_to_zip(bundle, path, arcname):
+    """Stream one loose or archived file into an open ZIP without loading it whole."""
+    if is_packed(path):
+        with bundle.open(arcname, "w", force_zip64=True) as dst:
+            for chunk in iter_packed_member(path):
+                dst.write(chunk)
+    else:
+        bundle.write(path, arcname)
+
+def export_documents(filters, output, fmt="csv", bundle_path=None, progress=None):
+    """
+    Stream matching document rows to output (a path, or a text stream such as
+    stdout) as CSV or JSON Lines. With bundle_path the PDFs and parameter files
+    are also written, one at a time, into a ZIP together with the row listing
+    (when output is a stream, a temporary copy of the listing is kept for
+    that). Memory use does not depend on the number of matches.
+    Returns (rows exported, files bundled, files missing).
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}' (use one of: {', '.join(EXPORT_FORMATS)})")
+
+    exported = bundled = missing = 0
+    out = open(output, "w", newline="", encoding="utf-8") if isinstance(output, str) else output
+    bundle = zipfile.ZipFile(bundle_path, "w", zipfile.ZIP_DEFLATED, allowZip64=True) if bundle_path else None
+    # A ZIP takes one member at a time, so a listing sent to a stream is copied and added last
+    listing_copy = None
+    if bundle is not None and out is output:
+        listing_copy = tempfile.TemporaryFile("w+", newline="", encoding="utf-8")
+    targets = [out] if listing_copy is None else [out, listing_copy]
+    try:
+        writers = None
+        for row in iter_matching_documents(filters):
+            if fmt == "csv":
+                if writers is None:
+                    writers = [csv.DictWriter(target, fieldnames=list(row)) for target in targets]
+                    for writer in writers:
+                        writer.writeheader()
+                for writer in writers:
+                    writer.writerow(row)
+            else:
+                line = json.dumps(row, ensure_ascii=False) + "\n"
+                for target in targets:
+                    target.write(line)
+
+            if bundle is not None:
+                for path_key, folder in (("Path to Generated PDF", "pdf"), ("Path to Parameter File", "parameters")):
+                    path = row[path_key]
+                    if not stored_file_exists(path):
+                        missing += 1
+                        continue
+                    name = os.path.basename(packed_member(path) if is_packed(path) else path)
+                    add_stored_file_to_zip(bundle, path, f"{folder}/{row['Document Index Number']}/{name}")
+                    bundled += 1
+
+            exported += 1
+            if progress and exported % EXPORT_PROGRESS_EVERY == 0:
+                progress(exported)
+
+        out.flush()
+        if listing_copy is not None:
+            listing_copy.seek(0)
+            with bundle.open(f"documents.{fmt}", "w", force_zip64=True) as member, \
+                    io.TextIOWrapper(member, encoding="utf-8", newline="") as listing:
+                shutil.copyfileobj(listing_copy, listing)
+        elif bundle is not None:
+            bundle.write(output, f"documents.{fmt}")
+    finally:
+        if out is not output:
+            out.close()
+        if listing_copy is not None:
+            listing_copy.close()
+        if bundle is not None:
+            bundle.close()
+
+    if progress:
+        progress(exported)
+    return exported, bundled, missing
+
+def fill_placeholders(content, parameters):
+    """Replace every {{name}} placeholder in content with its parameter value."""
+    for ph, value in parameters.items():
+        content = content.replace(f"{{{{{ph}}}}}", value)
+    return content
+
+def write_parameter_file(param_file_path, parameters):
+    """
+    Save the key = value parameter file used for regeneration.
+    Identical parameter sets are stored once; returns the path the registry
+    should record (see store_deduplicated).
+    """
+    text = "".join(f"{key} = {value}\n" for key, value in parameters.items())
+
+    def write(path):
+        with open(path, "w") as param_file:
+            param_file.write(text)
+
+    return store_deduplicated("params", text_sha256(text), param_file_path, write)
+
+def text_sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def render_key(content):
+    """Hash identifying a rendered document: its final LaTeX source (plus the date if it prints one)."""
+    if any(macro in content for macro in DATE_DEPENDENT_MACROS):
+        content = f"{datetime.now():%Y-%m-%d}\n{content}"
+    return text_sha256(content)
+
+def find_identical(kind, digest):
+    """Path of a loose file already holding this content, or None."""
+    path = content_catalog.lookup(kind, digest)
+    return path if path and os.path.exists(path) else None
+
+def link_or_reference(existing_path, new_path):
+    """
+    Make new_path share existing_path's bytes with a hard link. Where the
+    filesystem refuses, fall back to recording existing_path itself; deletes
+    then only remove a file once no registry row references it.
+    Returns the path the registry should record.
+    """
+    os.makedirs(os.path.dirname(new_path) or ".", exist_ok=True)
+    try:
+        if os.path.exists(new_path):
+            os.remove(new_path)
+        os.link(existing_path, new_path)
+        return new_path
+    except OSError:
+        return existing_path
+
+def store_deduplicated(kind, digest, path, write):
+    """Store content once: link to an identical existing file, or write(path) and remember it."""
+    existing = find_identical(kind, digest)
+    if existing and os.path.normcase(existing) != os.path.normcase(path):
+        return link_or_reference(existing, path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    write(path)
+    content_catalog.remember(kind, digest, path)
+    return path
+
+def find_duplicate_template(content):
+    """Return the registered (name, path) of a template with exactly this content, if any."""
+    digest = text_sha256(content)
+    if content_catalog.lookup("template", digest) is None:
+        # Templates imported before hashing existed are hashed on first use
+        for _, name, path in template_catalog.templates():
+            if os.path.exists(path) and content_catalog.lookup_path("template", path) is None:
+                with open(path, "r") as f:
+                    content_catalog.remember("template", text_sha256(f.read()), path)
+    existing = find_identical("template", digest)
+    if existing is None:
+        return None
+    names = [name for _, name, path in template_catalog.templates()
+             if os.path.normcase(path) == os.path.normcase(existing)]
+    return (names[0], existing) if names else None
+
+def count_path_references(rows, path_key, path):
+    """How many registry rows point at path (shared files are reference counted)."""
+    path = normalize_path(path)
+    return sum(1 for row in rows if normalize_path(row.get(path_key)) == path)
+
+def delete_registry_row(csv_file, key, value, path_keys):
+    """
+    Remove the row whose key column equals value, then each of its files
+    (path_keys columns) that no remaining row references. The count, the
+    rewrite and the unlinks all happen under the registry's lock, so no
+    other instance can register a row sharing a file in between.
+    Returns the removed row, or None if it was already gone.
+    """
+    with RegistryLock(csv_file):
+        before, after = update_registry(csv_file, lambda rows: [row for row in rows if row[key] != value])
+        removed = next((row for row in before if row[key] == value), None)
+        if removed is None:
+            return None
+        for path_key in path_keys:
+            path = removed.get(path_key)
+            if path and os.path.exists(path) and count_path_references(after, path_key, path) == 0:
+                os.remove(path)
+                existence_cache.invalidate(path)
+    return removed
+
+class LatexLogParser:
+    """
+    Streaming parser for pdflatex terminal output. Feed it one line at a time;
+    each error is returned as a dict (file, line, message, context) as soon as
+    it is complete. Handles both -file-line-error ("file.tex:12: msg") and
+    classic ("! msg" ... "l.12 context") reports.
+    """
+    FILE_LINE_ERROR = re.compile(r'^(.*?\.(?:tex|sty|cls|def)):(\d+): (.*)$')
+    CLASSIC_ERROR = re.compile(r'^! (.*)$')
+    CONTEXT = re.compile(r'^l\.(\d+) ?(.*)$')
+
+    def __init__(self):
+        self.errors = []
+        self._pending = None
+
+    def feed(self, line):
+        line = line.rstrip("\r\n")
+        match = self.FILE_LINE_ERROR.match(line)
+        if match:
+            completed = self._flush()
+            self._pending = {"file": match.group(1), "line": int(match.group(2)),
+                             "message": match.group(3), "context": ""}
+            return completed
+        match = self.CLASSIC_ERROR.match(line)
+        if match:
+            completed = self._flush()
+            self._pending = {"file": None, "line": None, "message": match.group(1), "context": ""}
+            return completed
+        match = self.CONTEXT.match(line)
+        if match and self._pending is not None:
+            if self._pending["line"] is None:
+                self._pending["line"] = int(match.group(1))
+            self._pending["context"] = match.group(2)
+            return self._flush()
+        return None
+
+    def close(self):
+        return self._flush()
+
+    def _flush(self):
+        error, self._pending = self._pending, None
+        if error is not None:
+            self.errors.append(error)
+        return error
+
+
+class CompileResult(subprocess.CompletedProcess):
+    """
+    pdflatex outcome plus the structured errors parsed from its output.
+    outcome is one of ok, error, timeout, cancelled, cpu-limit, output-limit.
+    """
+
+    def __init__(self, args, returncode, stdout, errors, outcome="ok"):
+        super().__init__(args, returncode, stdout, "")
+        self.errors = errors
+        self.outcome = outcome
+
+
+class CompileJob:
+    """
+    One compile that can be cancelled while queued or running: in-process
+    with cancel(), or from another process (the CLI 'cancel' command) via a
+    jobs/<id>.cancel file. Every job has a jobs/<id>.job marker until it ends.
+    """
+    _ids = itertools.count(1)
+    _active = {}
+    _lock = threading.Lock()
+
+    def __init__(self, template_name="", label="compile", priority=PRIORITY_INTERACTIVE):
+        self.id = f"{os.getpid()}-{next(CompileJob._ids)}"
+        self.template_name = template_name
+        self.label = label
+        self.priority = priority
+        self.state = "queued"
+        self.process = None
+        self.created = time.monotonic()
+        self.queue_seconds = None
+        self._cancelled = threading.Event()
+        with CompileJob._lock:
+            CompileJob._active[self.id] = self
+        self._write_marker()
+
+    @classmethod
+    def active(cls):
+        with cls._lock:
+            return list(cls._active.values())
+
+    def _path(self, suffix):
+        return os.path.join(JOBS_DIR, f"{self.id}.{suffix}")
+
+    def _write_marker(self):
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        with open(self._path("job"), "w") as f:
+            json.dump({"id": self.id, "owner": os.getpid(), "host": socket.gethostname(), "state": self.state, "label": self.label,
+                       "priority": self.priority, "template": self.template_name, "since": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}, f)
+
+    def cancel(self):
+        self._cancelled.set()
+        if self.process is not None:
+            kill_process_tree(self.process)
+
+    def is_cancelled(self):
+        return self._cancelled.is_set() or os.path.exists(self._path("cancel"))
+
+    def wait_cancelled(self, timeout):
+        """Sleep up to timeout, waking early on an in-process cancel; returns is_cancelled()."""
+        self._cancelled.wait(timeout)
+        return self.is_cancelled()
+
+    def start(self, process=None):
+        self.process = process
+        self.state = "running"
+        self.queue_seconds = time.monotonic() - self.created
+        self._write_marker()
+
+    def finish(self, outcome):
+        if self.queue_seconds is None:
+            self.queue_seconds = time.monotonic() - self.created
+        self.state = outcome
+        self.process = None
+        with CompileJob._lock:
+            CompileJob._active.pop(self.id, None)
+        remove_job_files(self.id)
+
+
+class CompileScheduler:
+    """
+    Runs compile work on a fixed pool of worker threads, strictly by class:
+    interactive before batch before background. RESERVED_INTERACTIVE_WORKERS
+    are never given to the other classes, so a single document does not wait
+    behind a long batch. Within a class, tasks are taken round-robin by group
+    (one group per batch), so concurrent batches share the workers fairly;
+    a group can also be capped to `limit` concurrent tasks.
+    """
+
+    def __init__(self, workers=COMPILE_WORKERS, reserved=RESERVED_INTERACTIVE_WORKERS):
+        self.workers = workers
+        self.reserved = min(reserved, workers - 1)
+        self._cond = threading.Condition()
+        self._queues = {priority: OrderedDict() for priority in PRIORITY_CLASSES}
+        self._running = dict.fromkeys(PRIORITY_CLASSES, 0)
+        self._group_running = {}
+        self._group_limits = {}
+        self._threads = []
+
+    def submit(self, fn, *args, priority=PRIORITY_BATCH, group=None, limit=None, **kwargs):
+        """Queue fn(*args, **kwargs); returns a concurrent.futures.Future."""
+        future = Future()
+        key = (priority, group)
+        with self._cond:
+            if limit:
+                self._group_limits[key] = limit
+            self._queues[priority].setdefault(key, deque()).append((future, fn, args, kwargs))
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            self._cond.notify()
+        return future
+
+    def run(self, fn, *args, priority=PRIORITY_BATCH, group=None, **kwargs):
+        """Queue fn and wait for its result (for callers already off the UI thread)."""
+        return self.submit(fn, *args, priority=priority, group=group, **kwargs).result()
+
+    def queued(self):
+        """Number of queued tasks per class."""
+        with self._cond:
+            return {priority: sum(len(tasks) for tasks in groups.values())
+                    for priority, groups in self._queues.items()}
+
+    def _take(self):
+        """Next task this worker may run, or None. Called with the lock held."""
+        shared_busy = sum(count for priority, count in self._running.items() if priority != PRIORITY_INTERACTIVE)
+        for priority in PRIORITY_CLASSES:
+            if priority != PRIORITY_INTERACTIVE and shared_busy >= self.workers - self.reserved:
+                return None
+            groups = self._queues[priority]
+            for key in list(groups):
+                if self._group_running.get(key, 0) >= self._group_limits.get(key, self.workers):
+                    continue
+                tasks = groups[key]
+                task = tasks.popleft()
+                if tasks:
+                    groups.move_to_end(key)
+                else:
+                    del groups[key]
+                self._running[priority] += 1
+                self._group_running[key] = self._group_running.get(key, 0) + 1
+                return key, task
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                taken = self._take()
+                while taken is None:
+                    self._cond.wait()
+                    taken = self._take()
+            key, (future, fn, args, kwargs) = taken
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running[key[0]] -= 1
+                    self._group_running[key] -= 1
+                    if not self._group_running[key] and key not in self._queues[key[0]]:
+                        del self._group_running[key]
+                        self._group_limits.pop(key, None)
+                    self._cond.notify_all()
+
+
+compile_scheduler = CompileScheduler()
+
+
+def process_alive(pid):
+    """Whether a process with this PID is running on this machine."""
+    if os.name == "nt":
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return exit_code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # alive, owned by another user
+    return True
+
+def owner_alive(pid, host=None):
+    """
+    Whether the LaxDoc process that wrote a marker still runs. Processes on
+    other machines sharing the folder cannot be checked and count as alive.
+    """
+    if host and host != socket.gethostname():
+        return True
+    return process_alive(pid)
+
+def remove_job_files(job_id):
+    for suffix in ("job", "cancel"):
+        try:
+            os.remove(os.path.join(JOBS_DIR, f"{job_id}.{suffix}"))
+        except OSError:
+            pass
+
+def list_compile_jobs():
+    """
+    Queued and running jobs of every LaxDoc process sharing this workspace.
+    Markers left by a process that crashed or was killed are removed.
+    """
+    jobs = []
+    if not os.path.isdir(JOBS_DIR):
+        return jobs
+    for name in sorted(os.listdir(JOBS_DIR)):
+        if name.endswith(".job"):
+            try:
+                with open(os.path.join(JOBS_DIR, name)) as f:
+                    job = json.load(f)
+            except (OSError, ValueError):
+                continue  # finished while we were listing
+            if owner_alive(job["owner"], job.get("host")):
+                jobs.append(job)
+            else:
+                remove_job_files(job["id"])
+    return jobs
+
+def request_job_cancel(job_id):
+    """Ask the process that owns a job to cancel it; returns False for unknown or dead jobs."""
+    if not any(job["id"] == job_id for job in list_compile_jobs()):
+        return False
+    open(os.path.join(JOBS_DIR, f"{job_id}.cancel"), "w").close()
+    return True
+
+def kill_process_tree(process):
+    """Kill pdflatex and anything it spawned (it runs in its own process group)."""
+    if os.name == "nt":
+        subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], capture_output=True)
+        return
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+def apply_resource_limits(pid, cpu_limit):
+    """CPU, memory and file-size caps for a running compile, where the OS allows it."""
+    if resource is None or not hasattr(resource, "prlimit"):
+        return
+    limits = (
+        (resource.RLIMIT_CPU, cpu_limit),
+        (resource.RLIMIT_AS, COMPILE_MEMORY_LIMIT),
+        (resource.RLIMIT_FSIZE, COMPILE_FILE_LIMIT),
+    )
+    for limit, value in limits:
+        try:
+            resource.prlimit(pid, limit, (value, value))
+        except (OSError, ValueError):
+            pass
+
+def wait_for_compile(process):
+    """Reap the compile; returns (returncode, CPU seconds or None)."""
+    if hasattr(os, "wait4"):
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+        except ChildProcessError:
+            return process.wait(), None
+        process.returncode = os.waitstatus_to_exitcode(status)
+        return process.returncode, usage.ru_utime + usage.ru_stime
+    return process.wait(), None
+
+def record_compile_stats(job, outcome, wall_seconds, cpu_seconds):
+    """Append one row per compile, with its time spent queued, to compile_stats.csv."""
+    append_registry_rows(COMPILE_STATS_CSV, COMPILE_STATS_HEADERS, [[
+        datetime.now().strftime("%Y-%m-%d %H:%M:%S"), job.id, job.label, job.priority, job.template_name,
+        outcome, f"{job.queue_seconds or 0:.2f}", f"{wall_seconds:.2f}",
+        "" if cpu_seconds is None else f"{cpu_seconds:.2f}"
+    ]])
+
+def summarize_compile_stats(csv_file=COMPILE_STATS_CSV):
+    """Per template: runs, outcome counts, mean and max wall time."""
+    summary = {}
+    _, rows = read_registry(csv_file)
+    for row in rows:
+        entry = summary.setdefault(row["Template Type Name"] or "(none)",
+                                   {"runs": 0, "outcomes": {}, "wall_total": 0.0, "wall_max": 0.0})
+        wall = float(row["Wall Seconds"] or 0)
+        entry["runs"] += 1
+        entry["outcomes"][row["Outcome"]] = entry["outcomes"].get(row["Outcome"], 0) + 1
+        entry["wall_total"] += wall
+        entry["wall_max"] = max(entry["wall_max"], wall)
+    return summary
+
+def summarize_queue_waits(csv_file=COMPILE_STATS_CSV):
+    """Per priority class: jobs, mean, 95th percentile and max seconds spent queued."""
+    waits = {}
+    _, rows = read_registry(csv_file)
+    for row in rows:
+        waits.setdefault(row.get("Priority") or PRIORITY_INTERACTIVE, []).append(float(row.get("Queue Seconds") or 0))
+    summary = {}
+    for priority, values in waits.items():
+        values.sort()
+        summary[priority] = {
+            "jobs": len(values),
+            "mean": sum(values) / len(values),
+            "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+            "max": values[-1],
+        }
+    return summary
+
+
+def compile_latex(tex_path, output_dir, jobname, fail_fast=COMPILE_FAIL_FAST, job=None,
+                  timeout=COMPILE_TIMEOUT, cpu_limit=COMPILE_CPU_LIMIT, record_stats=True):
+    """
+    Run pdflatex on tex_path, writing <jobname>.pdf into output_dir.
+    Output is parsed while it streams; in fail-fast mode pdflatex halts on
+    the first error (and is stopped as soon as one is seen). The job is
+    killed, process group and all, on cancel, after timeout wall-clock
+    seconds, or when it exceeds the CPU, memory, file-size or log limits.
+    With record_stats=False (drafts) nothing goes to compile_stats.csv.
+    """
+    job = job or CompileJob(label=jobname)
+    os.makedirs(output_dir, exist_ok=True)
+    args = [
+        "pdflatex",
+        "-interaction=nonstopmode",
+        "-file-line-error",
+        f"-output-directory={output_dir}",
+        f"-jobname={jobname}",
+        tex_path
+    ]
+    if fail_fast:
+        args.insert(2, "-halt-on-error")
+
+    if job.is_cancelled():
+        job.finish("cancelled")
+        if record_stats:
+            record_compile_stats(job, "cancelled", 0.0, None)
+        return CompileResult(args, -1, "", [], "cancelled")
+
+    # Unwrapped log lines keep error messages and markers parseable
+    env = dict(os.environ, max_print_line="10000")
+    if os.name == "nt":
+        group = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        group = {"start_new_session": True}
+    started = time.monotonic()
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               stdin=subprocess.DEVNULL, text=True, errors="replace", env=env, **group)
+    apply_resource_limits(process.pid, cpu_limit)
+    job.start(process)
+
+    stop_reason = []
+
+    def watchdog():
+        deadline = started + timeout
+        while process.poll() is None:
+            if job.wait_cancelled(min(0.25, max(0.0, deadline - time.monotonic()))):
+                stop_reason.append("cancelled")
+            elif time.monotonic() >= deadline:
+                stop_reason.append("timeout")
+            else:
+                continue
+            kill_process_tree(process)
+            return
+
+    threading.Thread(target=watchdog, daemon=True).start()
+
+    parser = LatexLogParser()
+    output = []
+    output_size = 0
+    for line in process.stdout:
+        output.append(line)
+        output_size += len(line)
+        if output_size > COMPILE_LOG_LIMIT:
+            stop_reason.append("output-limit")
+            kill_process_tree(process)
+            break
+        if parser.feed(line) and fail_fast:
+            kill_process_tree(process)
+            break
+    process.stdout.close()
+    returncode, cpu_seconds = wait_for_compile(process)
+    parser.close()
+
+    if stop_reason:
+        outcome = stop_reason[0]
+    elif resource is not None and returncode == -signal.SIGXCPU:
+        outcome = "cpu-limit"
+    elif resource is not None and returncode == -signal.SIGXFSZ:
+        outcome = "output-limit"
+    elif returncode == 0 and not parser.errors:
+        outcome = "ok"
+    else:
+        outcome = "error"
+    if outcome != "ok" and returncode == 0:
+        returncode = 1
+
+    job.finish(outcome)
+    if record_stats:
+        record_compile_stats(job, outcome, time.monotonic() - started, cpu_seconds)
+    return CompileResult(args, returncode, "".join(output), parser.errors, outcome)
+
+def render_source_map(template_path, parameters):
+    """
+    Render a template line by line and return, for every line of the final
+    LaTeX source, (text, origin file, origin line, placeholders on that line).
+    Values containing newlines map all their lines back to the same origin.
+    """
+    with open(template_path, "r") as f:
+        lines = expand_partial_lines(f.read(), template_path, [])
+    source_map = []
+    for text, origin, lineno in lines:
+        fields = list(dict.fromkeys(parse_placeholders(text)))
+        rendered = fill_placeholders(text, parameters)
+        source_map.extend((part, origin, lineno, fields) for part in rendered.split("\n"))
+    return source_map
+
+def is_main_file_error(error, tex_path):
+    """Errors raised inside packages or classes carry their own line numbers."""
+    return error["file"] is None or os.path.basename(error["file"]) == os.path.basename(tex_path)
+
+def locate_compile_errors(result, tex_path, template_path, parameters):
+    """
+    Map each parsed error of a single-document compile back through partial
+    expansion and placeholder substitution. Returns a list of
+    (error, (origin file, origin line, fields) or None).
+    """
+    source_map = None
+    located = []
+    for error in result.errors:
+        location = None
+        if error["line"] and is_main_file_error(error, tex_path):
+            if source_map is None:
+                source_map = render_source_map(template_path, parameters)
+            if 0 < error["line"] <= len(source_map):
+                location = source_map[error["line"] - 1][1:]
+        located.append((error, location))
+    return located
+
+def locate_merge_errors(result, tex_path, template_path, merge_source, records):
+    """
+    Like locate_compile_errors for a mail-merge job, using the record markers
+    to find which record failed. Returns a list of (error, location, record).
+    """
+    source_lines = merge_source.split("\n")
+    located = []
+    for error in result.errors:
+        location = record = None
+        if error["line"] and is_main_file_error(error, tex_path):
+            # Each record body starts on the line after its marker
+            for i in range(min(error["line"], len(source_lines)) - 1, -1, -1):
+                match = re.search(rf"{MERGE_MARKER}:(\d+):", source_lines[i])
+                if match:
+                    record = int(match.group(1))
+                    offset = error["line"] - 1 - (i + 1)
+                    source_map = render_source_map(template_path, records[record])
+                    # ... and corresponds to the rest of the \begin{document} line onwards
+                    begin = next((n for n, entry in enumerate(source_map) if "\\begin{document}" in entry[0]), None)
+                    if begin is not None and 0 <= begin + offset < len(source_map):
+                        location = source_map[begin + offset][1:]
+                    break
+        located.append((error, location, record))
+    return located
+
+def describe_compile_error(error, location=None, record=None):
+    """One human readable line for a parsed pdflatex error."""
+    where = f"line {error['line']}" if error["line"] else "unknown line"
+    if location:
+        origin, lineno, fields = location
+        where = f"{os.path.basename(origin)} line {lineno}"
+        if fields:
+            where += f" (field{'s' if len(fields) > 1 else ''}: {', '.join(fields)})"
+    if record is not None:
+        where = f"record {record + 1}, {where}"
+    text = f"{where}: {error['message']}"
+    if error["context"]:
+        text += f"  [{error['context'].strip()}]"
+    return text
+
+def format_compile_report(error_lines, result):
+    """Structured errors first, then the tail of the raw pdflatex output."""
+    stopped = {
+        "timeout": f"Stopped: the compile ran longer than {COMPILE_TIMEOUT} seconds.",
+        "cancelled": "Stopped: the compile was cancelled.",
+        "cpu-limit": f"Stopped: the compile used more than {COMPILE_CPU_LIMIT} CPU seconds.",
+        "output-limit": "Stopped: the compile produced more output than allowed.",
+    }
+    report = [stopped[result.outcome]] if result.outcome in stopped else []
+    if error_lines:
+        report += ["LaTeX errors:"] + [f"  {line}" for line in error_lines]
+    elif not report:
+        report = ["LaTeX failed without a parseable error."]
+    report += ["", "--- pdflatex output (tail) ---", result.stdout[-COMPILE_LOG_TAIL:]]
+    return "\n".join(report)
+
+def explain_compile_errors(result, tex_path, template_path, parameters):
+    """Error report for a single document, with lines mapped back to template fields."""
+    located = locate_compile_errors(result, tex_path, template_path, parameters)
+    return format_compile_report([describe_compile_error(e, loc) for e, loc in located], result)
+
+def add_document_entry(doc_id, template_name, desc, param_file_path, pdf_path, generated_at=None):
+    """
+    Append a generated document to documents.csv and release its ID
+    reservation. The ID is checked again under the lock, so a document can
+    never be registered twice under one ID.
+    """
+    add_document_entries([(doc_id, template_name, desc, param_file_path, pdf_path, generated_at)])
+
+def add_document_entries(entries):
+    """
+    Register many documents at once: entries are (doc_id, template_name,
+    desc, param_file_path, pdf_path, generated_at) tuples, generated_at
+    optional. One lock, one duplicate check, one append and one release of
+    the reservations, so a batch costs about as much as a single document.
+    If any ID is already registered (or repeated), nothing is registered.
+    """
+    new_rows = []
+    for doc_id, template_name, desc, param_file_path, pdf_path, *generated_at in entries:
+        current_date = ((generated_at and generated_at[0]) or datetime.now()).strftime("%Y-%m-%d %H:%M:%S")
+        new_rows.append([doc_id, template_name, current_date, desc, param_file_path, pdf_path])
+    if not new_rows:
+        return
+    doc_ids = [row[0] for row in new_rows]
+
+    with RegistryLock(DOCUMENTS_CSV):
+        document_id_catalog.refresh()
+        seen, duplicates = set(), set()
+        for doc_id in doc_ids:
+            if doc_id in seen or doc_id in document_id_catalog.ids:
+                duplicates.add(doc_id)
+            seen.add(doc_id)
+        duplicates = sorted(duplicates)
+        if duplicates:
+            raise ValueError(f"Document ID '{duplicates[0]}' is already registered." if len(duplicates) == 1
+                             else f"Document IDs already registered: {', '.join(duplicates)}")
+        append_registry_rows(DOCUMENTS_CSV, DOCUMENT_HEADERS, new_rows)
+        release_document_ids(doc_ids)
+
+def compile_into(content, pdf_path, workdir, job=None):
+    """
+    Compile LaTeX source in its own work directory and move the PDF to pdf_path,
+    leaving no by-products beside it. Returns the pdflatex result.
+    """
+    os.makedirs(workdir, exist_ok=True)
+    jobname = os.path.splitext(os.path.basename(pdf_path))[0]
+    tex_path = os.path.join(workdir, f"{jobname}.tex")
+    with open(tex_path, "w") as f:
+        f.write(content)
+    result = compile_latex(tex_path, workdir, jobname, job=job)
+    built_pdf = os.path.join(workdir, f"{jobname}.pdf")
+    if result.returncode == 0 and os.path.exists(built_pdf):
+        os.makedirs(os.path.dirname(pdf_path) or ".", exist_ok=True)
+        os.replace(built_pdf, pdf_path)
+    return result
+
+def preview_workspace(template_name):
+    """Warm per-template preview directory; the aux files of the last draft stay there."""
+    return os.path.join(template_cache_dir(template_name), "preview")
+
+def render_preview(template_name, template_path, parameters, job):
+    """
+    Compile a draft of the template with the current field values in its
+    preview workspace and render page 1 to PNG with pdftoppm. Nothing is
+    registered, no registry is written (no compile stats, no template
+    dependencies) and no document ID is used. Returns (result, png_path);
+    png_path is None if the draft did not compile.
+    """
+    workdir = preview_workspace(template_name)
+    os.makedirs(workdir, exist_ok=True)
+    tex_path = os.path.join(workdir, "preview.tex")
+    png_path = os.path.join(workdir, "preview.png")
+    content = fill_placeholders(load_template_source(template_name, template_path, record=False), parameters)
+
+    # An unchanged draft (e.g. the template was picked again) is not recompiled
+    if os.path.exists(png_path) and os.path.exists(tex_path):
+        with open(tex_path, "r") as f:
+            if f.read() == content:
+                job.finish("ok")
+                return CompileResult([], 0, "", []), png_path
+
+    if os.path.exists(png_path):
+        os.remove(png_path)  # the cached image is only valid for the tex beside it
+    with open(tex_path, "w") as f:
+        f.write(content)
+    result = compile_latex(tex_path, workdir, "preview", fail_fast=True, job=job, timeout=PREVIEW_TIMEOUT,
+                           record_stats=False)
+    if result.returncode != 0:
+        return result, None
+    subprocess.run(
+        ["pdftoppm", "-png", "-r", str(PREVIEW_DPI), "-f", "1", "-l", "1", "-singlefile",
+         os.path.join(workdir, "preview.pdf"), os.path.join(workdir, "preview")],
+        check=True, capture_output=True
+    )
+    return result, png_path
+
+def rebuild_documents(template_names, workers=REBUILD_WORKERS):
+    """
+    Recompile, in parallel, every registered document of the given templates
+    from its stored parameters, overwriting each PDF in place. Rebuilds run
+    as background jobs, at most `workers` at a time.
+    Returns (rebuilt document IDs, {document ID: (template name, error message)}).
+    """
+    template_names = set(template_names)
+    templates = load_template_paths()
+    _, rows = read_registry(DOCUMENTS_CSV)
+    # Archived documents are frozen in their pack, and rows without a parameter
+    # file have nothing to rebuild from
+    rows = [row for row in rows
+            if row["Template Type Name"] in template_names and row["Path to Parameter File"]
+            and not is_packed(row["Path to Generated PDF"])]
+
+    # A template whose error does not come from a field value will fail for
+    # every document, so its remaining jobs are skipped instead of compiled.
+    broken_templates = set()
+
+    def rebuild_job(row, job):
+        try:
+            return rebuild(row, job)
+        finally:
+            if job.state == "queued":
+                job.finish("skipped")
+
+    def rebuild(row, job):
+        doc_id = row["Document Index Number"]
+        template_name = row["Template Type Name"]
+        if template_name in broken_templates:
+            raise RuntimeError("Skipped: an earlier document showed the template itself is broken.")
+        parameters = read_parameter_file(row["Path to Parameter File"])
+        content = load_template_source(template_name, templates[template_name])
+        content = fill_placeholders(content, parameters)
+        workdir = os.path.join(TEMP_TEX_DIR, "rebuild", doc_id)
+        result = compile_into(content, row["Path to Generated PDF"], workdir, job)
+        shutil.rmtree(workdir, ignore_errors=True)
+        if result.outcome == "cancelled":
+            raise RuntimeError("Cancelled.")
+        if result.returncode != 0:
+            tex_path = os.path.join(workdir, f"{doc_id}.tex")
+            located = locate_compile_errors(result, tex_path, templates[template_name], parameters)
+            if not any(location and location[2] for _, location in located):
+                broken_templates.add(template_name)
+            raise RuntimeError(format_compile_report(
+                [describe_compile_error(error, location) for error, location in located], result))
+        content_catalog.remember("render", render_key(content), row["Path to Generated PDF"])
+        return doc_id
+
+    rebuilt, failed = [], {}
+    group = object()  # one fair-share group per rebuild run
+    # Jobs exist from submission, so queued rebuilds can be cancelled too
+    futures = {compile_scheduler.submit(rebuild_job, row,
+                                        CompileJob(row["Template Type Name"], "rebuild", PRIORITY_BACKGROUND),
+                                        priority=PRIORITY_BACKGROUND, group=group, limit=workers): row
+               for row in rows}
+    for future, row in futures.items():
+        try:
+            rebuilt.append(future.result())
+        except Exception as e:
+            failed[row["Document Index Number"]] = (row["Template Type Name"], str(e))
+    return rebuilt, failed
+
+def rebuild_for_changed_partials(partials=None, workers=REBUILD_WORKERS):
+    """
+    Invalidate and rebuild only what depends on the changed partials
+    (detected by hash when partials is None). Returns (templates, rebuilt, failed).
+    """
+    partials = set(partials) if partials else find_changed_partials()
+    affected = templates_affected_by(partials)
+    invalidate_template_artifacts(affected)
+
+    templates = load_template_paths()
+    rebuilt, failed = rebuild_documents(affected & set(templates), workers)
+
+    # Templates whose documents all rebuilt are now in step with their partials;
+    # the others keep their old hashes so the next rebuild retries them.
+    failed_templates = {template_name for template_name, _ in failed.values()}
+    for template_name in affected & set(templates) - failed_templates:
+        with open(templates[template_name], "r") as f:
+            _, used = expand_partials(f.read())
+        record_template_dependencies(template_name, used)
+    return affected, rebuilt, failed
+
+def split_latex_document(content):
+    """Split a LaTeX source into (preamble, body) around the document environment."""
+    match = re.search(r'\\begin\{document\}(.*)\\end\{document\}', content, re.S)
+    if not match:
+        raise ValueError("Template has no \\begin{document} ... \\end{document} block.")
+    return content[:match.start()], match.group(1)
+
+def load_merge_records(csv_path):
+    """Yield one parameter dict per row of a mail-merge CSV file."""
+    with open(csv_path, newline="") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield {key.strip(): (val or "").strip() for key, val in row.items() if key}
+
+def check_merge_template(content, records):
+    """
+    Refuse templates a single merge run would render wrongly: fields in the
+    preamble that differ between records (the preamble is shared), and
+    \\label, whose names would clash between records.
+    """
+    preamble, body = split_latex_document(content)
+    varying = [ph for ph in dict.fromkeys(parse_placeholders(preamble))
+               if len({record.get(ph) for record in records}) > 1]
+    if varying:
+        raise ValueError(f"Fields used in the template preamble differ between records: {', '.join(varying)}. "
+                         "A merge shares one preamble; generate these documents separately (e.g. as a sweep).")
+    if re.search(r"\\label\b", body):
+        raise ValueError("The template uses \\label; its labels would clash between the records of one merge run. "
+                         "Generate these documents separately (e.g. as a sweep).")
+
+def build_merge_source(content, records):
+    """
+    Build one LaTeX job holding every record of a mail merge (see
+    check_merge_template for the templates it accepts). Preamble fields are
+    filled from the first record. Each record starts on a fresh page with
+    every counter and \\maketitle restored to their state at \\begin{document},
+    and is preceded by a marker reporting how many pages were shipped before
+    it, so the combined PDF can be split per record afterwards.
+    """
+    preamble, body = split_latex_document(content)
+    parts = [fill_placeholders(preamble, records[0]), "\\begin{document}\n", MERGE_RECORD_SETUP]
+    for n, parameters in enumerate(records):
+        parts.append(
+            "\\clearpage\\LaxDocResetRecord\\setcounter{page}{1}"
+            f"\\typeout{{{MERGE_MARKER}:{n}:\\the\\ReadonlyShipoutCounter}}\n"
+        )
+        parts.append(fill_placeholders(body, parameters))
+    parts.append(f"\\clearpage\\typeout{{{MERGE_MARKER}:END:\\the\\ReadonlyShipoutCounter}}\n")
+    parts.append("\\end{document}\n")
+    return "".join(parts)
+
+def parse_merge_page_ranges(log_text, record_count):
+    """Turn the page markers in a pdflatex log into one (start, end) page range per record."""
+    starts = {}
+    end_page = None
+    for key, page in re.findall(rf"{MERGE_MARKER}:(\d+|END):(\d+)", log_text):
+        if key == "END":
+            end_page = int(page)
+        else:
+            starts[int(key)] = int(page)
+
+    if end_page is None or len(starts) != record_count:
+        raise ValueError("Page markers missing from the LaTeX log; cannot split merged PDF.")
+
+    ranges = []
+    for n in range(record_count):
+        start = starts[n]
+        end = starts[n + 1] if n + 1 < record_count else end_page
+        if end <= start:
+            raise ValueError(f"Record {n + 1} produced no pages.")
+        ranges.append((start, end))
+    return ranges
+
+def split_pdf_pages(pdf_path, page_ranges, output_paths):
+    """Write each (start, end) page range of pdf_path to its own PDF file."""
+    if PdfReader is None:
+        raise RuntimeError("Splitting merged output requires the 'pypdf' package (pip install pypdf).")
+
+    reader = PdfReader(pdf_path)
+    for (start, end), output_path in zip(page_ranges, output_paths):
+        writer = PdfWriter()
+        for page in range(start, end):
+            writer.add_page(reader.pages[page])
+        with open(output_path, "wb") as f:
+            writer.write(f)
+
+def generate_merged_documents(template_name, template_index, template_path, records,
+                              doc_description, custom_format=None, combined_only=False, job=None,
+                              batch_input=None):
+    """
+    Render many parameter sets of one template in a single pdflatex run.
+
+    With combined_only the merged PDF is kept as a print run and nothing is
+    registered. Otherwise it is split per record and every record is
+    registered in documents.csv under its own document ID.
+    Registered merges are journaled per record (see BatchJournal), under
+    batch_input (e.g. the merge file's path; default: the records
+    themselves): a rerun only renders the records not yet done, under the
+    IDs they were first given. A record that broke the compile waits out
+    its backoff, so the rerun gets the others through.
+    Returns the list of document IDs, or the combined PDF path for print runs.
+    """
+    content = load_template_source(template_name, template_path)
+
+    records = list(records)
+    if not records:
+        raise ValueError("The merge file contains no records.")
+
+    placeholders = list(dict.fromkeys(parse_placeholders(content)))
+    missing = set(placeholders) - set(records[0])
+    if missing:
+        raise ValueError(f"Merge file is missing columns for: {', '.join(sorted(missing))}")
+    check_merge_template(content, records)
+
+    journal = row_keys = None
+    row_numbers = list(range(len(records)))  # position of each rendered record in the merge file
+    if not combined_only:
+        journal = BatchJournal("merge", template_name, batch_input or text_sha256(json.dumps(records)))
+        document_id_catalog.refresh()
+        journal.settle(document_id_catalog.ids)
+        rows = [(number, row_key, record) for number, (row_key, record) in enumerate(iter_batch_rows(records))
+                if journal.state(row_key) != BatchJournal.DONE]
+        waiting = [journal.waiting(row_key) for _, row_key, _ in rows]
+        rows = [row for row, retry_at in zip(rows, waiting) if retry_at is None]
+        if not rows:
+            if any(waiting):
+                raise ValueError(f"The remaining records failed recently; retry after {min(filter(None, waiting))}.")
+            raise ValueError("Every record of this merge file has already been generated.")
+        row_numbers, row_keys, records = (list(column) for column in zip(*rows))
+        # IDs are reserved and journaled before the compile, so an interrupted run's records keep theirs
+        doc_ids = reserve_document_ids(template_index, journal.holder,
+                                       [journal.doc_id(row_key) for row_key in row_keys], custom_format)
+        journal.start(dict(zip(row_keys, doc_ids)))
+
+    # Compiled in its own work directory, as compile_into does, so no
+    # by-products end up beside the registered PDFs
+    jobname = f"MERGE-{template_index}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    job = job or CompileJob(template_name, "merge", PRIORITY_BATCH)
+    workdir = os.path.join(TEMP_TEX_DIR, "merge", job.id)
+    os.makedirs(workdir, exist_ok=True)
+    merge_tex = os.path.join(workdir, f"{jobname}.tex")
+    merge_source = build_merge_source(content, records)
+    with open(merge_tex, "w") as f:
+        f.write(merge_source)
+
+    # Fail-fast: one bad record stops the whole run at its first error
+    # The time limits grow with the batch, one long job being expected here
+    result = compile_scheduler.run(compile_latex, merge_tex, workdir, jobname, job=job,
+                                   timeout=COMPILE_TIMEOUT + 2 * len(records),
+                                   cpu_limit=COMPILE_CPU_LIMIT + 2 * len(records),
+                                   priority=job.priority, group=job.id)
+    combined_pdf = os.path.join(workdir, f"{jobname}.pdf")
+    if result.returncode != 0 or not os.path.exists(combined_pdf):
+        located = [(error, location, None if record is None else row_numbers[record], record)
+                   for error, location, record in locate_merge_errors(result, merge_tex, template_path,
+                                                                       merge_source, records)]
+        report = format_compile_report([describe_compile_error(e, loc, number) for e, loc, number, _ in located], result)
+        if journal is not None:
+            # Only a record the errors point at is held back; the others stay pending
+            blamed = sorted({rec for _, _, _, rec in located if rec is not None})
+            for record in blamed:
+                journal.fail(row_keys[record], next(describe_compile_error(e, loc, number)
+                                                    for e, loc, number, rec in located if rec == record))
+                report += (f"\nRecord {row_numbers[record] + 1} is skipped until "
+                           f"{journal.rows[row_keys[record]]['retry_at']}; rerun the merge to generate the others.")
+            journal.record([row_key for i, row_key in enumerate(row_keys) if i not in blamed], BatchJournal.PENDING)
+        shutil.rmtree(workdir, ignore_errors=True)
+        raise RuntimeError(f"Mail merge compilation failed.\n{report}")
+
+    if combined_only:
+        print_run = os.path.join(DOCUMENTS_DIR, f"{jobname}.pdf")
+        os.makedirs(DOCUMENTS_DIR, exist_ok=True)
+        shutil.move(combined_pdf, print_run)
+        shutil.rmtree(workdir, ignore_errors=True)
+        return print_run
+
+    page_ranges = parse_merge_page_ranges(result.stdout, len(records))
+
+    paths = [document_paths(doc_id, template_name, template_index) for doc_id in doc_ids]
+    pdf_paths = [pdf_path for _, pdf_path in paths]
+    for pdf_path in pdf_paths:
+        os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
+    split_pdf_pages(combined_pdf, page_ranges, pdf_paths)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    entries = []
+    for doc_id, (param_file_path, pdf_path), parameters in zip(doc_ids, paths, records):
+        param_file_path = write_parameter_file(param_file_path, {ph: parameters[ph] for ph in placeholders})
+        desc = parameters.get("Short Description") or doc_description
+        entries.append((doc_id, template_name, desc, param_file_path, pdf_path))
+    add_document_entries(entries)
+    journal.record(row_keys, BatchJournal.DONE)
+    journal.close_if_done()
+
+    return doc_ids
+
+class BatchJournal:
+    """
+    On-disk record of a merge or sweep batch (batches/<kind>-<key>.jsonl),
+    keyed by input row: every state change (pending, compiling, done,
+    failed) is appended and fsynced before the batch moves on. A rerun of
+    the same batch skips done rows, reuses the document IDs already given
+    to the others (they stay reserved in reserved_ids.csv under the
+    journal's name), and retries failed rows once their backoff has passed.
+    """
+    PENDING, COMPILING, DONE, FAILED = "pending", "compiling", "done", "failed"
+
+    def __init__(self, kind, template_name, batch_input):
+        self.key = text_sha256(json.dumps([kind, template_name, batch_input]))[:16]
+        self.path = os.path.join(BATCH_JOURNAL_DIR, f"{kind}-{self.key}.jsonl")
+        self.holder = f"batch:{os.path.basename(self.path)}"  # of its rows' ID reservations
+        self.rows = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            self._load()
+        else:
+            self._append([{"batch": kind, "template": template_name, "input": batch_input,
+                           "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}])
+
+    def _load(self):
+        good = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # torn last write of a crashed run
+                if not line.endswith(b"\n"):
+                    break
+                good += len(line)
+                if "row" in entry:
+                    self.rows[entry["row"]] = entry
+        if good < os.path.getsize(self.path):
+            os.truncate(self.path, good)
+
+    def _append(self, entries):
+        os.makedirs(BATCH_JOURNAL_DIR, exist_ok=True)
+        with open(self.path, "a") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def record(self, row_keys, state, **fields):
+        """Durably move rows to state, keeping their earlier fields (doc_id, attempts, ...)."""
+        if isinstance(row_keys, str):
+            row_keys = [row_keys]
+        self._update({row_key: dict(fields) for row_key in row_keys}, state)
+
+    def start(self, doc_ids):
+        """Durably mark rows compiling under their document IDs ({row key: doc ID})."""
+        self._update({row_key: {"doc_id": doc_id} for row_key, doc_id in doc_ids.items()}, self.COMPILING)
+
+    def _update(self, changes, state):
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            entries = [{**self.rows.get(row_key, {}), "row": row_key, "state": state, **fields, "at": now}
+                       for row_key, fields in changes.items()]
+            self._append(entries)
+            for entry in entries:
+                self.rows[entry["row"]] = entry
+
+    def fail(self, row_key, error):
+        """Mark a row failed; it is retried after a backoff doubling with every failure."""
+        attempts = self.rows.get(row_key, {}).get("attempts", 0) + 1
+        delay = min(BATCH_RETRY_BACKOFF * 2 ** (attempts - 1), BATCH_RETRY_BACKOFF_MAX)
+        retry_at = datetime.fromtimestamp(time.time() + delay).strftime("%Y-%m-%d %H:%M:%S")
+        self.record(row_key, self.FAILED, attempts=attempts, error=error, retry_at=retry_at)
+
+    def close_if_done(self):
+        """
+        Once every row is done, rewrite the journal as one line per row,
+        marked closed: a rerun still finds every row done, at a fraction
+        of the size.
+        """
+        with self._lock:
+            if any(entry["state"] != self.DONE for entry in self.rows.values()):
+                return False
+            with open(self.path) as f:
+                header = json.loads(f.readline())
+            header["closed"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                for entry in [header, *self.rows.values()]:
+                    f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        return True
+
+    def state(self, row_key):
+        return self.rows.get(row_key, {}).get("state")
+
+    def doc_id(self, row_key):
+        return self.rows.get(row_key, {}).get("doc_id")
+
+    def waiting(self, row_key):
+        """retry_at of a failed row still in its backoff, else None."""
+        entry = self.rows.get(row_key, {})
+        if entry.get("state") == self.FAILED and entry["retry_at"] > datetime.now().strftime("%Y-%m-%d %H:%M:%S"):
+            return entry["retry_at"]
+        return None
+
+
+    def settle(self, registered_ids):
+        """
+        Rows a crashed run left compiling: done if their document made it
+        into the registry, pending (same document ID) otherwise.
+        """
+        stuck = [row_key for row_key, entry in self.rows.items() if entry["state"] == self.COMPILING]
+        done = [row_key for row_key in stuck if self.doc_id(row_key) in registered_ids]
+        if done:
+            self.record(done, self.DONE)
+        if len(done) < len(stuck):
+            self.record([row_key for row_key in stuck if row_key not in done], self.PENDING)
+
+def iter_batch_rows(records):
+    """
+    Yield (row key, record): a hash of the record's values, plus its
+    occurrence number so identical rows stay distinct. Keys survive rows
+    being reordered, and an edited row counts as a new one.
+    """
+    occurrences = {}
+    for record in records:
+        digest = text_sha256(json.dumps(record, sort_keys=True))[:16]
+        occurrence = occurrences[digest] = occurrences.get(digest, -1) + 1
+        yield f"{digest}-{occurrence}", record
+
+def iter_batch_journals():
+    """Yield (file name, header, {row key: latest entry}) for every batch journal."""
+    if not os.path.isdir(BATCH_JOURNAL_DIR):
+        return
+    for name in sorted(os.listdir(BATCH_JOURNAL_DIR)):
+        if not name.endswith(".jsonl"):
+            continue
+        header, rows = {}, {}
+        with open(os.path.join(BATCH_JOURNAL_DIR, name)) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                if "row" in entry:
+                    rows[entry["row"]] = entry
+                elif not header:
+                    header = entry
+        yield name, header, rows
+
+def discard_batch_journal(name):
+    """Forget a batch: delete its journal and release the IDs its unfinished rows held."""
+    path = os.path.join(BATCH_JOURNAL_DIR, os.path.basename(name))
+    if not os.path.exists(path):
+        return False
+    os.remove(path)
+    holder = f"batch:{os.path.basename(path)}"
+    if os.path.exists(RESERVED_IDS_CSV):
+        update_registry(RESERVED_IDS_CSV, lambda rows: [row for row in rows if row["Holder"] != holder])
+    return True
+
+def list_batch_journals():
+    """One summary dict per batch journal: its kind, template, input and row counts by state."""
+    batches = []
+    for name, header, rows in iter_batch_journals():
+        counts = {}
+        for entry in rows.values():
+            counts[entry["state"]] = counts.get(entry["state"], 0) + 1
+        batches.append({**header, "file": name, "counts": counts})
+    return batches
+
+def parse_sweep_values(spec):
+    """
+    Values of one sweep field:
+      "North | South | East"   a list (write || for a literal bar; \\| stays \\|)
+      "1..10", "0..1..0.25"    an inclusive range, with an optional step
+      "@tiers.csv:Tier"        the non-empty values of a CSV column
+      anything else            a single value
+    """
+    if spec.startswith("@") and ":" in spec:
+        csv_path, column = spec[1:].rsplit(":", 1)
+        with open(csv_path, newline="") as f:
+            reader = csv.DictReader(f)
+            if column not in (reader.fieldnames or []):
+                raise ValueError(f"'{csv_path}' has no column '{column}'")
+            values = [row[column].strip() for row in reader if (row[column] or "").strip()]
+        if not values:
+            raise ValueError(f"Column '{column}' of '{csv_path}' is empty")
+        return values
+
+    match = SWEEP_RANGE_PATTERN.match(spec)
+    if match:
+        start, stop = decimal.Decimal(match.group(1)), decimal.Decimal(match.group(2))
+        step = decimal.Decimal(match.group(3) or ("1" if stop >= start else "-1"))
+        if step == 0 or (stop - start) * step < 0:
+            raise ValueError(f"Range '{spec}' never reaches its end")
+        # Every value gets as many decimals as the most precise bound or step
+        places = max(-number.as_tuple().exponent for number in (start, stop, step))
+        quantum = decimal.Decimal(1).scaleb(-places)
+        values = []
+        value = start
+        while (value <= stop) if step > 0 else (value >= stop):
+            values.append(str(value.quantize(quantum)))
+            value += step
+        return values
+
+    parts, current, pos = [], [], 0
+    for token in SWEEP_LIST_TOKEN.finditer(spec):
+        current.append(spec[pos:token.start()])
+        if token.group() == "|":
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append("|" if token.group() == "||" else token.group())
+        pos = token.end()
+    parts.append("".join(current) + spec[pos:])
+    if len(parts) > 1:
+        return [part.strip() for part in parts if part.strip()]
+    return parts
+
+def iter_sweep_records(values, mode="product"):
+    """
+    Lazily yield one parameter dict per combination of values ({field: [values]}):
+    every combination (product), or the lists paired in order (zip), in which
+    single values are repeated for every record.
+    """
+    names = list(values)
+    if mode == "zip":
+        lengths = {len(values[name]) for name in names if len(values[name]) > 1}
+        if len(lengths) > 1:
+            raise ValueError("Zipped sweep fields must all have the same number of values")
+        count = lengths.pop() if lengths else 1
+        columns = [values[name] if len(values[name]) > 1 else itertools.repeat(values[name][0], count)
+                   for name in names]
+        for combination in zip(*columns):
+            yield dict(zip(names, combination))
+    else:
+        for combination in itertools.product(*(values[name] for name in names)):
+            yield dict(zip(names, combination))
+
+def count_sweep_records(values, mode="product"):
+    lengths = [len(field_values) for field_values in values.values()]
+    if mode == "zip":
+        return max(lengths, default=1)
+    count = 1
+    for length in lengths:
+        count *= length
+    return count
+
+def sweep_label(parameters, varying):
+    """The part of a sweep document's description that tells its combination apart."""
+    return ", ".join(f"{name}={parameters[name]}" for name in varying)
+
+def run_sweep(template_name, template_index, template_path, specs, doc_description, mode="product",
+              custom_format=None, window=SWEEP_WINDOW, progress=None, job=None):
+    """
+    Generate one document per combination of the sweep specs ({placeholder: spec}).
+    Combinations are produced lazily and at most `window` compiles are in
+    flight. Each document is described as "<doc_description> (<varying fields>)";
+    The sweep is journaled per combination (see BatchJournal) under its
+    description, so rerunning it with the same description resumes it:
+    done combinations (or ones whose description is already registered)
+    are skipped, interrupted ones keep their document IDs, and failed ones
+    are retried once their backoff has passed.
+    Combinations rendering identically to one earlier in the sweep are
+    dropped, and ones identical to an existing PDF are linked, not compiled.
+    Cancelling job (a CompileJob for the whole sweep) stops the sweep and its
+    compiles. Returns a summary dict.
+    """
+    content = load_template_source(template_name, template_path)
+    placeholders = list(dict.fromkeys(parse_placeholders(content)))
+    missing = set(placeholders) - set(specs)
+    if missing:
+        raise ValueError(f"No sweep values for: {', '.join(sorted(missing))}")
+    values = {name: parse_sweep_values(specs[name]) for name in placeholders}
+    varying = [name for name in placeholders if len(values[name]) > 1]
+
+    _, rows = read_registry(DOCUMENTS_CSV)
+    done_descriptions = {row["Short Description"] for row in rows if row["Template Type Name"] == template_name}
+    registered_ids = {row["Document Index Number"] for row in rows}
+    journal = BatchJournal("sweep", template_name, doc_description)
+    journal.settle(registered_ids)
+    # New combinations take IDs from a pool reserved `window` at a time; IDs a
+    # crashed run had reserved ahead but not used are picked up again
+    journal_ids = {journal.doc_id(row_key) for row_key in journal.rows}
+    _, reservations = read_registry(RESERVED_IDS_CSV)
+    id_pool = deque(row["Document Index Number"] for row in reservations
+                    if row["Holder"] == journal.holder and row["Document Index Number"] not in journal_ids
+                    and row["Document Index Number"] not in registered_ids)
+
+    summary = {"total": count_sweep_records(values, mode), "generated": [], "linked": [],
+               "skipped": 0, "duplicates": 0, "waiting": 0, "failed": {}}
+    seen_renders = set()
+    group = object()  # one fair-share group per sweep
+    pending = {}
+    job = job or CompileJob(template_name, "sweep", PRIORITY_BATCH)
+    job.start()
+
+    def report():
+        if progress:
+            handled = (len(summary["generated"]) + len(summary["linked"]) + summary["skipped"]
+                       + summary["duplicates"] + summary["waiting"] + len(summary["failed"]))
+            progress(f"{handled}/{summary['total']} combinations handled")
+
+    # Finished documents are registered and journaled done `window` at a time
+    finished = []
+
+    def register(row_key, doc_id, desc, parameters, param_file_path, pdf_path, outcome):
+        param_file_path = write_parameter_file(param_file_path, parameters)
+        finished.append((row_key, outcome, (doc_id, template_name, desc, param_file_path, pdf_path)))
+        if len(finished) >= window:
+            register_finished()
+
+    def register_finished():
+        batch = finished[:]
+        finished.clear()
+        if not batch:
+            return
+        try:
+            add_document_entries([entry for _, _, entry in batch])
+        except Exception as e:
+            for row_key, _, (_, _, desc, _, _) in batch:
+                journal.fail(row_key, str(e))
+                summary["failed"][desc] = str(e)
+            return
+        journal.record([row_key for row_key, _, _ in batch], BatchJournal.DONE)
+        for _, outcome, entry in batch:
+            summary[outcome].append(entry[0])
+
+    def collect(future):
+        row_key, doc_id, desc, parameters, param_file_path, pdf_path, key, workdir, _ = pending.pop(future)
+        try:
+            result = future.result()
+            if result.outcome == "cancelled":
+                journal.record(row_key, BatchJournal.PENDING)
+                return  # left for the next run to resume, under the same ID
+            if result.returncode != 0:
+                tex_path = os.path.join(workdir, f"{os.path.splitext(os.path.basename(pdf_path))[0]}.tex")
+                located = locate_compile_errors(result, tex_path, template_path, parameters)
+                raise RuntimeError(describe_compile_error(*located[0]) if located
+                                   else f"Compilation {result.outcome}.")
+            content_catalog.remember("render", key, pdf_path)
+            register(row_key, doc_id, desc, parameters, param_file_path, pdf_path, "generated")
+        except Exception as e:
+            journal.fail(row_key, str(e))
+            summary["failed"][desc] = str(e)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        report()
+
+    try:
+        for row_key, parameters in iter_batch_rows(iter_sweep_records(values, mode)):
+            if job.is_cancelled():
+                break
+            label = sweep_label(parameters, varying)
+            desc = f"{doc_description} ({label})" if label else doc_description
+            if journal.state(row_key) == BatchJournal.DONE or desc in done_descriptions:
+                summary["skipped"] += 1
+                report()
+                continue
+            if journal.waiting(row_key):
+                summary["waiting"] += 1
+                report()
+                continue
+            source = fill_placeholders(content, parameters)
+            key = render_key(source)
+            if key in seen_renders:
+                summary["duplicates"] += 1
+                report()
+                continue
+            seen_renders.add(key)
+
+            # Reserved only now, so IDs taken by others while the sweep runs are never reused
+            doc_id = journal.doc_id(row_key)
+            if doc_id:
+                doc_id = reserve_document_ids(template_index, journal.holder, [doc_id], custom_format)[0]
+            else:
+                if not id_pool:
+                    id_pool.extend(reserve_document_ids(template_index, journal.holder, [None] * window, custom_format))
+                doc_id = id_pool.popleft()
+            journal.start({row_key: doc_id})
+            param_file_path, pdf_path = document_paths(doc_id, template_name, template_index)
+            identical_pdf = find_identical("render", key)
+            if identical_pdf:
+                register(row_key, doc_id, desc, parameters, param_file_path,
+                         link_or_reference(identical_pdf, pdf_path), "linked")
+                report()
+                continue
+
+            workdir = os.path.join(TEMP_TEX_DIR, "sweep", doc_id)
+            compile_job = CompileJob(template_name, "sweep", PRIORITY_BATCH)
+            future = compile_scheduler.submit(compile_into, source, pdf_path, workdir, compile_job,
+                                              priority=PRIORITY_BATCH, group=group)
+            pending[future] = (row_key, doc_id, desc, parameters, param_file_path, pdf_path, key, workdir, compile_job)
+            if len(pending) >= window:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+    finally:
+        if job.is_cancelled():
+            for entry in pending.values():
+                entry[-1].cancel()
+        for future in list(pending):
+            collect(future)
+        register_finished()
+        release_document_ids(id_pool)
+        summary["cancelled"] = job.is_cancelled()
+        job.finish("cancelled" if summary["cancelled"] else "ok")
+    journal.close_if_done()
+    return summary
+
+def format_sweep_summary(summary):
+    lines = [f"{len(summary['generated'])} generated, {len(summary['linked'])} linked to identical PDFs, "
+             f"{summary['skipped']} already done, {summary['duplicates']} duplicate renders dropped, "
+             f"{len(summary['failed'])} failed (of {summary['total']} combinations)."]
+    if summary["waiting"]:
+        lines.append(f"{summary['waiting']} combinations that failed recently were left for a later run.")
+    if summary.get("cancelled"):
+        lines.append("The sweep was cancelled; run it again with the same description to resume.")
+    lines += [f"FAILED {desc}: {error}" for desc, error in summary["failed"].items()]
+    return "\n".join(lines)
+
+
+
+class DirectoryListingCache:
+    """
+    Answers file-existence questions from cached directory listings.
+    Each directory is listed with one os.scandir and re-listed only when its
+    mtime changes, which is checked at most once per begin_pass(). On network
+    shares this turns one remote stat per file into one per directory.
+    """
+
+    def __init__(self):
+        self._listings = {}  # directory -> (mtime_ns, set of entry names)
+        self._validated = set()  # directories whose mtime was checked this pass
+        self._lock = threading.Lock()
+
+    def begin_pass(self):
+        """Start a new lookup pass; every directory is revalidated on first use."""
+        with self._lock:
+            self._validated.clear()
+
+    def invalidate(self, path=None):
+        """Drop the listing holding path, or every listing when path is None."""
+        with self._lock:
+            if path is None:
+                self._listings.clear()
+                self._validated.clear()
+            else:
+                directory = os.path.normcase(os.path.abspath(os.path.dirname(path)))
+                self._listings.pop(directory, None)
+                self._validated.discard(directory)
+
+    def _listing(self, directory):
+        with self._lock:
+            cached = self._listings.get(directory)
+            if cached is not None and directory in self._validated:
+                return cached[1]
+
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            names = frozenset()
+            mtime = None
+        else:
+            if cached is not None and cached[0] == mtime:
+                names = cached[1]
+            else:
+                with os.scandir(directory) as entries:
+                    names = frozenset(os.path.normcase(entry.name) for entry in entries)
+
+        with self._lock:
+            self._listings[directory] = (mtime, names)
+            self._validated.add(directory)
+        return names
+
+    def exists(self, path):
+        if not path:
+            return False
+        directory = os.path.normcase(os.path.abspath(os.path.dirname(path)))
+        return os.path.normcase(os.path.basename(path)) in self._listing(directory)
+
+
+# Shared by the search frames so listings survive between searches
+existence_cache = DirectoryListingCache()
+
+class PrefixTrie:
+    """
+    Burst trie from case-insensitive keys to sets of values, for completion
+    and prefix filtering. Nodes branch on one character, but a subtree of
+    up to BURST_LIMIT keys stays a single sorted list searched with bisect,
+    which keeps hundreds of thousands of keys compact with lookups well
+    under a millisecond. A node is a dict {char: child}; "" holds the key
+    that ends at that depth. New keys are linked in on the next lookup
+    (or link_pending()), in bulk when there are many, as on a first load.
+    A key with a single value stores it bare rather than in a set.
+    """
+    BURST_LIMIT = 1024
+
+    def __init__(self):
+        self._root = []
+        self._values = {}
+        self._labels = {}
+        self._pending = []
+
+    def __len__(self):
+        return len(self._values)
+
+    def add(self, key, value):
+        folded = key.lower()
+        if not folded:
+            return
+        values = self._values.get(folded, self)  # self: no such key
+        if values is self:
+            self._values[folded] = value
+            if key != folded:
+                self._labels[folded] = key
+            self._pending.append(folded)
+        elif isinstance(values, set):
+            values.add(value)
+        elif values != value:
+            self._values[folded] = {values, value}
+
+    def add_all(self, keys, value):
+        for key in keys:
+            self.add(key, value)
+
+    def link_pending(self):
+        if not self._pending:
+            return
+        if len(self._pending) > self.BURST_LIMIT and len(self._pending) * 8 > len(self._values):
+            self._root = self._build(sorted(self._values), 0)
+        else:
+            for key in self._pending:
+                self._insert(key)
+        self._pending = []
+
+    def _build(self, keys, depth):
+        """Node for sorted keys sharing their first depth characters."""
+        if len(keys) <= self.BURST_LIMIT:
+            return keys
+        node = {}
+        start = 0
+        if len(keys[0]) == depth:  # the key ending here sorts first
+            node[""] = [keys[0]]
+            start = 1
+        while start < len(keys):
+            char = keys[start][depth]
+            end = bisect.bisect_left(keys, keys[start][:depth] + chr(ord(char) + 1), start)
+            node[char] = self._build(keys[start:end], depth + 1)
+            start = end
+        return node
+
+    def _insert(self, key):
+        parent, branch, node, depth = None, None, self._root, 0
+        while isinstance(node, dict):
+            parent, branch = node, key[depth:depth + 1]
+            node = node.setdefault(branch, [])
+            depth += 1
+        bisect.insort(node, key)
+        if len(node) > self.BURST_LIMIT:
+            burst = self._build(node, depth)
+            if parent is None:
+                self._root = burst
+            else:
+                parent[branch] = burst
+
+    def remove(self, key, value):
+        folded = key.lower()
+        values = self._values.get(folded, self)
+        if isinstance(values, set):
+            values.discard(value)
+            if len(values) == 1:
+                self._values[folded] = next(iter(values))
+            return
+        if values != value:
+            return
+        del self._values[folded]
+        self._labels.pop(folded, None)
+        self.link_pending()
+        node, depth = self._root, 0
+        while isinstance(node, dict):
+            node = node.get(folded[depth:depth + 1])
+            depth += 1
+            if node is None:
+                return
+        i = bisect.bisect_left(node, folded)
+        if i < len(node) and node[i] == folded:
+            del node[i]
+
+    def keys(self, prefix=""):
+        """Matching keys (lower-cased) in sorted order, lazily."""
+        self.link_pending()
+        prefix = prefix.lower()
+        node, depth = self._root, 0
+        while isinstance(node, dict) and depth < len(prefix):
+            node = node.get(prefix[depth])
+            depth += 1
+            if node is None:
+                return
+        yield from self._walk(node, prefix)
+
+    def _walk(self, node, prefix):
+        if isinstance(node, dict):
+            for branch in sorted(node):
+                yield from self._walk(node[branch], prefix)
+            return
+        i = bisect.bisect_left(node, prefix)
+        while i < len(node) and node[i].startswith(prefix):
+            yield node[i]
+            i += 1
+
+    def complete(self, prefix, limit=SUGGESTION_LIMIT):
+        """Up to limit keys starting with prefix, as first spelled."""
+        return [self._labels.get(key, key) for key in itertools.islice(self.keys(prefix), limit)]
+
+    def values(self, prefix):
+        """Set of the values of every key starting with prefix."""
+        return set(self.iter_values(prefix))
+
+    def iter_values(self, prefix):
+        """Values of the keys starting with prefix, lazily in key order; a value may repeat."""
+        for key in self.keys(prefix):
+            values = self._values[key]
+            if isinstance(values, set):
+                yield from values
+            else:
+                yield values
+
+
+def description_tokens(text):
+    """Distinct lower-case words of a description, as indexed for search."""
+    return set(re.findall(r"\w+", text.lower()))
+
+def csv_record_offsets(data):
+    """
+    Byte offsets at which the complete CSV records in data start, plus the
+    offset where the last complete one ends. A record ends at a newline that
+    follows an even number of quote characters (fields may span lines).
+    """
+    offsets = []
+    start = pos = quotes = 0
+    while True:
+        end = data.find(b"\n", pos)
+        if end == -1:
+            return offsets, start
+        quotes += data.count(b'"', pos, end)
+        pos = end + 1
+        if quotes % 2 == 0:
+            offsets.append(start)
+            start = pos
+            quotes = 0
+
+
+class RegistryCatalog(abc.ABC):
+    """
+    Shared in-memory view of a registry CSV.
+    refresh() costs one os.stat; the file is re-read only when its inode, size
+    or mtime changed, and subscribers are then called with the catalog. Call
+    refresh() from the Tk thread, since subscribers usually update widgets,
+    or refresh(notify=False) from a worker and notify() back on the Tk thread.
+    """
+
+    def __init__(self, csv_file):
+        self.csv_file = csv_file
+        self._signature = None
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.csv_file)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def refresh(self, notify=True):
+        """Reload if the file changed; returns True when it did (and subscribers were notified)."""
+        with self._lock:
+            signature = self._stat_signature()
+            if signature == self._signature:
+                return False
+            previous, self._signature = self._signature, signature
+            self._reload(previous, signature)
+
+        if notify:
+            self.notify()
+        return True
+
+    def notify(self):
+        for callback in list(self._subscribers):
+            callback(self)
+
+    @abc.abstractmethod
+    def _reload(self, previous, signature):
+        """Rebuild the derived data; previous is None on the first load."""
+
+
+class DocumentIdCatalog(RegistryCatalog):
+    """
+    The set of registered document IDs, for ID allocation. Like
+    DocumentCatalog, a grown file with the same inode is caught up by
+    parsing only the appended bytes. It has no subscribers, so any thread
+    may refresh it.
+    """
+
+    def __init__(self, csv_file=DOCUMENTS_CSV):
+        super().__init__(csv_file)
+        self._offset = 0
+        self.ids = set()
+
+    def _reload(self, previous, signature):
+        if previous is None or signature is None or previous[0] != signature[0] or signature[1] < self._offset:
+            self._offset = 0
+            self.ids = set()
+        if signature is None:
+            return
+        with open(self.csv_file, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        _, consumed = csv_record_offsets(data)
+        reader = csv.reader(io.StringIO(data[:consumed].decode("utf-8", errors="replace"), newline=""))
+        if self._offset == 0:
+            next(reader, None)  # Skip header
+        self.ids.update(values[0] for values in reader if values)
+        self._offset += consumed
+
+
+class TemplateCatalog(RegistryCatalog):
+    """The (index, name, path) list of templates.csv, shared by every frame."""
+
+    def __init__(self, csv_file=TEMPLATES_CSV):
+        super().__init__(csv_file)
+        self._templates = []
+        self.name_trie = PrefixTrie()
+
+    def _reload(self, previous, signature):
+        templates = []
+        name_trie = PrefixTrie()
+        if signature is not None:
+            with open(self.csv_file, newline="") as f:
+                reader = csv.reader(f)
+                next(reader, None)  # Skip header
+                for row in reader:
+                    if len(row) >= 5:
+                        templates.append((row[0], row[1], row[4]))  # (index, name, path)
+                        name_trie.add(row[1], row[1])
+        self._templates = templates
+        self.name_trie = name_trie
+
+    def templates(self):
+        self.refresh()
+        return list(self._templates)
+
+    def complete_name(self, prefix):
+        self.refresh()
+        return self.name_trie.complete(prefix)
+
+
+class DocumentCatalog(RegistryCatalog):
+    """
+    Derived data of documents.csv: the template names in use, prefix tries
+    over document IDs, template names and description words, and the byte
+    offset of every row. documents.csv only grows by appends between
+    rewrites, and every rewrite replaces the file (new inode), so a grown
+    file with the same inode is caught up by parsing just the appended
+    bytes. After a rewrite (e.g. a delete) only the rows that appeared or
+    disappeared touch the tries. The ID and description tries are built
+    once, by build_search_index() (slow on a large registry, so run it off
+    the UI thread), and kept current from then on. complete() and
+    matching_ids() answer from the last refresh and never re-read the file
+    themselves: a full parse takes seconds, so the UI refreshes in the background.
+    """
+
+    def __init__(self, csv_file=DOCUMENTS_CSV):
+        super().__init__(csv_file)
+        self._offset = 0
+        self._fieldnames = None
+        self._rows = {}  # document ID -> (template name, description)
+        self._offsets = {}  # document ID -> byte offset of its row
+        self._by_template = {}
+        self._indexed = False
+        self.id_trie = PrefixTrie()
+        self.template_trie = PrefixTrie()
+        self.description_trie = PrefixTrie()
+
+    @property
+    def template_names(self):
+        return set(self._by_template)
+
+    def _reload(self, previous, signature):
+        if signature is None:
+            self._offset = 0
+            self._fieldnames = None
+            self._remove_rows(list(self._rows))
+            return
+
+        appended_only = (
+            previous is not None
+            and self._fieldnames is not None
+            and previous[0] == signature[0]
+            and signature[1] >= self._offset
+        )
+        stale = None
+        if not appended_only:
+            self._offset = 0
+            self._fieldnames = None
+            stale = set(self._rows)
+
+        with open(self.csv_file, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        # Leave a partially written last record for the next refresh
+        offsets, consumed = csv_record_offsets(data)
+        base = self._offset
+        self._offset += consumed
+
+        reader = csv.reader(io.StringIO(data[:consumed].decode("utf-8", errors="replace"), newline=""))
+        for offset, values in zip(offsets, reader):
+            if self._fieldnames is None:
+                self._fieldnames = values
+                id_col, template_col, desc_col = (
+                    values.index(name) for name in ("Document Index Number", "Template Type Name", "Short Description"))
+                self._columns = (id_col, template_col, desc_col)
+            elif len(values) == len(self._fieldnames):
+                id_col, template_col, desc_col = self._columns
+                doc_id = values[id_col]
+                self._offsets[doc_id] = base + offset
+                if stale is not None:
+                    stale.discard(doc_id)
+                self._add_row(doc_id, values[template_col], values[desc_col])
+        if stale:
+            self._remove_rows(stale)
+        for trie in (self.id_trie, self.template_trie, self.description_trie):
+            trie.link_pending()
+
+    def build_search_index(self):
+        """
+        Fill the ID and description tries from the rows loaded so far (later
+        refreshes keep them current); safe to call from a worker thread.
+        """
+        with self._lock:
+            if self._indexed:
+                return
+            for doc_id, (_, description) in self._rows.items():
+                self.id_trie.add(doc_id, doc_id)
+                self.description_trie.add_all(description_tokens(description), doc_id)
+            self.id_trie.link_pending()
+            self.description_trie.link_pending()
+            self._indexed = True
+
+    def _add_row(self, doc_id, template_name, description):
+        entry = (template_name, description)
+        if self._rows.get(doc_id) == entry:
+            return
+        if doc_id in self._rows:
+            self._remove_rows([doc_id], keep_offset=True)
+        self._rows[doc_id] = entry
+        if template_name not in self._by_template:
+            self._by_template[template_name] = set()
+            self.template_trie.add(template_name, template_name)
+        self._by_template[template_name].add(doc_id)
+        if self._indexed:
+            self.id_trie.add(doc_id, doc_id)
+            self.description_trie.add_all(description_tokens(description), doc_id)
+
+    def _remove_rows(self, doc_ids, keep_offset=False):
+        for doc_id in doc_ids:
+            template_name, description = self._rows.pop(doc_id)
+            if not keep_offset:
+                self._offsets.pop(doc_id, None)
+            documents = self._by_template[template_name]
+            documents.discard(doc_id)
+            if not documents:
+                del self._by_template[template_name]
+                self.template_trie.remove(template_name, template_name)
+            if self._indexed:
+                self.id_trie.remove(doc_id, doc_id)
+                for token in description_tokens(description):
+                    self.description_trie.remove(token, doc_id)
+
+    def complete(self, field, prefix):
+        """Suggestions for a search field: "index", "type" or "desc" (the word being typed)."""
+        if field != "type" and not self._indexed:
+            return []  # build_search_index() has not finished yet
+        if not self._lock.acquire(blocking=False):
+            return []  # a worker is refreshing the tries
+        try:
+            trie = {"index": self.id_trie, "type": self.template_trie, "desc": self.description_trie}[field]
+            return trie.complete(prefix)
+        finally:
+            self._lock.release()
+
+    def matching_ids(self, index="", type_prefix="", words=()):
+        """
+        IDs of the documents whose ID starts with index, whose template name
+        starts with type_prefix and whose description has a word starting
+        with each of words; None if nothing narrows it (or the search index
+        is not built yet). The IDs come lazily: one trie is walked (the ID
+        trie if index is given, else the longest word's, else the template
+        names') and every other criterion is checked per row, so taking the
+        first few costs little however many documents match.
+        """
+        if not self._indexed:
+            return None
+        index, type_prefix = index.lower(), type_prefix.lower()
+        words = sorted((word.lower() for word in words), key=len, reverse=True)
+        if index:
+            candidates = self.id_trie.iter_values(index)
+        elif words:
+            candidates = self.description_trie.iter_values(words[0])
+        elif type_prefix:
+            candidates = itertools.chain.from_iterable(
+                self._by_template[name] for name in self.template_trie.iter_values(type_prefix))
+        else:
+            return None
+        return self._iter_matching(candidates, index, type_prefix, words)
+
+    def _iter_matching(self, candidates, index, type_prefix, words):
+        seen = set()
+        for doc_id in candidates:
+            if doc_id in seen or doc_id not in self._rows:
+                continue
+            seen.add(doc_id)
+            template_name, description = self._rows[doc_id]
+            if not doc_id.lower().startswith(index) or not template_name.lower().startswith(type_prefix):
+                continue
+            tokens = description_tokens(description) if words else ()
+            if all(any(token.startswith(word) for token in tokens) for word in words):
+                yield doc_id
+
+    def rows(self, doc_ids):
+        """Read just these rows of documents.csv, by their byte offsets."""
+        with open(self.csv_file, "rb") as f:
+            for doc_id in doc_ids:
+                f.seek(self._offsets[doc_id])
+                lines = []
+                quotes = 0
+                for line in f:
+                    lines.append(line)
+                    quotes += line.count(b'"')
+                    if quotes % 2 == 0:
+                        break
+                text = b"".join(lines).decode("utf-8", errors="replace")
+                values = next(csv.reader(io.StringIO(text, newline="")), [])
+                row = dict(zip(self._fieldnames, values))
+                if row.get("Document Index Number") == doc_id:  # else rewritten since the last refresh
+                    yield row
+
+
+class ArchiveIndex(RegistryCatalog):
+    """Offset index of the archive packs: member -> (pack file, offset, length)."""
+
+    def __init__(self, csv_file=ARCHIVE_INDEX_CSV):
+        super().__init__(csv_file)
+        self._members = {}
+
+    def _reload(self, previous, signature):
+        members = {}
+        _, rows = read_registry(self.csv_file)
+        for row in rows:
+            members[row["Member"]] = (row["Pack File"], int(row["Offset"]), int(row["Length"]), row["SHA-256"])
+        self._members = members
+
+    def lookup(self, member):
+        self.refresh()
+        return self._members.get(member)
+
+
+class ContentHashCatalog(RegistryCatalog):
+    """
+    Content-hash catalog (content_hashes.csv) used to store identical templates,
+    PDFs and parameter files once. Kinds: template, render (final LaTeX source
+    of a PDF) and params. Rows are append-only; the latest row for a path
+    wins, so an entry whose file was later rebuilt with other content is stale.
+    As in DocumentIdCatalog, a grown file is caught up by parsing only the
+    appended bytes, so remember() does not make the next lookup re-read it all.
+    """
+
+    def __init__(self, csv_file=CONTENT_HASHES_CSV):
+        super().__init__(csv_file)
+        self._offset = 0
+        self._columns = None
+        self._by_digest = {}
+        self._by_path = {}
+
+    def _reload(self, previous, signature):
+        if previous is None or signature is None or previous[0] != signature[0] or signature[1] < self._offset:
+            self._offset = 0
+            self._columns = None
+            self._by_digest, self._by_path = {}, {}
+        if signature is None:
+            return
+        with open(self.csv_file, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        _, consumed = csv_record_offsets(data)
+        reader = csv.reader(io.StringIO(data[:consumed].decode("utf-8", errors="replace"), newline=""))
+        if self._columns is None:
+            header = next(reader, None)
+            if header is None:
+                return
+            self._columns = tuple(header.index(name) for name in ("Kind", "SHA-256", "Path"))
+        kind_col, digest_col, path_col = self._columns
+        for values in reader:
+            if len(values) == len(CONTENT_HASHES_HEADERS):
+                self._index(values[kind_col], values[digest_col], values[path_col])
+        self._offset += consumed
+
+    def _index(self, kind, digest, path):
+        self._by_digest[(kind, digest)] = path
+        self._by_path[(kind, normalize_path(path))] = digest
+
+    def lookup(self, kind, digest):
+        self.refresh()
+        path = self._by_digest.get((kind, digest))
+        if path is None or self._by_path.get((kind, normalize_path(path))) != digest:
+            return None
+        return path
+
+    def lookup_path(self, kind, path):
+        self.refresh()
+        return self._by_path.get((kind, normalize_path(path)))
+
+    def remember(self, kind, digest, path):
+        append_registry_rows(self.csv_file, CONTENT_HASHES_HEADERS, [[digest, kind, path]])
+        self._index(kind, digest, path)
+
+
+# One catalog per registry, shared by every frame that lists templates
+template_catalog = TemplateCatalog()
+document_catalog = DocumentCatalog()
+document_id_catalog = DocumentIdCatalog()
+archive_index = ArchiveIndex()
+content_catalog = ContentHashCatalog()
+
+def is_packed(path):
+    """Registry paths of archived files look like archive/pack-0001.pack#documents/X.pdf."""
+    return bool(path) and "#" in path and path.split("#", 1)[0].endswith(".pack")
+
+def packed_member(path):
+    return path.split("#", 1)[1]
+
+def stored_file_exists(path, cache=None):
+    """Existence check that understands archived paths; loose files go through cache if given."""
+    if is_packed(path):
+        return archive_index.lookup(packed_member(path)) is not None
+    if cache is not None:
+        return cache.exists(path)
+    return bool(path) and os.path.exists(path)
+
+def iter_packed_member(path, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """Yield the decompressed bytes of one archived file, reading only its slice of the pack."""
+    entry = archive_index.lookup(packed_member(path))
+    if entry is None:
+        raise FileNotFoundError(f"Not in archive index: {path}")
+    pack_file, offset, length, _ = entry
+    decompressor = zlib.decompressobj()
+    with open(pack_file, "rb") as f:
+        f.seek(offset)
+        remaining = length
+        while remaining:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                raise IOError(f"Pack file truncated: {pack_file}")
+            remaining -= len(chunk)
+            yield decompressor.decompress(chunk)
+    yield decompressor.flush()
+
+def read_stored_bytes(path):
+    """Read a loose or archived file completely (used for small parameter files)."""
+    if is_packed(path):
+        return b"".join(iter_packed_member(path))
+    with open(path, "rb") as f:
+        return f.read()
+
+def materialize_stored_file(path):
+    """Return a real filesystem path for a stored file, extracting archived ones to temp/archive/."""
+    if not is_packed(path):
+        return path
+    target = os.path.join(TEMP_TEX_DIR, "archive", os.path.basename(packed_member(path)))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, "wb") as f:
+        for chunk in iter_packed_member(path):
+            f.write(chunk)
+    return target
+
+def current_pack_file():
+    """The pack file new members are appended to; rolls over at ARCHIVE_PACK_SIZE."""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    packs = sorted(name for name in os.listdir(ARCHIVE_DIR) if name.endswith(".pack"))
+    if packs:
+        latest = os.path.join(ARCHIVE_DIR, packs[-1])
+        if os.path.getsize(latest) < ARCHIVE_PACK_SIZE:
+            return latest
+        number = int(packs[-1][len("pack-"):-len(".pack")]) + 1
+    else:
+        number = 1
+    return os.path.join(ARCHIVE_DIR, f"pack-{number:04d}.pack")
+
+def append_to_pack(pack, source_path, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """Compress one file onto the end of an open pack; returns (offset, length, size, sha256)."""
+    offset = pack.seek(0, os.SEEK_END)
+    compressor = zlib.compressobj(6)
+    digest = hashlib.sha256()
+    size = 0
+    with open(source_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+            size += len(chunk)
+            pack.write(compressor.compress(chunk))
+    pack.write(compressor.flush())
+    return offset, pack.tell() - offset, size, digest.hexdigest()
+
+def iter_bounded(executor, fn, items, window):
+    """Yield fn(item) for every item as results complete, with at most window tasks queued."""
+    pending = set()
+    for item in items:
+        pending.add(executor.submit(fn, item))
+        if len(pending) >= window:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    for future in pending:
+        yield future.result()
+
+def snapshot_object_path(target, digest):
+    return os.path.join(target, "objects", digest[:2], digest)
+
+def store_snapshot_object(target, source_path, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """
+    Copy a file into the backup's content-addressed object store, hashing
+    it on the way. Returns (sha256, size); content already stored is not kept twice.
+    """
+    incoming = os.path.join(target, "objects", "incoming")
+    os.makedirs(incoming, exist_ok=True)
+    tmp_path = os.path.join(incoming, f"{os.getpid()}-{threading.get_ident()}.tmp")
+    digest = hashlib.sha256()
+    size = 0
+    with open(source_path, "rb") as src, open(tmp_path, "wb") as dst:
+        for chunk in iter(lambda: src.read(chunk_size), b""):
+            digest.update(chunk)
+            size += len(chunk)
+            dst.write(chunk)
+        dst.flush()
+        os.fsync(dst.fileno())
+    digest = digest.hexdigest()
+    object_path = snapshot_object_path(target, digest)
+    if os.path.exists(object_path):
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        os.replace(tmp_path, object_path)
+    return digest, size
+
+def extract_snapshot_object(target, digest, dest_path, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """Copy a stored object to dest_path + '.tmp', checking its hash; returns the temporary path."""
+    os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+    tmp_path = f"{dest_path}.tmp"
+    check = hashlib.sha256()
+    with open(snapshot_object_path(target, digest), "rb") as src, open(tmp_path, "wb") as dst:
+        for chunk in iter(lambda: src.read(chunk_size), b""):
+            check.update(chunk)
+            dst.write(chunk)
+        dst.flush()
+        os.fsync(dst.fileno())
+    if check.hexdigest() != digest:
+        os.remove(tmp_path)
+        raise ValueError(f"Backup object {digest} is corrupt (needed for {dest_path}).")
+    return tmp_path
+
+def list_snapshots(target):
+    """Snapshot IDs in the backup at target, oldest first."""
+    snapshots_dir = os.path.join(target, "snapshots")
+    if not os.path.isdir(snapshots_dir):
+        return []
+    return sorted(name[:-len(".csv")] for name in os.listdir(snapshots_dir) if name.endswith(".csv"))
+
+def load_snapshot_manifest(target, snapshot_id=None):
+    """(snapshot ID, manifest rows) of a snapshot, the latest one by default."""
+    snapshots = list_snapshots(target)
+    if not snapshots:
+        raise ValueError(f"'{target}' holds no snapshots.")
+    snapshot_id = snapshot_id or snapshots[-1]
+    if snapshot_id not in snapshots:
+        raise ValueError(f"No snapshot '{snapshot_id}' in '{target}' (available: {', '.join(snapshots)}).")
+    _, rows = read_registry(os.path.join(target, "snapshots", f"{snapshot_id}.csv"))
+    return snapshot_id, rows
+
+def write_csv_atomically(csv_file, headers, rows):
+    """Write a CSV outside the workspace (no registry lock) via a temporary file and rename."""
+    tmp_path = f"{csv_file}.tmp"
+    with open(tmp_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        writer.writerows(rows)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, csv_file)
+
+def snapshot_path_key(path):
+    return normalize_path(path).replace(os.sep, "/")
+
+def create_snapshot(target, workers=SNAPSHOT_WORKERS, progress=None):
     """
-    Validates that the custom format:
-    - Uses only supported tokens
-    - Contains {seq}
+    Back up the registries and the template, document, data and archive
+    folders to target as a new snapshot. Files are stored once per content
+    hash, so only new or changed content is copied; a file whose size and
+    modification time match the previous snapshot is not even read.
+    The registries are captured together first, under their locks, so the
+    snapshot's registries are from one point in time and every file they
+    reference (unless deleted meanwhile, which is reported) is backed up.
+    Returns a summary dict.
     """
-    allowed_tokens = {
-        "{TEMPLATE}", "{seq}",
-        "{YYYY}", "{YY}", "{MM}", "{DD}",
-        "{YYYYMMDD}", "{DDMMYYYY}", "{YYMMDD}"," {DDMMYY}","{YYYYMM}","{YYMM}"
-    }
+    # Partial copies left by an interrupted run
+    shutil.rmtree(os.path.join(target, "objects", "incoming"), ignore_errors=True)
+    previous = {}
+    if list_snapshots(target):
+        _, rows = load_snapshot_manifest(target)
+        previous = {row["Path"]: row for row in rows if row["Kind"] == "file"}
+    snapshot_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+    while os.path.exists(os.path.join(target, "snapshots", f"{snapshot_id}.csv")):
+        time.sleep(1)
+        snapshot_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+
+    entries = []
+    with contextlib.ExitStack() as locks:
+        for csv_file in sorted(SNAPSHOT_REGISTRIES):
+            locks.enter_context(RegistryLock(csv_file))
+        for csv_file in SNAPSHOT_REGISTRIES:
+            if os.path.exists(csv_file):
+                modified = os.stat(csv_file).st_mtime_ns
+                digest, size = store_snapshot_object(target, csv_file)
+                entries.append([snapshot_path_key(csv_file), "registry", digest, size, modified])
+
+    summary = {"snapshot": snapshot_id, "files": 0, "copied": 0, "copied_bytes": 0, "missing": []}
+    registry_keys = {entry[0] for entry in entries}
+
+    def back_up(path):
+        key = snapshot_path_key(path)
+        try:
+            stat = os.stat(path)
+            known = previous.get(key)
+            if (known and int(known["Size"]) == stat.st_size and int(known["Modified"]) == stat.st_mtime_ns
+                    and os.path.exists(snapshot_object_path(target, known["SHA-256"]))):
+                return [key, "file", known["SHA-256"], stat.st_size, stat.st_mtime_ns], False
+            digest, size = store_snapshot_object(target, path)
+        except FileNotFoundError:
+            return None, False  # deleted since the folders were listed
+        return [key, "file", digest, size, stat.st_mtime_ns], True
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        paths = set()
+        for root in SNAPSHOT_DIRS:
+            paths |= scan_tree_parallel(root, executor)
+        paths = sorted(path for path in paths
+                       if not path.endswith(SNAPSHOT_SKIP_SUFFIXES) and snapshot_path_key(path) not in registry_keys)
+        for entry, copied in iter_bounded(executor, back_up, paths, 4 * workers):
+            if entry is None:
+                continue
+            entries.append(entry)
+            summary["files"] += 1
+            if copied:
+                summary["copied"] += 1
+                summary["copied_bytes"] += entry[3]
+            if progress and summary["files"] % EXPORT_PROGRESS_EVERY == 0:
+                progress(summary["files"])
+
+    # Files the captured documents.csv references but that vanished before they were copied
+    stored = {entry[0] for entry in entries}
+    documents_entry = next((entry for entry in entries if entry[0] == snapshot_path_key(DOCUMENTS_CSV)), None)
+    if documents_entry:
+        with open(snapshot_object_path(target, documents_entry[2]), newline="") as f:
+            for row in csv.DictReader(f):
+                for path_key in ("Path to Generated PDF", "Path to Parameter File"):
+                    path = row[path_key]
+                    if is_packed(path):
+                        path = path.split("#", 1)[0]
+                    if path and snapshot_path_key(path) not in stored:
+                        summary["missing"].append(path)
+
+    os.makedirs(os.path.join(target, "snapshots"), exist_ok=True)
+    write_csv_atomically(os.path.join(target, "snapshots", f"{snapshot_id}.csv"), SNAPSHOT_MANIFEST_HEADERS, entries)
+    return summary
+
+def verify_snapshot(target, snapshot_id=None, full=False, workers=SNAPSHOT_WORKERS):
+    """
+    Check that every object a snapshot needs is in the backup and intact.
+    Objects unchanged (same size and modification time) since an earlier
+    verification found them intact are not read again, unless full.
+    Returns a summary dict with the missing and corrupt paths.
+    """
+    snapshot_id, rows = load_snapshot_manifest(target, snapshot_id)
+    verified_csv = os.path.join(target, SNAPSHOT_VERIFIED_CSV)
+    _, verified_rows = read_registry(verified_csv)
+    verified = {row["SHA-256"]: row for row in verified_rows}
+    sizes = {row["SHA-256"]: int(row["Size"]) for row in rows}
 
-    used_tokens = set(re.findall(r"\{[A-Z]+\}", fmt))
-    unknown = used_tokens - allowed_tokens
+    def check(digest):
+        try:
+            stat = os.stat(snapshot_object_path(target, digest))
+        except FileNotFoundError:
+            return digest, "missing", None
+        if stat.st_size != sizes[digest]:
+            return digest, "corrupt", None
+        known = verified.get(digest)
+        if not full and known and int(known["Size"]) == stat.st_size and int(known["Modified"]) == stat.st_mtime_ns:
+            return digest, "skipped", None
+        if file_sha256(snapshot_object_path(target, digest)) != digest:
+            return digest, "corrupt", None
+        return digest, "read", [digest, stat.st_size, stat.st_mtime_ns, datetime.now().strftime("%Y-%m-%d %H:%M:%S")]
+
+    outcomes = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for digest, outcome, verified_row in iter_bounded(executor, check, list(sizes), 4 * workers):
+            outcomes[digest] = outcome
+            if verified_row:
+                verified[digest] = dict(zip(SNAPSHOT_VERIFIED_HEADERS, verified_row))
+            elif outcome != "skipped":
+                verified.pop(digest, None)
+    write_csv_atomically(verified_csv, SNAPSHOT_VERIFIED_HEADERS,
+                         [[row[name] for name in SNAPSHOT_VERIFIED_HEADERS] for row in verified.values()])
+
+    summary = {"snapshot": snapshot_id, "objects": len(outcomes),
+               "read": sum(outcome == "read" for outcome in outcomes.values()),
+               "skipped": sum(outcome == "skipped" for outcome in outcomes.values()),
+               "missing": [], "corrupt": []}
+    for row in rows:
+        outcome = outcomes[row["SHA-256"]]
+        if outcome in ("missing", "corrupt"):
+            summary[outcome].append(row["Path"])
+    return summary
+
+def restore_snapshot(target, snapshot_id=None, into=".", registries_only=False, workers=SNAPSHOT_WORKERS):
+    """
+    Restore a snapshot into the workspace at into: files first, skipping
+    any whose size and modification time already match, then all registries
+    together under their locks, each swapped in with a journaled rename.
+    Files the snapshot does not know are left alone ('reconcile' lists them).
+    Every restored byte is checked against its hash. Returns a summary dict.
+    """
+    snapshot_id, rows = load_snapshot_manifest(target, snapshot_id)
+    summary = {"snapshot": snapshot_id, "restored": 0, "unchanged": 0, "registries": 0}
 
-    if unknown:
-        raise ValueError(f"Invalid token(s) in format: {', '.join(unknown)}")
+    def restore(row):
+        dest_path = os.path.join(into, *row["Path"].split("/"))
+        modified = int(row["Modified"])
+        try:
+            stat = os.stat(dest_path)
+            if stat.st_size == int(row["Size"]) and stat.st_mtime_ns == modified:
+                return False
+        except FileNotFoundError:
+            pass
+        tmp_path = extract_snapshot_object(target, row["SHA-256"], dest_path)
+        os.utime(tmp_path, ns=(modified, modified))
+        os.replace(tmp_path, dest_path)
+        return True
+
+    if not registries_only:
+        files = [row for row in rows if row["Kind"] == "file"]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for restored in iter_bounded(executor, restore, files, 4 * workers):
+                summary["restored" if restored else "unchanged"] += 1
+
+    registries = [row for row in rows if row["Kind"] == "registry"]
+    with contextlib.ExitStack() as locks:
+        for row in sorted(registries, key=lambda row: row["Path"]):
+            csv_file = os.path.join(into, *row["Path"].split("/"))
+            os.makedirs(os.path.dirname(csv_file) or ".", exist_ok=True)
+            locks.enter_context(RegistryLock(csv_file))
+        for row in registries:
+            csv_file = os.path.join(into, *row["Path"].split("/"))
+            tmp_path = extract_snapshot_object(target, row["SHA-256"], csv_file)
+            write_journal(csv_file, {"op": "replace", "tmp": tmp_path})
+            os.replace(tmp_path, csv_file)
+            os.remove(journal_path(csv_file))
+            summary["registries"] += 1
+    return summary
+
+def archive_documents(cutoff):
+    """
+    Move the PDFs and parameter files of documents generated before cutoff
+    (a datetime) into append-only compressed packs and repoint their rows.
+    A file several rows share is packed once, and every row referencing it
+    is repointed, newer ones included. Members are indexed before the
+    registry is rewritten, and loose files are deleted last, so an
+    interrupted run can be repeated safely.
+    Returns the number of documents archived.
+    """
+    _, rows = read_registry(DOCUMENTS_CSV)
+    candidates = []
+    for row in rows:
+        try:
+            generated = datetime.strptime(row["Date of Generation"], "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            continue
+        if generated < cutoff:
+            candidates.append(row)
+    if not candidates:
+        return 0
+
+    # One archiver at a time appends to the packs
+    with RegistryLock(ARCHIVE_INDEX_CSV):
+        pack_file = pack = None  # opened when the first member needs it
+        new_index_rows = []
+        packed = {}  # normalized loose path -> its pack reference
+        archived_loose = []
+        archived_ids = set()
+
+        def seal(pack):
+            if pack is None or pack.closed:
+                return
+            pack.flush()
+            os.fsync(pack.fileno())
+            pack.close()
 
-    if "{seq}" not in fmt:
-        raise ValueError("Format must include the {seq} token to ensure uniqueness.")
-    
-    if "{TEMPLATE}" not in fmt:
-        raise ValueError("Format must include the {TEMPLATE} token.")
-    
-def generate_unique_template_index(name, csv_file=TEMPLATES_CSV):
+        try:
+            for row in candidates:
+                for path_key in ("Path to Generated PDF", "Path to Parameter File"):
+                    path = row[path_key]
+                    if not path or is_packed(path):
+                        continue
+                    member = normalize_path(path)
+                    if member not in packed:
+                        if not os.path.exists(path):
+                            continue
+                        known = archive_index.lookup(member.replace(os.sep, "/"))
+                        if known is None or known[3] != file_sha256(path):
+                            if pack is None:
+                                pack_file = current_pack_file()
+                                pack = open(pack_file, "ab")
+                            offset, length, size, digest = append_to_pack(pack, path)
+                            new_index_rows.append([member.replace(os.sep, "/"), pack_file,
+                                                   offset, length, size, digest])
+                            known_pack = pack_file
+                            if offset + length >= ARCHIVE_PACK_SIZE:
+                                # Full: later members go into the next pack
+                                seal(pack)
+                                pack = None
+                        else:
+                            known_pack = known[0]  # already packed by an interrupted run
+                        packed[member] = f"{known_pack}#{member.replace(os.sep, '/')}"
+                        archived_loose.append(path)
+                    archived_ids.add(row["Document Index Number"])
+        finally:
+            seal(pack)
+
+        append_registry_rows(ARCHIVE_INDEX_CSV, ARCHIVE_INDEX_HEADERS, new_index_rows)
+
+    def repoint(row):
+        for path_key in ("Path to Generated PDF", "Path to Parameter File"):
+            reference = packed.get(normalize_path(row[path_key]))
+            if reference:
+                row = {**row, path_key: reference}
+        return row
+
+    if packed:
+        update_registry(DOCUMENTS_CSV, lambda rows: [repoint(row) for row in rows])
+    for path in archived_loose:
+        os.remove(path)
+        existence_cache.invalidate(path)
+    return len(archived_ids)
+
+class SuggestionPopup:
     """
-    Generate a unique abbreviation (acronym or prefix) for the template.
-    Avoids duplication with existing entries in templates.csv.
+    As-you-type suggestions in a list under an entry or combobox.
+    complete(text) returns the suggestions for the current text; picking one
+    (click, or Down then Return) calls on_pick(value), or by default
+    replaces the entry's text.
     """
-    # Step 1: Load existing index codes
-    existing = set()
-    if os.path.exists(csv_file):
-        with open(csv_file, newline="") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                existing.add(row["Template Index"])
 
-    # Step 2: Start with acronym logic
-    words = name.strip().split()
-    print(words)
-    if len(words) == 1:
-        base_code = words[0][:3].upper()
-    else:
-        base_code = ''.join(word[0] for word in words).upper()
+    def __init__(self, entry, complete, on_pick=None):
+        self.entry = entry
+        self.complete = complete
+        self.on_pick = on_pick
+        self.listbox = None
+        entry.bind("<KeyRelease>", self.update)
+        entry.bind("<Down>", self.focus_list)
+        entry.bind("<Escape>", self.hide)
+        entry.bind("<FocusOut>", lambda event: self.entry.after(200, self.hide_unless_focused))
+
+    def update(self, event=None):
+        if event is not None and event.keysym in ("Down", "Up", "Return", "Escape", "Tab"):
+            return
+        suggestions = self.complete(self.entry.get()) if self.entry.get() else []
+        if not suggestions:
+            self.hide()
+            return
+        toplevel = self.entry.winfo_toplevel()
+        if self.listbox is None:
+            self.listbox = tk.Listbox(toplevel, exportselection=False)
+            self.listbox.bind("<ButtonRelease-1>", self.pick)
+            self.listbox.bind("<Return>", self.pick)
+            self.listbox.bind("<Escape>", self.hide)
+        self.listbox.delete(0, "end")
+        for suggestion in suggestions:
+            self.listbox.insert("end", suggestion)
+        self.listbox.configure(height=len(suggestions))
+        self.listbox.place(
+            x=self.entry.winfo_rootx() - toplevel.winfo_rootx(),
+            y=self.entry.winfo_rooty() - toplevel.winfo_rooty() + self.entry.winfo_height(),
+            width=self.entry.winfo_width()
+        )
+        self.listbox.lift()
+
+    def focus_list(self, event=None):
+        if self.listbox is not None and self.listbox.winfo_ismapped():
+            self.listbox.focus_set()
+            self.listbox.selection_clear(0, "end")
+            self.listbox.selection_set(0)
+            self.listbox.activate(0)
+
+    def pick(self, event=None):
+        selection = self.listbox.curselection()
+        if not selection:
+            return
+        value = self.listbox.get(selection[0])
+        self.hide()
+        if self.on_pick:
+            self.on_pick(value)
+        else:
+            self.entry.delete(0, "end")
+            self.entry.insert(0, value)
+        self.entry.focus_set()
 
-    # Step 3: Check for uniqueness
-    code = base_code
-    suffix = 2
-    while code in existing:
-        code = f"{base_code}{suffix}"
-        suffix += 1
+    def hide(self, event=None):
+        if self.listbox is not None:
+            self.listbox.place_forget()
 
-    return code
+    def hide_unless_focused(self):
+        if self.listbox is not None and self.listbox.focus_get() is not self.listbox:
+            self.hide()
+
+def run_in_background(widget, work, on_done, on_error=None, on_progress=None, poll_ms=50):
+    """
+    Run work() on a daemon thread and deliver its result to on_done(result)
+    on the Tk thread, polling a queue with widget.after so that no Tk call is
+    ever made from the worker. With on_progress, work is called as
+    work(report) and every report(value) reaches on_progress(value).
+    """
+    results = queue.Queue()
 
+    def worker():
+        try:
+            if on_progress:
+                value = work(lambda progress: results.put(("progress", progress)))
+            else:
+                value = work()
+            results.put(("done", value))
+        except Exception as e:
+            results.put(("error", e))
+
+    def poll():
+        while True:
+            try:
+                kind, value = results.get_nowait()
+            except queue.Empty:
+                widget.after(poll_ms, poll)
+                return
+            if kind != "progress":
+                break
+            on_progress(value)
+        if kind == "done":
+            on_done(value)
+        elif on_error:
+            on_error(value)
+        else:
+            messagebox.showerror("Error", str(value))
 
+    threading.Thread(target=worker, daemon=True).start()
+    widget.after(poll_ms, poll)
 
 def ask_large_text(title="Input", prompt="Enter text:", initial_text="", width=60, height=5):
     """Safe large input window that sanitizes newline characters for CSV compatibility."""
@@ -393,6 +3915,16 @@ class ImportTemplateFrame(ctk.CTkFrame):
             hover_color="#1F6A8A"
         )
         self.btn_select.pack(pady=CTK_FRAME_PAD)
+
+        self.btn_partial = ctk.CTkButton(
+            self,
+            text="Select Shared Partial .tex File",
+            command=self.select_partial_file,
+            fg_color="#2A8CBB",
+            hover_color="#1F6A8A"
+        )
+        self.btn_partial.pack(pady=CTK_FRAME_PAD)
+        ctk.CTkLabel(self, text="Templates include a partial with {{> partial_name}}").pack()
         
     def select_template_file(self):
         file_path = filedialog.askopenfilename(
@@ -405,12 +3937,14 @@ class ImportTemplateFrame(ctk.CTkFrame):
             return
 
         save_path = None
+        link_existing = False
         try:
             with open(file_path, 'r') as f:
                 content = f.read()
-                placeholders = parse_placeholders(content)
+                expanded, partials = expand_partials(content)
+                placeholders = parse_placeholders(expanded)
                 
-                if validate_latex(content, placeholders):
+                if validate_latex(expanded, placeholders):
                     # template_name = simpledialog.askstring(
                     #     "Template Name",
                     #     "Enter template name (without extension):"
@@ -446,23 +3980,97 @@ class ImportTemplateFrame(ctk.CTkFrame):
                     if os.path.exists(save_path):
                         messagebox.showerror("Error", "Template name already exists!")
                         return
-                    
-                    save_template(content, save_path)
-                    add_csv_entry(
-                        index=generate_unique_template_index(template_name,TEMPLATES_CSV),
-                        name=template_name,
-                        desc=short_desc,
-                        template_path=save_path
-                    )
+
+                    duplicate = find_duplicate_template(content)
+                    link_existing = False
+                    if duplicate:
+                        answer = messagebox.askyesnocancel(
+                            "Duplicate Template",
+                            f"This file is identical to the existing template '{duplicate[0]}'.\n\n"
+                            f"Yes: register '{template_name}' as a link to it (no second copy)\n"
+                            "No: import a separate copy anyway"
+                        )
+                        if answer is None:
+                            return
+                        link_existing = answer
+
+                    if link_existing:
+                        save_path = duplicate[1]
+                    else:
+                        save_template(content, save_path)
+                        content_catalog.remember("template", text_sha256(content), save_path)
+                    record_template_dependencies(template_name, partials)
+                    # Hold the lock so another instance cannot take the same index
+                    with RegistryLock(TEMPLATES_CSV):
+                        add_csv_entry(
+                            index=generate_unique_template_index(template_name,TEMPLATES_CSV),
+                            name=template_name,
+                            desc=short_desc,
+                            template_path=save_path
+                        )
                     
                     messagebox.showinfo("Success", "Template imported successfully!")
                 
                 
         except Exception as e:
-            if save_path and os.path.exists(save_path):
+            if save_path and os.path.exists(save_path) and not link_existing:
                 os.remove(save_path)
             messagebox.showerror("Error", str(e))
 
+    def select_partial_file(self):
+        """Import or replace a shared partial, then rebuild whatever depends on it."""
+        file_path = filedialog.askopenfilename(
+            title="Select Shared Partial",
+            filetypes=[("LaTeX Files", "*.tex")],
+            initialdir=os.getcwd()
+        )
+        if not file_path:
+            return
+
+        partial_name = ask_wide_entry(
+            title="Partial Name",
+            prompt="Enter partial name (used as {{> name}} in templates):",
+            initial_value=os.path.splitext(os.path.basename(file_path))[0]
+        )
+        if not partial_name or not re.fullmatch(r"\w+", partial_name):
+            messagebox.showerror("Error", "Partial names may only contain letters, digits and underscores")
+            return
+
+        try:
+            with open(file_path, "r") as f:
+                content = f.read()
+            expand_partials(content, (partial_name,))  # reject missing includes and cycles early
+            save_path = partial_path(partial_name)
+            replacing = os.path.exists(save_path)
+            if replacing and not messagebox.askyesno("Replace Partial", f"Partial '{partial_name}' exists. Replace it?"):
+                return
+            save_template(content, save_path)
+
+            affected = templates_affected_by({partial_name})
+            if not replacing or not affected:
+                messagebox.showinfo("Success", f"Partial '{partial_name}' saved.")
+                return
+
+            invalidate_template_artifacts(affected)
+            if messagebox.askyesno(
+                "Rebuild Affected Documents",
+                f"{len(affected)} template(s) use '{partial_name}'. Rebuild their documents now?"
+            ):
+                run_in_background(
+                    self,
+                    lambda: rebuild_for_changed_partials({partial_name}),
+                    self.show_rebuild_result
+                )
+        except Exception as e:
+            messagebox.showerror("Error", str(e))
+
+    def show_rebuild_result(self, outcome):
+        affected, rebuilt, failed = outcome
+        msg = f"Rebuilt {len(rebuilt)} document(s) of {len(affected)} template(s)."
+        if failed:
+            msg += f"\n\n{len(failed)} failed: {', '.join(sorted(failed)[:10])}"
+        messagebox.showinfo("Rebuild Complete", msg)
+
 class DocumentGenerationFrame(ctk.CTkFrame):
     def __init__(self, master, **kwargs):
         super().__init__(master, **kwargs)
@@ -470,7 +4078,6 @@ class DocumentGenerationFrame(ctk.CTkFrame):
         # Template Selection
         self.template_var = ctk.StringVar()
         self.templates = self.load_templates()  # Load templates from CSV
-        print(self.templates)  # Debugging line to check loaded templates
         self.template_label = ctk.CTkLabel(self, text="Select Template:")
         self.template_dropdown = ctk.CTkComboBox(
             self, 
@@ -479,9 +4086,28 @@ class DocumentGenerationFrame(ctk.CTkFrame):
             command=self.load_template_fields
         )
         
-        # Input Fields Container
-        self.input_fields_frame = ctk.CTkScrollableFrame(self, height=300)
+        # Input Fields Container, with the live preview beside it
+        self.fields_row = ctk.CTkFrame(self, fg_color="transparent")
+        self.input_fields_frame = ctk.CTkScrollableFrame(self.fields_row, height=300)
         self.input_fields = {}
+
+        self.preview_frame = ctk.CTkFrame(self.fields_row)
+        self.live_preview = ctk.BooleanVar(value=shutil.which("pdftoppm") is not None)
+        self.live_preview_checkbox = ctk.CTkCheckBox(
+            self.preview_frame,
+            text="Live preview",
+            variable=self.live_preview,
+            command=self.schedule_preview
+        )
+        self.preview_status = ctk.CTkLabel(self.preview_frame, text="", wraplength=300)
+        self.preview_label = tk.Label(self.preview_frame)
+        self.live_preview_checkbox.pack(pady=5)
+        self.preview_status.pack(pady=2)
+        self.preview_label.pack(pady=5)
+        self.preview_image = None
+        self.preview_after = None
+        self.preview_job = None
+        self.preview_seq = 0
         
         # Generate Button
         self.generate_btn = ctk.CTkButton(
@@ -498,8 +4124,61 @@ class DocumentGenerationFrame(ctk.CTkFrame):
         # Layout
         self.template_label.pack(pady=5)
         self.template_dropdown.pack(pady=5, fill="x")
-        self.input_fields_frame.pack(pady=10, fill="both", expand=True)
+        self.input_fields_frame.pack(side="left", fill="both", expand=True)
+        self.preview_frame.pack(side="right", fill="y", padx=(10, 0))
+        self.fields_row.pack(pady=10, fill="both", expand=True)
         self.generate_btn.pack(pady=10)
+
+        # Mail merge: many records of one template in a single LaTeX run
+        self.merge_frame = ctk.CTkFrame(self, fg_color="transparent")
+        self.merge_btn = ctk.CTkButton(
+            self.merge_frame,
+            text="Mail Merge from CSV...",
+            command=self.generate_merge,
+            fg_color="#2A8CBB",
+            hover_color="#1F6A8A"
+        )
+        self.combined_only = ctk.BooleanVar(value=False)
+        self.combined_only_checkbox = ctk.CTkCheckBox(
+            self.merge_frame,
+            text="Keep only the combined PDF (print run)",
+            variable=self.combined_only
+        )
+        self.sweep_btn = ctk.CTkButton(
+            self.merge_frame,
+            text="Generate Sweep...",
+            command=self.generate_sweep,
+            fg_color="#2A8CBB",
+            hover_color="#1F6A8A"
+        )
+        self.sweep_zip = ctk.BooleanVar(value=False)
+        self.sweep_zip_checkbox = ctk.CTkCheckBox(
+            self.merge_frame,
+            text="Pair sweep values in order",
+            variable=self.sweep_zip
+        )
+        self.merge_btn.pack(side="left", padx=5)
+        self.combined_only_checkbox.pack(side="left", padx=5)
+        self.sweep_btn.pack(side="left", padx=5)
+        self.sweep_zip_checkbox.pack(side="left", padx=5)
+        self.cancel_btn = ctk.CTkButton(
+            self.merge_frame,
+            text="Cancel",
+            command=self.cancel_active_job,
+            state="disabled",
+            fg_color="#B03A2E",
+            hover_color="#7B241C"
+        )
+        self.cancel_btn.pack(side="left", padx=5)
+        self.merge_frame.pack(pady=5)
+        self.sweep_status = ctk.CTkLabel(
+            self,
+            text="Sweep: write several values in a field as A | B | C, a range as 1..10 (or 0..1..0.25), "
+                 "or @file.csv:Column",
+            text_color="gray"
+        )
+        self.sweep_status.pack(pady=(0, 5))
+        self.active_jobs = {}
         # Custom ID Option
         self.use_custom_id = ctk.BooleanVar(value=False)
         self.custom_id_checkbox = ctk.CTkCheckBox(
@@ -524,6 +4203,13 @@ class DocumentGenerationFrame(ctk.CTkFrame):
 
         self.error_log.pack(pady=10, fill="x")
 
+        template_catalog.subscribe(self.on_templates_changed)
+        SuggestionPopup(self.template_dropdown, template_catalog.complete_name, on_pick=self.pick_template)
+
+    def pick_template(self, template_name):
+        self.template_var.set(template_name)
+        self.load_template_fields(template_name)
+
     def toggle_custom_id(self):
         if self.use_custom_id.get():
             self.custom_id_entry.configure(state="normal")
@@ -532,22 +4218,36 @@ class DocumentGenerationFrame(ctk.CTkFrame):
             self.custom_id_entry.configure(state="readonly")
 
 
+    def set_active_job(self, kind, job):
+        """
+        Track the running "generate", "merge" or "sweep" job. One of each may
+        run at a time, so a single document can still be generated during a merge.
+        """
+        if job is None:
+            self.active_jobs.pop(kind, None)
+        else:
+            self.active_jobs[kind] = job
+        button = {"generate": self.generate_btn, "merge": self.merge_btn, "sweep": self.sweep_btn}[kind]
+        button.configure(state="disabled" if job else "normal")
+        self.cancel_btn.configure(state="normal" if self.active_jobs else "disabled")
+
+    def cancel_active_job(self):
+        for job in list(self.active_jobs.values()):
+            job.cancel()
+
     def update_template_dropdown(self):
-        """Update the template dropdown with the latest templates."""
-        self.templates = self.load_templates()  # Reload templates from CSV
+        """Update the template dropdown if templates.csv changed since the last look."""
+        template_catalog.refresh()
+
+    def on_templates_changed(self, catalog):
+        """Catalog subscriber: keep the dropdown in step with templates.csv."""
+        self.templates = catalog.templates()
         template_names = [tpl[1] for tpl in self.templates]
         self.template_dropdown.configure(values=template_names)  # Update dropdown values
+
     def load_templates(self):
-        """Load templates from index.csv"""
-        templates = []
-        if os.path.exists(TEMPLATES_CSV):
-            with open(TEMPLATES_CSV, "r") as f:
-                reader = csv.reader(f)
-                next(reader)  # Skip header
-                for row in reader:
-                    if len(row) >= 5:
-                        templates.append((row[0],row[1], row[4]))  # (name, path)
-        return templates
+        """Load templates from the shared templates.csv catalog"""
+        return template_catalog.templates()
 
     def load_regeneration_data(self, row_data, edit_mode=False):
         self.template_var.set(row_data["Template Type Name"])
@@ -555,20 +4255,15 @@ class DocumentGenerationFrame(ctk.CTkFrame):
 
         # Load parameters from .txt
         param_file = row_data["Path to Parameter File"]
-        if not os.path.exists(param_file):
+        if not stored_file_exists(param_file):
             messagebox.showerror("Error", f"Parameter file missing: {param_file}")
             return
         try:
-            with open(param_file, "r") as f:
-                param_lines = f.readlines()
-                for line in param_lines:
-                    if "=" in line:
-                        key, val = line.split("=", 1)
-                        key = key.strip()
-                        val = val.strip()
-                        if key in self.input_fields:
-                            self.input_fields[key].delete(0, "end")
-                            self.input_fields[key].insert(0, val)
+            for key, val in read_parameter_file(param_file).items():
+                if key in self.input_fields:
+                    self.input_fields[key].delete(0, "end")
+                    self.input_fields[key].insert(0, val)
+            self.schedule_preview()
             if edit_mode:
                 self.editing_existing = True
                 self.document_id = row_data["Document Index Number"]
@@ -592,20 +4287,86 @@ class DocumentGenerationFrame(ctk.CTkFrame):
         template_path = next((tpl[2] for tpl in self.templates if tpl[1] == choice), None)
         
         if template_path and os.path.exists(template_path):
-            with open(template_path, "r") as f:
-                content = f.read()
-                placeholders = parse_placeholders(content)
+            try:
+                content = load_template_source(choice, template_path)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
+            placeholders = parse_placeholders(content)
+
+            for ph in placeholders:
+                frame = ctk.CTkFrame(self.input_fields_frame)
+                label = ctk.CTkLabel(frame, text=f"{ph}:")
+                entry = ctk.CTkEntry(frame)
                 
-                for ph in placeholders:
-                    frame = ctk.CTkFrame(self.input_fields_frame)
-                    label = ctk.CTkLabel(frame, text=f"{ph}:")
-                    entry = ctk.CTkEntry(frame)
-                    
-                    label.pack(side="left", padx=5)
-                    entry.pack(side="right", fill="x", expand=True)
-                    frame.pack(fill="x", pady=2)
-                    
-                    self.input_fields[ph] = entry
+                label.pack(side="left", padx=5)
+                entry.pack(side="right", fill="x", expand=True)
+                frame.pack(fill="x", pady=2)
+                entry.bind("<KeyRelease>", self.schedule_preview)
+                
+                self.input_fields[ph] = entry
+            self.schedule_preview()
+
+    def schedule_preview(self, event=None):
+        """Debounce: (re)start the preview timer on every keystroke."""
+        if self.preview_after is not None:
+            self.after_cancel(self.preview_after)
+            self.preview_after = None
+        if self.live_preview.get() and self.template_var.get():
+            self.preview_after = self.after(PREVIEW_DEBOUNCE_MS, self.start_preview)
+
+    def start_preview(self):
+        """Compile a draft of the current input, dropping any draft still in flight."""
+        self.preview_after = None
+        template_name = self.template_var.get()
+        template_path = next((tpl[2] for tpl in self.templates if tpl[1] == template_name), None)
+        if not template_path:
+            return
+        if shutil.which("pdftoppm") is None:
+            self.live_preview.set(False)
+            self.preview_status.configure(text="Live preview needs pdftoppm (poppler-utils).")
+            return
+        if self.preview_job is not None:
+            self.preview_job.cancel()
+        parameters = {ph: entry.get() for ph, entry in self.input_fields.items()}
+        job = CompileJob(template_name, "preview", PRIORITY_INTERACTIVE)
+        self.preview_job = job
+        self.preview_seq += 1
+        seq = self.preview_seq
+        self.preview_status.configure(text="Updating preview...")
+        # One preview at a time: a newer draft waits for the cancelled one to be killed
+        run_in_background(
+            self,
+            lambda: compile_scheduler.run(render_preview, template_name, template_path, parameters, job,
+                                          priority=PRIORITY_INTERACTIVE, group="preview", limit=1),
+            lambda outcome: self.show_preview(seq, outcome, template_name, template_path, parameters),
+            on_error=lambda e: self.show_preview_error(seq, job, e)
+        )
+
+    def show_preview(self, seq, outcome, template_name, template_path, parameters):
+        if seq != self.preview_seq:
+            return  # superseded by a newer draft
+        self.preview_job = None
+        result, png_path = outcome
+        if png_path is None:
+            if result.outcome == "timeout":
+                self.preview_status.configure(text="Preview timed out.")
+            elif result.outcome != "cancelled":
+                tex_path = os.path.join(preview_workspace(template_name), "preview.tex")
+                located = locate_compile_errors(result, tex_path, template_path, parameters)
+                self.preview_status.configure(
+                    text=describe_compile_error(*located[0]) if located else "The draft does not compile.")
+            return
+        self.preview_image = tk.PhotoImage(file=png_path)
+        self.preview_label.configure(image=self.preview_image)
+        self.preview_status.configure(text="Preview of page 1 (draft, not saved)")
+
+    def show_preview_error(self, seq, job, error):
+        if job.state == "queued":
+            job.finish("error")  # failed before it reached pdflatex
+        if seq == self.preview_seq:
+            self.preview_job = None
+            self.preview_status.configure(text=f"Preview failed: {error}")
 
     def generate_document(self):
         """Handle document generation process."""
@@ -619,6 +4380,7 @@ class DocumentGenerationFrame(ctk.CTkFrame):
             messagebox.showerror("Error", f"Missing values for: {', '.join(missing_fields)}")
             return
 
+        document_id = None
         try:
             # doc_description = simpledialog.askstring(
             #     "Document Description",
@@ -636,15 +4398,11 @@ class DocumentGenerationFrame(ctk.CTkFrame):
             # Get template content
             template_path = next(tpl[2] for tpl in self.templates if tpl[1] == self.template_var.get())
             template_index = next(tpl[0] for tpl in self.templates if tpl[1] == self.template_var.get())
-            with open(template_path, "r") as f:
-                content = f.read()
+            content = load_template_source(self.template_var.get(), template_path)
 
             # Replace placeholders with user input
-            parameters = {}  # Dictionary to store key-value pairs
-            for ph, entry in self.input_fields.items():
-                value = entry.get()
-                content = content.replace(f"{{{{{ph}}}}}", value)
-                parameters[ph] = value  # Save key-value pair
+            parameters = {ph: entry.get() for ph, entry in self.input_fields.items()}
+            content = fill_placeholders(content, parameters)
 
             # Create temp directory for LaTeX compilation
             os.makedirs(TEMP_TEX_DIR, exist_ok=True)
@@ -654,17 +4412,6 @@ class DocumentGenerationFrame(ctk.CTkFrame):
             with open(temp_tex, "w") as f:
                 f.write(content)
 
-            # Save parameters to a .txt file in the data subdirectory
-            os.makedirs("data", exist_ok=True)
-            param_file_name = f"{self.template_var.get()}_{datetime.now().strftime('%Y%m%d%H%M%S')}.txt"
-            param_file_path = os.path.join("data", param_file_name)
-            
-            with open(param_file_path, "w") as param_file:
-                for key, value in parameters.items():
-                    param_file.write(f"{key} = {value}\n")
-
-            # Compile LaTeX to PDF
-            os.makedirs(DOCUMENTS_DIR, exist_ok=True)
             # Ask user for custom prefix or use default
             custom_prefix = self.custom_id_entry.get().strip() if self.use_custom_id.get() else None
             if custom_prefix:
@@ -675,59 +4422,216 @@ class DocumentGenerationFrame(ctk.CTkFrame):
                     return
 
 
-            document_id = generate_document_id(self.template_var.get(),template_index, DOCUMENTS_CSV, custom_prefix)
+            document_id = generate_document_id(self.template_var.get(), template_index, custom_prefix)
             output_name = document_id  # Ensures uniqueness + clear reference
 
-            result = subprocess.run(
-                [
-                    "pdflatex",
-                    "-interaction=nonstopmode",
-                    f"-output-directory={DOCUMENTS_DIR}",
-                    f"-jobname={output_name}",
-                    f"./{TEMP_TEX_DIR}/{temp_tex}"
-                ],
-                capture_output=True,
-                text=True
+            # Save parameters to a .txt file in the data subdirectory
+            param_file_path, pdf_path = document_paths(document_id, self.template_var.get(), template_index)
+            param_file_path = write_parameter_file(param_file_path, parameters)
+
+            # An identical render is linked instead of compiled again
+            key = render_key(content)
+            identical_pdf = find_identical("render", key)
+            template_name = self.template_var.get()
+
+            def finish(result, pdf_path=pdf_path):
+                self.set_active_job("generate", None)
+                # Check compilation result
+                if result.outcome == "cancelled":
+                    release_document_ids([document_id])
+                    messagebox.showinfo("Cancelled", "Document generation was cancelled.")
+                elif result.returncode != 0:
+                    release_document_ids([document_id])
+                    self.show_error_log(explain_compile_errors(result, temp_tex, template_path, parameters))
+                    messagebox.showerror("Compilation Error", "Failed to generate PDF. Check error log.")
+                else:
+                    if not identical_pdf:
+                        content_catalog.remember("render", key, pdf_path)
+                    # Update index.csv with parameter file reference
+                    self.update_index(output_name, param_file_path, doc_description, pdf_path, template_name)
+                    messagebox.showinfo("Success", f"Document generated: {output_name}.pdf")
+                    if os.name == 'nt':
+                        os.startfile(pdf_path)
+                    elif os.name == 'posix':
+                        subprocess.Popen(['xdg-open', pdf_path])
+                    else:
+                        subprocess.Popen(['open', pdf_path])
+
+            def failed(error):
+                release_document_ids([document_id])
+                self.job_failed("generate", error)
+
+            if identical_pdf:
+                finish(CompileResult([], 0, "", []), link_or_reference(identical_pdf, pdf_path))
+                return
+
+            # Compile LaTeX to PDF off the UI thread, ahead of any queued batch work
+            job = CompileJob(template_name, "generate", PRIORITY_INTERACTIVE)
+            self.set_active_job("generate", job)
+            run_in_background(
+                self,
+                lambda: compile_scheduler.run(compile_latex, temp_tex, os.path.dirname(pdf_path), output_name,
+                                              job=job, priority=PRIORITY_INTERACTIVE),
+                finish,
+                on_error=failed
             )
 
-            # Check compilation result
-            if result.returncode != 0:
-                self.show_error_log(result.stderr)
-                messagebox.showerror("Compilation Error", "Failed to generate PDF. Check error log.")
-            else:
-                # Update index.csv with parameter file reference
-                self.update_index(output_name, param_file_path, doc_description)
-                messagebox.showinfo("Success", f"Document generated: {output_name}.pdf")
-                pdf_path = os.path.join(DOCUMENTS_DIR, f"{output_name}.pdf")
-                if os.name == 'nt':
-                    os.startfile(pdf_path)
-                elif os.name == 'posix':
-                    subprocess.Popen(['xdg-open', pdf_path])
+        except Exception as e:
+            if document_id:
+                release_document_ids([document_id])
+            messagebox.showerror("Error", str(e))
+
+    def job_failed(self, kind, error):
+        job = self.active_jobs.get(kind)
+        if job is not None and job.state == "queued":
+            job.finish("error")  # failed before it reached pdflatex
+        self.set_active_job(kind, None)
+        if isinstance(error, RuntimeError):
+            self.show_error_log(str(error))
+            messagebox.showerror("Compilation Error", "Generation failed. Check error log.")
+        else:
+            messagebox.showerror("Error", str(error))
+
+    def generate_merge(self):
+        """Render every row of a CSV file through the selected template in one compile."""
+        if not self.template_var.get():
+            messagebox.showerror("Error", "Please select a template first!")
+            return
+
+        csv_path = filedialog.askopenfilename(
+            title="Select Mail Merge Data",
+            filetypes=[("CSV Files", "*.csv")],
+            initialdir=os.getcwd()
+        )
+        if not csv_path:
+            return
+
+        try:
+            custom_prefix = self.custom_id_entry.get().strip() if self.use_custom_id.get() else None
+            if custom_prefix:
+                validate_custom_id_format(custom_prefix)
+
+            doc_description = None
+            if not self.combined_only.get():
+                doc_description = ask_large_text(
+                    title="Document Description",
+                    prompt="Enter a short description for the merged documents\n"
+                           "(a 'Short Description' column in the CSV overrides it per row):"
+                )
+                if not doc_description:
+                    messagebox.showerror("Error", "Description cannot be empty!")
+                    return
+
+            template_path = next(tpl[2] for tpl in self.templates if tpl[1] == self.template_var.get())
+            template_index = next(tpl[0] for tpl in self.templates if tpl[1] == self.template_var.get())
+            template_name = self.template_var.get()
+            combined_only = self.combined_only.get()
+            job = CompileJob(template_name, "merge", PRIORITY_BATCH)
+
+            def done(outcome):
+                self.set_active_job("merge", None)
+                if combined_only:
+                    messagebox.showinfo("Success", f"Combined PDF generated: {outcome}")
                 else:
-                    subprocess.Popen(['open', pdf_path])
+                    messagebox.showinfo("Success", f"{len(outcome)} documents generated ({outcome[0]} to {outcome[-1]}).")
+
+            self.set_active_job("merge", job)
+            run_in_background(
+                self,
+                lambda: generate_merged_documents(
+                    template_name,
+                    template_index,
+                    template_path,
+                    load_merge_records(csv_path),
+                    doc_description,
+                    custom_format=custom_prefix,
+                    combined_only=combined_only,
+                    job=job,
+                    batch_input=os.path.abspath(csv_path)
+                ),
+                done,
+                on_error=lambda e: self.job_failed("merge", e)
+            )
 
         except Exception as e:
             messagebox.showerror("Error", str(e))
 
+    def generate_sweep(self):
+        """Generate one document per combination of the values written in the fields."""
+        if not self.template_var.get():
+            messagebox.showerror("Error", "Please select a template first!")
+            return
 
-    def update_index(self, output_name, param_file_path, doc_description):
-        """Update index.csv with new document entry."""
-        next_index = get_next_index(DOCUMENTS_CSV)
-        current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        pdf_path = os.path.join(DOCUMENTS_DIR, f"{output_name}.pdf")
-
-        new_row = [
-            output_name,
-            self.template_var.get(),
-            current_date,
-            doc_description, 
-            param_file_path,
-            pdf_path
-        ]
+        missing_fields = [ph for ph, entry in self.input_fields.items() if not entry.get()]
+        if missing_fields:
+            messagebox.showerror("Error", f"Missing values for: {', '.join(missing_fields)}")
+            return
+
+        try:
+            custom_prefix = self.custom_id_entry.get().strip() if self.use_custom_id.get() else None
+            if custom_prefix:
+                validate_custom_id_format(custom_prefix)
+
+            specs = {ph: entry.get() for ph, entry in self.input_fields.items()}
+            mode = "zip" if self.sweep_zip.get() else "product"
+            values = {ph: parse_sweep_values(spec) for ph, spec in specs.items()}
+            if mode == "zip":
+                next(iter_sweep_records(values, mode), None)  # length mismatches raise here
+            count = count_sweep_records(values, mode)
+            if not messagebox.askyesno("Generate Sweep", f"Generate up to {count} documents?"):
+                return
+
+            doc_description = ask_large_text(
+                title="Document Description",
+                prompt="Enter a short description for the sweep\n"
+                       "(each document adds its own values; reuse it to resume a sweep):"
+            )
+            if not doc_description:
+                messagebox.showerror("Error", "Description cannot be empty!")
+                return
+
+            template_path = next(tpl[2] for tpl in self.templates if tpl[1] == self.template_var.get())
+            template_index = next(tpl[0] for tpl in self.templates if tpl[1] == self.template_var.get())
+            template_name = self.template_var.get()
+            job = CompileJob(template_name, "sweep", PRIORITY_BATCH)
+
+            def done(summary):
+                self.set_active_job("sweep", None)
+                report = format_sweep_summary(summary)
+                self.sweep_status.configure(text=report.split("\n")[0])
+                if summary["failed"]:
+                    self.show_error_log(report)
+                    messagebox.showwarning("Sweep", "Some combinations failed. Check error log.")
+                else:
+                    messagebox.showinfo("Sweep", report)
+
+            self.set_active_job("sweep", job)
+            run_in_background(
+                self,
+                lambda report: run_sweep(
+                    template_name,
+                    template_index,
+                    template_path,
+                    specs,
+                    doc_description,
+                    mode=mode,
+                    custom_format=custom_prefix,
+                    progress=report,
+                    job=job
+                ),
+                done,
+                on_error=lambda e: self.job_failed("sweep", e),
+                on_progress=lambda text: self.sweep_status.configure(text=f"Sweep: {text}")
+            )
+
+        except Exception as e:
+            messagebox.showerror("Error", str(e))
 
-        with open(DOCUMENTS_CSV, "a", newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow(new_row)
+    def update_index(self, output_name, param_file_path, doc_description, pdf_path=None, template_name=None):
+        """Update index.csv with new document entry."""
+        pdf_path = pdf_path or os.path.join(DOCUMENTS_DIR, f"{output_name}.pdf")
+        template_name = template_name or self.template_var.get()
+        add_document_entry(output_name, template_name, doc_description, param_file_path, pdf_path)
 
     def show_error_log(self, log):
         """Display LaTeX compilation errors."""
@@ -764,40 +4668,145 @@ class SearchDocumentFrame(ctk.CTkFrame):
         ctk.CTkLabel(filter_frame, text="Short Description").grid(row=0, column=2, sticky="w", padx=5)
         ctk.CTkLabel(filter_frame, text="Template Type").grid(row=0, column=3, sticky="w", padx=5)
 
-        ctk.CTkEntry(filter_frame, textvariable=self.search_vars["index"]).grid(row=1, column=0, padx=5, pady=5, sticky="ew")
-        ctk.CTkEntry(filter_frame, textvariable=self.search_vars["date"]).grid(row=1, column=1, padx=5, pady=5, sticky="ew")
-        ctk.CTkEntry(filter_frame, textvariable=self.search_vars["desc"]).grid(row=1, column=2, padx=5, pady=5, sticky="ew")
+        self.index_entry = ctk.CTkEntry(filter_frame, textvariable=self.search_vars["index"])
+        self.index_entry.grid(row=1, column=0, padx=5, pady=5, sticky="ew")
+        self.date_entry = ctk.CTkEntry(filter_frame, textvariable=self.search_vars["date"])
+        self.date_entry.grid(row=1, column=1, padx=5, pady=5, sticky="ew")
+        self.desc_entry = ctk.CTkEntry(filter_frame, textvariable=self.search_vars["desc"])
+        self.desc_entry.grid(row=1, column=2, padx=5, pady=5, sticky="ew")
         self.type_dropdown = ctk.CTkComboBox(filter_frame, values=[], variable=self.search_vars["type"])
         self.type_dropdown.grid(row=1, column=3, padx=5, pady=5, sticky="ew")
 
-        # Search Button
-        ctk.CTkButton(self, text="Search", command=self.perform_search).grid(row=2, column=0, pady=10)
+        # As-you-type suggestions and filtering, answered from the catalog's prefix tries
+        SuggestionPopup(self.index_entry, lambda text: document_catalog.complete("index", text))
+        SuggestionPopup(self.type_dropdown, lambda text: document_catalog.complete("type", text))
+        SuggestionPopup(self.desc_entry, self.complete_description, on_pick=self.pick_description_word)
+        for widget in (self.index_entry, self.date_entry, self.desc_entry, self.type_dropdown):
+            widget.bind("<KeyRelease>", self.schedule_live_filter)
+        self.live_filter_after = None
+
+        # Search / Export Buttons
+        action_frame = ctk.CTkFrame(self, fg_color="transparent")
+        action_frame.grid(row=2, column=0, pady=10)
+        ctk.CTkButton(action_frame, text="Search", command=self.perform_search).pack(side="left", padx=5)
+        self.export_btn = ctk.CTkButton(action_frame, text="Export Results...", command=self.export_results)
+        self.export_btn.pack(side="left", padx=5)
+        self.export_status = ctk.CTkLabel(action_frame, text="")
+        self.export_status.pack(side="left", padx=5)
 
         # Scrollable result view
         self.result_frame = ctk.CTkScrollableFrame(self, height=300)
         self.result_frame.grid(row=3, column=0, sticky="nsew", padx=10, pady=10)
         self.result_frame.grid_columnconfigure(0, weight=1)
 
-        # Load template types for dropdown
-        self.load_template_types()
+        # Identifies the latest search so a stale background file check is ignored
+        self.search_token = 0
+        self.live_filter_token = 0
+        self.catalog_waiting = None  # callbacks of the catalog refresh in flight
+
+        # Load template types for dropdown, and the tries for suggestions
+        document_catalog.subscribe(self.on_documents_changed)
+        self.refresh_catalog(build_index=True)
 
 
     def load_template_types(self):
-        types = set()
-        if os.path.exists("documents.csv"):
-            with open("documents.csv", newline="") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    types.add(row["Template Type Name"])
-        self.type_dropdown.configure(values=[""] + sorted(types))
+        """Refresh the template type dropdown if documents.csv changed."""
+        self.refresh_catalog()
+
+    def refresh_catalog(self, then=None, build_index=False):
+        """
+        Bring document_catalog up to date on a worker thread (a full parse
+        of a large documents.csv, as after a delete, takes seconds), then
+        notify its subscribers and call then() on the Tk thread. A request
+        made while a refresh is running waits for that one, so the catalog
+        is never read on the Tk thread while a worker changes it.
+        """
+        if self.catalog_waiting is not None:
+            self.catalog_waiting.append(then)
+            return
+        self.catalog_waiting = [then]
+
+        def work():
+            changed = document_catalog.refresh(notify=False)
+            if build_index:
+                document_catalog.build_search_index()
+            return changed
+
+        def done(changed):
+            waiting, self.catalog_waiting = self.catalog_waiting, None
+            if changed:
+                document_catalog.notify()
+            else:
+                self.on_documents_changed(document_catalog)
+            for callback in filter(None, waiting):
+                callback()
+
+        def failed(error):
+            self.catalog_waiting = None
+            messagebox.showerror("Error", f"Could not read documents.csv: {error}")
+
+        run_in_background(self, work, done, failed)
+
+    def on_documents_changed(self, catalog):
+        self.type_dropdown.configure(values=[""] + sorted(catalog.template_names))
+
+    def complete_description(self, text):
+        """Suggest completions of the word being typed in the description filter."""
+        words = text.split()
+        if not words or text[-1].isspace():
+            return []
+        head = text[:len(text) - len(words[-1])]
+        return [head + word for word in document_catalog.complete("desc", words[-1])]
+
+    def pick_description_word(self, value):
+        self.search_vars["desc"].set(value + " ")
+        self.desc_entry.icursor("end")
+        self.live_filter()
+
+    def schedule_live_filter(self, event=None):
+        if self.live_filter_after is not None:
+            self.after_cancel(self.live_filter_after)
+        self.live_filter_after = self.after(LIVE_FILTER_DELAY_MS, self.live_filter)
+
+    def live_filter(self):
+        """
+        Incremental filtering: narrow by ID prefix, template name prefix and
+        description word prefixes with the catalog's tries, apply the full
+        filters to candidates until LIVE_FILTER_ROWS rows match, and count
+        up to LIVE_FILTER_COUNT_LIMIT further candidates for the note.
+        Search still scans everything (and matches substrings anywhere).
+        The catalog is refreshed in the background first.
+        """
+        self.live_filter_after = None
+        self.live_filter_token += 1
+        token = self.live_filter_token
+        self.refresh_catalog(lambda: self.apply_live_filter(token))
+
+    def apply_live_filter(self, token):
+        if token != self.live_filter_token:
+            return  # typed again meanwhile; the newer filter runs instead
+        filters = self.current_filters()
+        words = [word for word in re.findall(r"\w+", (filters["desc"] or "").lower())]
+        candidates = document_catalog.matching_ids(
+            index=filters["index"].strip(), type_prefix=filters["type"].strip(), words=words)
+        if candidates is None:
+            return  # nothing typed that the tries can narrow; wait for Search
+        matches = []
+        for row in document_catalog.rows(candidates):
+            if document_matches(row, filters):
+                matches.append(row)
+                if len(matches) >= LIVE_FILTER_ROWS:
+                    break
+        note = None
+        more = sum(1 for _ in itertools.islice(candidates, LIVE_FILTER_COUNT_LIMIT))
+        if more:
+            more = f"{more}+" if more == LIVE_FILTER_COUNT_LIMIT else more
+            note = f"Showing the first matches; up to {more} more. Press Search for the full list."
+        self.show_results(matches, note)
 
     def perform_search(self):
-        # Clear previous results
-        for widget in self.result_frame.winfo_children():
-            widget.destroy()
-
         if not os.path.exists("documents.csv"):
-            ctk.CTkLabel(self.result_frame, text="No documents found.").pack()
+            self.show_results([], empty_text="No documents found.")
             return
 
         with open("documents.csv", newline="") as f:
@@ -808,25 +4817,98 @@ class SearchDocumentFrame(ctk.CTkFrame):
                 if self.filter_row(row):
                     matches.append(row)
 
+        self.show_results(matches)
+
+    def show_results(self, matches, note=None, empty_text="No matches found."):
+        # Clear previous results
+        for widget in self.result_frame.winfo_children():
+            widget.destroy()
+
         if not matches:
-            ctk.CTkLabel(self.result_frame, text="No matches found.").pack()
+            ctk.CTkLabel(self.result_frame, text=empty_text).pack()
             return
+        if note:
+            ctk.CTkLabel(self.result_frame, text=note, text_color="gray").pack()
+
+        entry_frames = [self.add_result_row(i, row) for i, row in enumerate(matches, start=1)]
+        self.check_result_files(matches, entry_frames)
+
+    def check_result_files(self, matches, entry_frames):
+        """Look up the result files off the UI thread, then annotate each row."""
+        self.search_token += 1
+        token = self.search_token
+
+        def check():
+            existence_cache.begin_pass()
+            return [
+                (stored_file_exists(row["Path to Generated PDF"], existence_cache),
+                 stored_file_exists(row["Path to Parameter File"], existence_cache))
+                for row in matches
+            ]
+
+        def annotate(states):
+            if token != self.search_token:
+                return  # a newer search replaced these rows
+            for entry_frame, row, (pdf_exists, param_exists) in zip(entry_frames, matches, states):
+                if entry_frame.winfo_exists():
+                    self.annotate_result_row(entry_frame, row, pdf_exists, param_exists)
 
-        for i, row in enumerate(matches, start=1):
-            self.add_result_row(i, row)
+        run_in_background(self, check, annotate)
+
+    def current_filters(self):
+        return {key: var.get() for key, var in self.search_vars.items()}
 
     def filter_row(self, row):
-        idx = self.search_vars["index"].get().strip()
-        typ = self.search_vars["type"].get().strip()
-        date = self.search_vars["date"].get().strip()
-        desc = self.search_vars["desc"].get().strip().lower()
+        return document_matches(row, self.current_filters())
+
+    def export_results(self):
+        """Export every row matching the current filters, streamed on a worker thread."""
+        output = filedialog.asksaveasfilename(
+            title="Export Search Results",
+            defaultextension=".csv",
+            filetypes=[("CSV", "*.csv"), ("JSON Lines", "*.jsonl")]
+        )
+        if not output:
+            return
+        fmt = "jsonl" if output.lower().endswith(".jsonl") else "csv"
+
+        bundle_path = None
+        if messagebox.askyesno("Export Bundle", "Also write a ZIP bundle with the PDFs and parameter files?"):
+            bundle_path = filedialog.asksaveasfilename(
+                title="Save ZIP Bundle",
+                defaultextension=".zip",
+                filetypes=[("ZIP Archive", "*.zip")]
+            )
+            if not bundle_path:
+                return
 
-        return all([
-            (not idx or idx.lower() in row["Document Index Number"].lower()),
-            (not typ or typ.lower() in row["Template Type Name"].lower()),
-            (not date or date in row["Date of Generation"]),
-            (not desc or desc in row["Short Description"].lower()),
-        ])
+        filters = self.current_filters()
+        self.export_btn.configure(state="disabled")
+        self.export_status.configure(text="Exporting...")
+
+        def done(outcome):
+            exported, bundled, missing = outcome
+            self.export_btn.configure(state="normal")
+            self.export_status.configure(text=f"Exported {exported} rows")
+            msg = f"Exported {exported} document rows to {output}."
+            if bundle_path:
+                msg += f"\n{bundled} files bundled into {bundle_path}."
+                if missing:
+                    msg += f"\n{missing} referenced files were missing."
+            messagebox.showinfo("Export Complete", msg)
+
+        def failed(error):
+            self.export_btn.configure(state="normal")
+            self.export_status.configure(text="Export failed")
+            messagebox.showerror("Error", f"Export failed: {error}")
+
+        run_in_background(
+            self,
+            lambda report: export_documents(filters, output, fmt, bundle_path, report),
+            done,
+            on_error=failed,
+            on_progress=lambda count: self.export_status.configure(text=f"Exported {count} rows...")
+        )
 
 
     def add_result_row(self, count, row):
@@ -835,8 +4917,15 @@ class SearchDocumentFrame(ctk.CTkFrame):
 
         summary = f"#{row['Document Index Number']} | {row['Template Type Name']} | {row['Date of Generation']} | {row['Short Description']}"
         ctk.CTkLabel(entry_frame, text=summary, anchor="w").pack(side="left", padx=5, expand=True, fill="x")
+        entry_frame.status_label = ctk.CTkLabel(entry_frame, text="checking files...", text_color="gray")
+        entry_frame.status_label.pack(side="right", padx=5)
+        return entry_frame
+
+    def annotate_result_row(self, entry_frame, row, pdf_exists, param_exists):
+        """Add the row actions once the background check knows which files exist."""
+        entry_frame.status_label.destroy()
 
-        if os.path.exists(row["Path to Generated PDF"]):
+        if pdf_exists:
             ctk.CTkButton(entry_frame, text="Open PDF", width=100,
                         command=lambda path=row["Path to Generated PDF"]: self.open_pdf(path)).pack(side="right", padx=5)
 
@@ -844,16 +4933,16 @@ class SearchDocumentFrame(ctk.CTkFrame):
             # NEW: Delete Button
             ctk.CTkButton(entry_frame, text=" Delete", width=60,
                         command=lambda r=row: self.delete_document(r)).pack(side="right", padx=4)
-        if os.path.exists(row["Path to Parameter File"]):
+        else:
+            ctk.CTkLabel(entry_frame, text="PDF not found", text_color="red").pack(side="right", padx=5)
+        if param_exists:
             ctk.CTkButton(entry_frame, text="Regenerate", width=100,
                         command=lambda r=row: self.master.master.show_regenerate_frame(r,edit_mode=False)).pack(side="right", padx=5)
                     # NEW: Edit Button
             ctk.CTkButton(entry_frame, text=" Edit", width=60,
                         command=lambda r=row: self.edit_document(r,True)).pack(side="right", padx=4)
-
-
         else:
-            ctk.CTkLabel(entry_frame, text="PDF not found", text_color="red").pack(side="right", padx=5)
+            ctk.CTkLabel(entry_frame, text="Parameters not found", text_color="red").pack(side="right", padx=5)
 
     def edit_document(self, row_data, mode):
         self.master.master.show_regenerate_frame(row_data, edit_mode=mode)
@@ -866,34 +4955,12 @@ class SearchDocumentFrame(ctk.CTkFrame):
         if not confirm:
             return
 
-        # Remove files
         try:
-            for path_key in ["Path to Generated PDF", "Path to Parameter File"]:
-                path = row_data.get(path_key)
-                if path and os.path.exists(path):
-                    os.remove(path)
-
-            # Remove .txt parameter file (might be stored in "Path to Template File" by mistake in current code)
-            # Check with Sir: if parameter file needs to be deleted
-            param_file = row_data.get("Path to Parameter File", "")
-            if param_file.endswith(".txt") and os.path.exists(param_file):
-                os.remove(param_file)
-
-            # Rewrite CSV without the deleted entry
-            updated_rows = []
-            with open(DOCUMENTS_CSV, newline="") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    if row["Document Index Number"] != row_data["Document Index Number"]:
-                        updated_rows.append(row)
-
-            with open(DOCUMENTS_CSV, "w", newline="") as f:
-                writer = csv.DictWriter(f, fieldnames=[
-                    "Document Index Number", "Template Type Name", "Date of Generation",
-                    "Short Description", "Path to Parameter File", "Path to Generated PDF"
-                ])
-                writer.writeheader()
-                writer.writerows(updated_rows)
+            # Rewrite the CSV without the entry (keeping rows other instances added
+            # meanwhile), then remove its PDF and parameter file; a deduplicated
+            # file shared with other rows stays until its last reference goes
+            delete_registry_row(DOCUMENTS_CSV, "Document Index Number", row_data["Document Index Number"],
+                                ("Path to Generated PDF", "Path to Parameter File"))
 
             messagebox.showinfo("Deleted", f"Document #{row_data['Document Index Number']} has been deleted.")
             self.perform_search()  # Refresh results
@@ -905,6 +4972,7 @@ class SearchDocumentFrame(ctk.CTkFrame):
 
     def open_pdf(self, path):
         try:
+            path = materialize_stored_file(path)
             if os.name == 'nt':
                 os.startfile(path)
             elif os.name == 'posix':
@@ -938,9 +5006,18 @@ class SearchTemplateFrame(ctk.CTkFrame):
         ctk.CTkLabel(filter_frame, text="Date of Import (YYYY-MM-DD)").grid(row=0, column=2, sticky="w", padx=5)
 
         # Inputs
-        ctk.CTkEntry(filter_frame, textvariable=self.search_vars["index"]).grid(row=1, column=0, padx=5, pady=5, sticky="ew")
-        ctk.CTkEntry(filter_frame, textvariable=self.search_vars["type"]).grid(row=1, column=1, padx=5, pady=5, sticky="ew")
-        ctk.CTkEntry(filter_frame, textvariable=self.search_vars["date"]).grid(row=1, column=2, padx=5, pady=5, sticky="ew")
+        entries = [
+            ctk.CTkEntry(filter_frame, textvariable=self.search_vars[key])
+            for key in ("index", "type", "date")
+        ]
+        for column, entry in enumerate(entries):
+            entry.grid(row=1, column=column, padx=5, pady=5, sticky="ew")
+
+        # Names complete as you type, and the (small) template list filters live
+        SuggestionPopup(entries[1], template_catalog.complete_name)
+        self.live_filter_after = None
+        for entry in entries:
+            entry.bind("<KeyRelease>", self.schedule_live_filter)
 
 
         # Search button
@@ -964,8 +5041,14 @@ class SearchTemplateFrame(ctk.CTkFrame):
     #                 template_types.add(row.get("Template Type Name", ""))
     #     self.type_dropdown.configure(values=sorted(list(template_types)))
 
+    def schedule_live_filter(self, event=None):
+        if self.live_filter_after is not None:
+            self.after_cancel(self.live_filter_after)
+        self.live_filter_after = self.after(LIVE_FILTER_DELAY_MS, self.perform_search)
+
     def perform_search(self):
         """Search templates.csv using filter criteria and populate results."""
+        self.live_filter_after = None
         # Clear previous results
         for widget in self.result_frame.winfo_children():
             widget.destroy()
@@ -993,6 +5076,7 @@ class SearchTemplateFrame(ctk.CTkFrame):
             ctk.CTkLabel(self.result_frame, text="No matching templates found.").pack(pady=10)
             return
 
+        entry_frames = []
         for row in results:
             row_text = f"{row['Template Index']} | {row['Template Type Name']} | {row['Date of Import']} | {row['Short Description']}"
             entry_frame = ctk.CTkFrame(self.result_frame)
@@ -1005,7 +5089,24 @@ class SearchTemplateFrame(ctk.CTkFrame):
 
             ctk.CTkButton(entry_frame, text="Delete", width=80,
                         command=lambda r=row: self.delete_template(r)).pack(side="right", padx=4)
-            
+            entry_frames.append(entry_frame)
+
+        self.check_template_files(results, entry_frames)
+
+    def check_template_files(self, results, entry_frames):
+        """Flag rows whose .tex file is missing, checked in the background."""
+        def check():
+            existence_cache.begin_pass()
+            return [existence_cache.exists(row.get("Path to Template File")) for row in results]
+
+        def annotate(states):
+            for entry_frame, exists in zip(entry_frames, states):
+                if not exists and entry_frame.winfo_exists():
+                    ctk.CTkLabel(entry_frame, text="Template file missing",
+                                 text_color="red").pack(side="right", padx=5)
+
+        run_in_background(self, check, annotate)
+
     def export_template(self, row_data):
         template_path = row_data.get("Path to Template File")
         if not template_path or not os.path.exists(template_path):
@@ -1029,7 +5130,6 @@ class SearchTemplateFrame(ctk.CTkFrame):
 
     def delete_template(self, row_data):
         template_name = row_data["Template Type Name"]
-        template_path = row_data.get("Path to Template File")
 
         # Check if template is in use by any document
         in_use = False
@@ -1050,25 +5150,12 @@ class SearchTemplateFrame(ctk.CTkFrame):
             return
 
         try:
-            # Remove the .tex file
-            if template_path and os.path.exists(template_path):
-                os.remove(template_path)
-
-            # Rewrite templates.csv without this row
-            updated_rows = []
-            with open(TEMPLATES_CSV, newline="") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    if row["Template Type Name"] != template_name:
-                        updated_rows.append(row)
-
-            with open(TEMPLATES_CSV, "w", newline="") as f:
-                writer = csv.DictWriter(f, fieldnames=[
-                    "Template Index", "Template Type Name", "Date of Import",
-                    "Short Description", "Path to Template File"
-                ])
-                writer.writeheader()
-                writer.writerows(updated_rows)
+            # Rewrite templates.csv without this row (keeping rows other instances
+            # added meanwhile), then remove the .tex file unless another template
+            # name links to it
+            delete_registry_row(TEMPLATES_CSV, "Template Type Name", template_name, ("Path to Template File",))
+            record_template_dependencies(template_name, [])
+            invalidate_template_artifacts([template_name])
 
             messagebox.showinfo("Deleted", f"Template '{template_name}' has been deleted.")
             # self.master.master.generate_frame.load_templates()
@@ -1079,7 +5166,315 @@ class SearchTemplateFrame(ctk.CTkFrame):
 
 
 
+def cmd_migrate_layout(args):
+    """CLI: move existing documents into a (new) storage layout."""
+    moved = migrate_storage_layout(args.layout)
+    print(f"Migration to '{args.layout}' layout complete: {moved} documents moved.")
+    if args.layout != STORAGE_LAYOUT:
+        print(f"Set LAXDOC_STORAGE_LAYOUT={args.layout} so new documents use the same layout.")
+    return 0
+
+def cmd_reconcile(args):
+    """CLI: report (and optionally fix) drift between the registries and the disk."""
+    report = scan_registry_drift(args.workers)
+    labels = {
+        "missing_pdf": "Document rows whose PDF is missing",
+        "missing_params": "Document rows whose parameter file is missing",
+        "missing_template": "Document rows whose template is not registered",
+        "template_file_missing": "Template rows whose .tex file is missing",
+        "orphan_pdfs": "Unregistered PDFs",
+        "orphan_params": "Unreferenced parameter files",
+        "byproducts": "Leftover LaTeX by-products",
+    }
+    for key, label in labels.items():
+        items = report[key]
+        print(f"{label}: {len(items)}")
+        shown = items if args.verbose else items[:5]
+        for item in shown:
+            if isinstance(item, dict):
+                item = item.get("Document Index Number") or item.get("Template Type Name")
+            print(f"    {item}")
+        if len(items) > len(shown):
+            print(f"    ... {len(items) - len(shown)} more (use --verbose)")
+
+    if args.remove_dead_rows or args.purge_byproducts or args.reregister:
+        changes = fix_registry_drift(report, args.remove_dead_rows, args.purge_byproducts, args.reregister)
+        print(f"Removed {changes['rows_removed']} dead rows, purged {changes['byproducts_purged']} by-products, "
+              f"re-registered {changes['pdfs_reregistered']} PDFs.")
+        if changes["orphans_left"]:
+            print(f"Left {changes['orphans_left']} unregistered PDFs whose template or parameter file "
+                  f"could not be found, or whose document is still being generated.")
+    return 0
+
+def cmd_rebuild(args):
+    """CLI: rebuild only the documents whose templates use changed partials."""
+    affected, rebuilt, failed = rebuild_for_changed_partials(args.partial, args.workers)
+    if not affected:
+        print("No templates depend on a changed partial; nothing to rebuild.")
+        return 0
+    print(f"Affected templates: {', '.join(sorted(affected))}")
+    print(f"Rebuilt {len(rebuilt)} document(s).")
+    for doc_id, (template_name, error) in sorted(failed.items()):
+        print(f"FAILED {doc_id} ({template_name}):\n{error}")
+    return 1 if failed else 0
+
+def cmd_archive(args):
+    """CLI: pack documents older than a cutoff date into the archive tier."""
+    try:
+        cutoff = datetime.strptime(args.before, "%Y-%m-%d")
+    except ValueError:
+        print("--before must be a date in YYYY-MM-DD format")
+        return 2
+    archived = archive_documents(cutoff)
+    print(f"Archived {archived} document(s) generated before {args.before}.")
+    return 0
+
+def cmd_export(args):
+    """CLI: stream matching documents to CSV/JSONL, optionally with a ZIP bundle."""
+    filters = {
+        "template": args.template,
+        "date_from": args.date_from,
+        "date_to": args.date_to,
+        "index": args.index,
+        "desc": args.desc,
+    }
+    output = sys.stdout if args.output == "-" else args.output
+    exported, bundled, missing = export_documents(
+        filters, output, args.format, args.zip,
+        progress=None if output is sys.stdout else lambda count: print(f"\r{count} rows exported", end="", file=sys.stderr)
+    )
+    print(f"\nExported {exported} rows; bundled {bundled} files ({missing} missing).", file=sys.stderr)
+    return 0
+
+def cmd_jobs(args):
+    """CLI: list queued and running compile jobs."""
+    jobs = list_compile_jobs()
+    if not jobs:
+        print("No queued or running compile jobs.")
+    for job in jobs:
+        print(f"{job['id']:<16} {job['state']:<8} {job.get('priority', '-'):<12} {job['label']:<10} "
+              f"{job['template'] or '-':<24} since {job['since']}")
+    return 0
+
+def cmd_cancel(args):
+    """CLI: cancel queued or running compile jobs, in any LaxDoc process."""
+    job_ids = [job["id"] for job in list_compile_jobs()] if args.all else args.job_ids
+    if not job_ids:
+        print("Nothing to cancel.")
+        return 1
+    status = 0
+    for job_id in job_ids:
+        if request_job_cancel(job_id):
+            print(f"Cancel requested for {job_id}")
+        else:
+            print(f"No such job: {job_id}")
+            status = 1
+    return status
+
+def cmd_compile_stats(args):
+    """CLI: per-template compile outcomes, worst offenders first."""
+    summary = summarize_compile_stats()
+    if not summary:
+        print("No compiles recorded yet.")
+        return 0
+
+    def badness(item):
+        outcomes = item[1]["outcomes"]
+        return -(outcomes.get("timeout", 0) + outcomes.get("cpu-limit", 0) + outcomes.get("output-limit", 0))
+
+    for template_name, entry in sorted(summary.items(), key=badness)[:args.top]:
+        outcomes = ", ".join(f"{name}={count}" for name, count in sorted(entry["outcomes"].items()))
+        print(f"{template_name:<30} runs={entry['runs']:<6} mean={entry['wall_total'] / entry['runs']:.1f}s "
+              f"max={entry['wall_max']:.1f}s  {outcomes}")
+
+    print("\nQueue wait per class:")
+    waits = summarize_queue_waits()
+    for priority in PRIORITY_CLASSES:
+        if priority in waits:
+            entry = waits[priority]
+            print(f"  {priority:<12} jobs={entry['jobs']:<6} mean={entry['mean']:.2f}s "
+                  f"p95={entry['p95']:.2f}s max={entry['max']:.2f}s")
+    return 0
+
+def cmd_sweep(args):
+    """CLI: generate one document per combination of field values."""
+    templates = load_template_paths()
+    if args.template not in templates:
+        print(f"No such template: {args.template}")
+        return 2
+    specs = {}
+    for assignment in args.set or []:
+        name, sep, spec = assignment.partition("=")
+        if not sep:
+            print(f"--set expects FIELD=VALUES, got '{assignment}'")
+            return 2
+        specs[name.strip()] = spec.strip()
+    if args.custom_format:
+        validate_custom_id_format(args.custom_format)
+    summary = run_sweep(
+        args.template, load_template_indices()[args.template], templates[args.template], specs,
+        args.description, mode="zip" if args.zip else "product", custom_format=args.custom_format,
+        progress=lambda text: print(f"\r{text}", end="", file=sys.stderr)
+    )
+    print(file=sys.stderr)
+    print(format_sweep_summary(summary))
+    return 1 if summary["failed"] or summary["cancelled"] else 0
+
+def cmd_snapshot(args):
+    """CLI: incremental backup of the workspace to a target directory."""
+    summary = create_snapshot(
+        args.target, args.workers,
+        progress=lambda count: print(f"\r{count} files checked", end="", file=sys.stderr)
+    )
+    print(file=sys.stderr)
+    print(f"Snapshot {summary['snapshot']}: {summary['files']} files, {summary['copied']} new or changed "
+          f"({summary['copied_bytes'] / 1024 / 1024:.1f} MiB copied).")
+    for path in summary["missing"]:
+        print(f"WARNING {path} is registered but was deleted before it could be backed up")
+    return 0
+
+def cmd_verify(args):
+    """CLI: check a snapshot's objects, reading only those not verified before."""
+    summary = verify_snapshot(args.target, args.snapshot, args.full, args.workers)
+    print(f"Snapshot {summary['snapshot']}: {summary['objects']} objects, {summary['read']} read, "
+          f"{summary['skipped']} unchanged since their last verification.")
+    for outcome in ("missing", "corrupt"):
+        for path in summary[outcome]:
+            print(f"{outcome.upper()} {path}")
+    return 1 if summary["missing"] or summary["corrupt"] else 0
+
+def cmd_restore(args):
+    """CLI: restore a snapshot's files and registries."""
+    summary = restore_snapshot(args.target, args.snapshot, args.into, args.registries_only, args.workers)
+    print(f"Restored snapshot {summary['snapshot']}: {summary['restored']} files written, "
+          f"{summary['unchanged']} already up to date, {summary['registries']} registries.")
+    return 0
+
+def cmd_batches(args):
+    """CLI: list merge and sweep batch journals with their row states, or discard some."""
+    if args.discard:
+        status = 0
+        for name in args.discard:
+            if discard_batch_journal(name):
+                print(f"Discarded {name}")
+            else:
+                print(f"No such batch: {name}")
+                status = 1
+        return status
+    batches = list_batch_journals()
+    if not batches:
+        print("No batch journals.")
+    for batch in batches:
+        counts = ", ".join(f"{state}={count}" for state, count in sorted(batch["counts"].items())) or "no rows yet"
+        closed = f" (closed {batch['closed']})" if batch.get("closed") else ""
+        print(f"{batch['file']:<32} {batch.get('template', '-'):<24} {batch.get('input', '-')}\n    {counts}{closed}")
+    return 0
+
+def build_cli_parser():
+    """Command line interface for maintenance tasks that do not need the GUI."""
+    parser = argparse.ArgumentParser(prog="laxdoc", description="LaxDoc maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate = subparsers.add_parser("migrate-layout", help="Move documents into a sharded storage layout")
+    migrate.add_argument("--layout", choices=STORAGE_LAYOUTS, default=STORAGE_LAYOUT,
+                         help="Target layout (default: LAXDOC_STORAGE_LAYOUT or flat)")
+    migrate.set_defaults(func=cmd_migrate_layout)
+
+    reconcile = subparsers.add_parser("reconcile", help="Find and fix drift between the registries and the files on disk")
+    reconcile.add_argument("--remove-dead-rows", action="store_true",
+                           help="Drop rows whose files are all gone")
+    reconcile.add_argument("--purge-byproducts", action="store_true",
+                           help="Delete leftover .aux/.log files in documents/")
+    reconcile.add_argument("--reregister", action="store_true",
+                           help="Register orphaned PDFs in documents.csv")
+    reconcile.add_argument("--workers", type=int, default=RECONCILE_WORKERS)
+    reconcile.add_argument("--verbose", action="store_true", help="List every finding")
+    reconcile.set_defaults(func=cmd_reconcile)
+
+    rebuild = subparsers.add_parser("rebuild", help="Rebuild documents affected by changed partials")
+    rebuild.add_argument("--partial", action="append",
+                         help="Treat this partial as changed (repeatable; default: detect by content hash)")
+    rebuild.add_argument("--workers", type=int, default=REBUILD_WORKERS)
+    rebuild.set_defaults(func=cmd_rebuild)
+
+    archive = subparsers.add_parser("archive", help="Pack old documents into compressed archive files")
+    archive.add_argument("--before", required=True, help="Archive documents generated before this date (YYYY-MM-DD)")
+    archive.set_defaults(func=cmd_archive)
+
+    export = subparsers.add_parser("export", help="Export matching documents as CSV/JSONL and a ZIP bundle")
+    export.add_argument("--template", help="Exact template name")
+    export.add_argument("--from", dest="date_from", help="First generation date, YYYY-MM-DD")
+    export.add_argument("--to", dest="date_to", help="Last generation date, YYYY-MM-DD")
+    export.add_argument("--index", help="Document index contains this text")
+    export.add_argument("--desc", help="Short description contains this text")
+    export.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    export.add_argument("--output", default="-", help="Row listing file, or - for stdout (default)")
+    export.add_argument("--zip", help="Also write the PDFs and parameter files into this ZIP")
+    export.set_defaults(func=cmd_export)
+
+    jobs = subparsers.add_parser("jobs", help="List queued and running compile jobs")
+    jobs.set_defaults(func=cmd_jobs)
+
+    cancel = subparsers.add_parser("cancel", help="Cancel queued or running compile jobs")
+    cancel.add_argument("job_ids", nargs="*", help="Job IDs as shown by 'jobs'")
+    cancel.add_argument("--all", action="store_true", help="Cancel every job")
+    cancel.set_defaults(func=cmd_cancel)
+
+    stats = subparsers.add_parser("compile-stats", help="Show compile outcomes per template and queue wait per class")
+    stats.add_argument("--top", type=int, default=20)
+    stats.set_defaults(func=cmd_compile_stats)
+
+    sweep = subparsers.add_parser("sweep", help="Generate a document per combination of field values")
+    sweep.add_argument("template", help="Template name")
+    sweep.add_argument("--set", action="append", metavar="FIELD=VALUES",
+                       help="Values of a field: 'A | B | C', a range '1..10' or '0..1..0.25', "
+                            "'@file.csv:Column', or a single value (repeatable)")
+    sweep.add_argument("--zip", action="store_true", help="Pair the value lists in order instead of combining them all")
+    sweep.add_argument("--description", required=True,
+                       help="Description of the sweep; rerunning with the same one resumes it")
+    sweep.add_argument("--custom-format", help="Custom document ID format, e.g. {TEMPLATE}-{YYMMDD}-{seq}")
+    sweep.set_defaults(func=cmd_sweep)
+
+    batches = subparsers.add_parser("batches", help="List merge and sweep batches and their row states")
+    batches.add_argument("--discard", nargs="+", metavar="FILE",
+                         help="Forget these batches (as listed) and free the IDs their unfinished rows hold")
+    batches.set_defaults(func=cmd_batches)
+
+    snapshot = subparsers.add_parser("snapshot", help="Back up new and changed files and the registries to a directory")
+    snapshot.add_argument("target", help="Backup directory (created if needed)")
+    snapshot.add_argument("--workers", type=int, default=SNAPSHOT_WORKERS)
+    snapshot.set_defaults(func=cmd_snapshot)
+
+    verify = subparsers.add_parser("verify", help="Check a backup snapshot against its checksums")
+    verify.add_argument("target", help="Backup directory")
+    verify.add_argument("--snapshot", help="Snapshot ID (default: the latest)")
+    verify.add_argument("--full", action="store_true", help="Re-read objects verified before as well")
+    verify.add_argument("--workers", type=int, default=SNAPSHOT_WORKERS)
+    verify.set_defaults(func=cmd_verify)
+
+    restore = subparsers.add_parser("restore", help="Restore files and registries from a backup snapshot")
+    restore.add_argument("target", help="Backup directory")
+    restore.add_argument("--snapshot", help="Snapshot ID (default: the latest)")
+    restore.add_argument("--into", default=".", help="Workspace to restore into (default: this one)")
+    restore.add_argument("--registries-only", action="store_true",
+                         help="Only roll the registries back to the snapshot")
+    restore.add_argument("--workers", type=int, default=SNAPSHOT_WORKERS)
+    restore.set_defaults(func=cmd_restore)
+
+    return parser
+
+def run_cli(argv):
+    args = build_cli_parser().parse_args(argv)
+    # Keep stdout clean for commands that stream data to it
+    with contextlib.redirect_stdout(sys.stderr):
+        check_and_create_index()
+    return args.func(args)
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
+
     if shutil.which("pdflatex") is None:
         import tkinter as tk
         from tkinter import messagebox
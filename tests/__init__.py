@@ -0,0 +1,43 @@
+"""
+Unit tests for the pure logic of app.py: search tries and catalogs, sweeps,
+batch journals, LaTeX log parsing, storage layouts, archive packs and
+snapshots. None of them needs Tk or pdflatex. Run from the repository root:
+
+    python -m unittest
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import app
+
+
+class WorkspaceTestCase(unittest.TestCase):
+    """
+    Runs each test in an empty LaxDoc folder (app.py works relative to the
+    current directory), with fresh registry catalogs so nothing cached by
+    an earlier test leaks in.
+    """
+
+    def setUp(self):
+        cwd = os.getcwd()
+        self.workspace = tempfile.mkdtemp(prefix="laxdoc-test-")
+        os.chdir(self.workspace)
+        self.addCleanup(shutil.rmtree, self.workspace, ignore_errors=True)
+        self.addCleanup(os.chdir, cwd)
+        for name, catalog_class in (("template_catalog", app.TemplateCatalog),
+                                    ("document_catalog", app.DocumentCatalog),
+                                    ("document_id_catalog", app.DocumentIdCatalog),
+                                    ("archive_index", app.ArchiveIndex),
+                                    ("content_catalog", app.ContentHashCatalog)):
+            patcher = mock.patch.object(app, name, catalog_class())
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write_file(self, path, content):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb" if isinstance(content, bytes) else "w") as f:
+            f.write(content)
+        return path
@@ -0,0 +1,87 @@
+import os
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import app
+from tests import WorkspaceTestCase
+
+OLD = datetime(2024, 1, 5, 8, 0)
+NEW = datetime(2025, 6, 1, 8, 0)
+CUTOFF = datetime(2025, 1, 1)
+
+
+class ArchiveTest(WorkspaceTestCase):
+
+    def add_document(self, doc_id, when, content=None, param_file=None):
+        pdf = self.write_file(os.path.join("documents", f"{doc_id}.pdf"), content or os.urandom(4096))
+        param_file = param_file or self.write_file(os.path.join("data", f"Offer_{doc_id}.txt"), f"Name={doc_id}\n")
+        app.add_document_entries([(doc_id, "Offer", "", param_file, pdf, when)])
+        return pdf
+
+    def rows(self):
+        _, rows = app.read_registry(app.DOCUMENTS_CSV)
+        return {row["Document Index Number"]: row for row in rows}
+
+    def test_old_documents_are_packed_and_read_back(self):
+        content = b"%PDF-1.5 old offer" * 1000
+        self.add_document("OFL-01", OLD, content)
+        self.add_document("OFL-02", NEW)
+        self.assertEqual(app.archive_documents(CUTOFF), 1)
+
+        rows = self.rows()
+        pdf = rows["OFL-01"]["Path to Generated PDF"]
+        self.assertTrue(app.is_packed(pdf))
+        self.assertEqual(app.packed_member(pdf), "documents/OFL-01.pdf")
+        self.assertFalse(os.path.exists(os.path.join("documents", "OFL-01.pdf")))
+        self.assertTrue(app.stored_file_exists(pdf))
+        self.assertEqual(b"".join(app.iter_packed_member(pdf, chunk_size=100)), content)
+        self.assertEqual(app.read_stored_bytes(rows["OFL-01"]["Path to Parameter File"]), b"Name=OFL-01\n")
+        self.assertFalse(app.is_packed(rows["OFL-02"]["Path to Generated PDF"]))
+        self.assertEqual(app.archive_documents(CUTOFF), 0)
+
+    def test_shared_file_is_packed_once_and_every_row_repointed(self):
+        shared = self.write_file(os.path.join("data", "Offer_shared.txt"), "Name=shared\n")
+        self.add_document("OFL-01", OLD, param_file=shared)
+        self.add_document("OFL-02", NEW, param_file=shared)
+        app.archive_documents(CUTOFF)
+        rows = self.rows()
+        self.assertTrue(app.is_packed(rows["OFL-02"]["Path to Parameter File"]))
+        self.assertEqual(rows["OFL-01"]["Path to Parameter File"], rows["OFL-02"]["Path to Parameter File"])
+        _, index_rows = app.read_registry(app.ARCHIVE_INDEX_CSV)
+        self.assertEqual(sorted(row["Member"] for row in index_rows), ["data/Offer_shared.txt", "documents/OFL-01.pdf"])
+
+    def test_packs_roll_over_once_full(self):
+        for i in range(1, 6):
+            self.add_document(f"OFL-0{i}", OLD)
+        with mock.patch.object(app, "ARCHIVE_PACK_SIZE", 6000):
+            self.assertEqual(app.archive_documents(CUTOFF), 5)
+        _, index_rows = app.read_registry(app.ARCHIVE_INDEX_CSV)
+        self.assertGreater(len({row["Pack File"] for row in index_rows}), 1)
+        for row in index_rows:  # members only start below the limit; the last one may cross it
+            self.assertLess(int(row["Offset"]), 6000)
+        packs = sorted(name for name in os.listdir(app.ARCHIVE_DIR) if name.endswith(".pack"))
+        self.assertEqual(len(packs), len({row["Pack File"] for row in index_rows}))
+        for row in self.rows().values():
+            pdf = row["Path to Generated PDF"]
+            self.assertEqual(len(b"".join(app.iter_packed_member(pdf))), 4096)
+
+    def test_missing_member_is_reported(self):
+        missing = "archive/pack-0001.pack#documents/GONE.pdf"
+        self.assertFalse(app.stored_file_exists(missing))
+        with self.assertRaises(FileNotFoundError):
+            list(app.iter_packed_member(missing))
+
+    def test_truncated_pack_is_reported(self):
+        pdf = self.add_document("OFL-01", OLD)
+        app.archive_documents(CUTOFF)
+        packed = self.rows()["OFL-01"]["Path to Generated PDF"]
+        pack_file, offset, length, _ = app.archive_index.lookup(app.packed_member(packed))
+        os.truncate(pack_file, offset + length // 2)
+        with self.assertRaises(IOError):
+            list(app.iter_packed_member(packed))
+        self.assertFalse(os.path.exists(pdf))
+
+
+if __name__ == "__main__":
+    unittest.main()
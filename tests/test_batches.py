@@ -0,0 +1,104 @@
+import json
+import os
+import unittest
+from unittest import mock
+
+import app
+from tests import WorkspaceTestCase
+
+
+class BatchJournalTest(WorkspaceTestCase):
+
+    def journal(self, batch_input="rows.csv"):
+        return app.BatchJournal("merge", "Offer", batch_input)
+
+    def test_rerun_resumes_from_the_recorded_states(self):
+        journal = self.journal()
+        journal.record(["r1", "r2", "r3"], app.BatchJournal.PENDING)
+        journal.start({"r1": "001-01", "r2": "001-02"})
+        journal.record("r1", app.BatchJournal.DONE)
+
+        rerun = self.journal()
+        self.assertEqual(rerun.path, journal.path)
+        self.assertEqual([rerun.state(key) for key in ("r1", "r2", "r3")],
+                         [app.BatchJournal.DONE, app.BatchJournal.COMPILING, app.BatchJournal.PENDING])
+        self.assertEqual(rerun.doc_id("r1"), "001-01")
+        self.assertIsNone(rerun.doc_id("r3"))
+        self.assertNotEqual(self.journal("other.csv").path, journal.path)
+
+    def test_settle_finishes_registered_rows_and_requeues_the_rest(self):
+        journal = self.journal()
+        journal.start({"r1": "001-01", "r2": "001-02"})
+        rerun = self.journal()
+        rerun.settle({"001-01"})
+        self.assertEqual(rerun.state("r1"), app.BatchJournal.DONE)
+        self.assertEqual(rerun.state("r2"), app.BatchJournal.PENDING)
+        self.assertEqual(rerun.doc_id("r2"), "001-02")
+
+    def test_failures_back_off_doubling(self):
+        journal = self.journal()
+        with mock.patch.object(app.time, "time", return_value=1_700_000_000):
+            journal.fail("r1", "boom")
+            first = journal.rows["r1"]["retry_at"]
+            journal.fail("r1", "boom again")
+        entry = self.journal().rows["r1"]
+        self.assertEqual(entry["attempts"], 2)
+        self.assertEqual(entry["error"], "boom again")
+        delay = (app.datetime.strptime(entry["retry_at"], "%Y-%m-%d %H:%M:%S")
+                 - app.datetime.strptime(first, "%Y-%m-%d %H:%M:%S")).total_seconds()
+        self.assertEqual(delay, app.BATCH_RETRY_BACKOFF)
+
+    def test_waiting_until_the_backoff_has_passed(self):
+        journal = self.journal()
+        journal.fail("r1", "boom")
+        self.assertIsNotNone(journal.waiting("r1"))
+        journal.record("r1", app.BatchJournal.FAILED, retry_at="2000-01-01 00:00:00")
+        self.assertIsNone(journal.waiting("r1"))
+        self.assertIsNone(journal.waiting("unknown"))
+
+    def test_torn_last_line_is_dropped(self):
+        journal = self.journal()
+        journal.record("r1", app.BatchJournal.DONE)
+        size = os.path.getsize(journal.path)
+        with open(journal.path, "a") as f:
+            f.write('{"row": "r2", "state": "do')
+        rerun = self.journal()
+        self.assertEqual(list(rerun.rows), ["r1"])
+        self.assertEqual(os.path.getsize(journal.path), size)
+        rerun.record("r2", app.BatchJournal.PENDING)
+        self.assertEqual(self.journal().state("r2"), app.BatchJournal.PENDING)
+
+    def test_done_journal_is_compacted(self):
+        journal = self.journal()
+        journal.record(["r1", "r2"], app.BatchJournal.PENDING)
+        journal.record("r1", app.BatchJournal.DONE)
+        self.assertFalse(journal.close_if_done())
+        journal.record("r2", app.BatchJournal.DONE)
+        self.assertTrue(journal.close_if_done())
+        with open(journal.path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertIn("closed", lines[0])
+        self.assertEqual([line["row"] for line in lines[1:]], ["r1", "r2"])
+        self.assertEqual(self.journal().state("r2"), app.BatchJournal.DONE)
+
+
+class IterBatchRowsTest(unittest.TestCase):
+
+    def test_keys_follow_content_not_position(self):
+        a, b = {"name": "Ann"}, {"name": "Bob"}
+        keys = dict(app.iter_batch_rows([a, b]))
+        reordered = dict(app.iter_batch_rows([b, a]))
+        self.assertEqual({key: record["name"] for key, record in keys.items()},
+                         {key: record["name"] for key, record in reordered.items()})
+        edited = dict(app.iter_batch_rows([{"name": "Ann "}, b]))
+        self.assertEqual(len(set(keys) & set(edited)), 1)
+
+    def test_identical_rows_stay_distinct(self):
+        keys = [key for key, _ in app.iter_batch_rows([{"n": "1"}, {"n": "1"}, {"n": "2"}])]
+        self.assertEqual(len(set(keys)), 3)
+        self.assertEqual(keys[0].rsplit("-", 1)[0], keys[1].rsplit("-", 1)[0])
+        self.assertEqual([key.rsplit("-", 1)[1] for key in keys], ["0", "1", "0"])
+
+
+if __name__ == "__main__":
+    unittest.main()
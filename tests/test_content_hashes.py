@@ -0,0 +1,29 @@
+import csv
+import unittest
+
+import app
+from tests import WorkspaceTestCase
+
+
+class ContentHashCatalogTest(WorkspaceTestCase):
+
+    def test_lookup_sees_rows_appended_by_others(self):
+        catalog = app.ContentHashCatalog()
+        catalog.remember("params", "d1", "data/a.txt")
+        self.assertEqual(catalog.lookup("params", "d1"), "data/a.txt")
+        app.append_registry_rows(app.CONTENT_HASHES_CSV, app.CONTENT_HASHES_HEADERS, [["d2", "params", "data/b.txt"]])
+        self.assertEqual(catalog.lookup("params", "d2"), "data/b.txt")
+
+    def test_latest_row_for_a_path_wins(self):
+        catalog = app.ContentHashCatalog()
+        catalog.remember("render", "old", "documents/x.pdf")
+        catalog.remember("render", "new", "documents/x.pdf")
+        fresh = app.ContentHashCatalog()
+        self.assertIsNone(fresh.lookup("render", "old"))
+        self.assertEqual(fresh.lookup("render", "new"), "documents/x.pdf")
+        with open(app.CONTENT_HASHES_CSV, newline="") as f:
+            self.assertEqual(len(list(csv.reader(f))), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+import app
+
+
+def parse(output):
+    parser = app.LatexLogParser()
+    completed = [parser.feed(line) for line in output.splitlines(keepends=True)]
+    completed.append(parser.close())
+    return parser, [error for error in completed if error is not None]
+
+
+class LatexLogParserTest(unittest.TestCase):
+
+    def test_file_line_error_with_context(self):
+        parser, completed = parse(
+            "(./offer.tex\r\n"
+            "./offer.tex:12: Undefined control sequence.\r\n"
+            "l.12 Dear \\nmae\r\n"
+            "Output written on offer.pdf.\r\n")
+        self.assertEqual(completed, [{"file": "./offer.tex", "line": 12,
+                                      "message": "Undefined control sequence.", "context": "Dear \\nmae"}])
+        self.assertEqual(parser.errors, completed)
+
+    def test_classic_error_takes_its_line_from_the_context(self):
+        _, completed = parse(
+            "! Missing $ inserted.\n"
+            "<inserted text>\n"
+            "l.7 x^\n")
+        self.assertEqual(completed, [{"file": None, "line": 7, "message": "Missing $ inserted.", "context": "x^"}])
+
+    def test_error_is_returned_as_soon_as_it_is_complete(self):
+        parser = app.LatexLogParser()
+        self.assertIsNone(parser.feed("! Emergency stop.\n"))
+        error = parser.feed("! Another one.\n")  # no context line: the next error completes it
+        self.assertEqual(error["message"], "Emergency stop.")
+        self.assertEqual(parser.close()["message"], "Another one.")
+        self.assertIsNone(parser.close())
+        self.assertEqual(len(parser.errors), 2)
+
+    def test_error_in_a_package_file(self):
+        _, completed = parse("/usr/share/texmf/tex/latex/base/article.cls:42: Bad option.\n")
+        self.assertEqual([(error["file"], error["line"]) for error in completed],
+                         [("/usr/share/texmf/tex/latex/base/article.cls", 42)])
+
+    def test_ordinary_output_is_not_an_error(self):
+        parser, completed = parse(
+            "This is pdfTeX, Version 3.141592653\n"
+            "l.3 is only a context line after an error\n"
+            "Overfull \\hbox (1.2pt too wide) in paragraph at lines 3--4\n")
+        self.assertEqual(completed, [])
+        self.assertEqual(parser.errors, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+import itertools
+import unittest
+
+import app
+from tests import WorkspaceTestCase
+
+
+class PrefixTrieTest(unittest.TestCase):
+
+    def test_complete_is_sorted_case_insensitive_and_keeps_first_spelling(self):
+        trie = app.PrefixTrie()
+        for key in ("Offer Letter", "offer memo", "Invoice", "Offer Letter"):
+            trie.add(key, key)
+        self.assertEqual(trie.complete("OFF"), ["Offer Letter", "offer memo"])
+        self.assertEqual(trie.complete("x"), [])
+        self.assertEqual(len(trie), 3)
+
+    def test_values_collects_every_key_under_the_prefix(self):
+        trie = app.PrefixTrie()
+        trie.add("alpha", 1)
+        trie.add("alpine", 2)
+        trie.add("alpha", 3)
+        trie.add("beta", 4)
+        self.assertEqual(trie.values("alp"), {1, 2, 3})
+        self.assertEqual(sorted(trie.iter_values("alpha")), [1, 3])
+
+    def test_remove_drops_one_value_then_the_key(self):
+        trie = app.PrefixTrie()
+        trie.add("alpha", 1)
+        trie.add("alpha", 2)
+        trie.remove("alpha", 1)
+        self.assertEqual(trie.values("al"), {2})
+        trie.remove("alpha", 2)
+        self.assertEqual(trie.complete("al"), [])
+
+    def test_burst_nodes_keep_order_and_lookups(self):
+        trie = app.PrefixTrie()
+        trie.BURST_LIMIT = 4
+        keys = [f"{a}{b}{c}" for a in "ab" for b in "xyz" for c in "123"]
+        for key in reversed(keys):  # one at a time: bursts as it grows
+            trie.add(key, key)
+            trie.link_pending()
+        self.assertEqual(list(trie.keys()), sorted(keys))
+        self.assertEqual(list(trie.keys("ay")), ["ay1", "ay2", "ay3"])
+        trie.remove("ay2", "ay2")
+        self.assertEqual(list(trie.keys("ay")), ["ay1", "ay3"])
+
+    def test_bulk_load_builds_the_same_trie(self):
+        trie = app.PrefixTrie()
+        trie.BURST_LIMIT = 4
+        keys = [f"k{i:03d}" for i in range(200)]
+        for key in keys:
+            trie.add(key, key)
+        self.assertEqual(list(trie.keys("k1")), keys[100:200])
+
+
+class CsvRecordOffsetsTest(unittest.TestCase):
+
+    def test_offsets_of_complete_records(self):
+        data = b'a,b\n1,"two\nlines"\n3,x\n'
+        offsets, consumed = app.csv_record_offsets(data)
+        self.assertEqual(offsets, [0, 4, 18])
+        self.assertEqual(consumed, len(data))
+
+    def test_partial_last_record_is_left_unconsumed(self):
+        data = b'a,b\n1,"open\n'
+        offsets, consumed = app.csv_record_offsets(data)
+        self.assertEqual(offsets, [0])
+        self.assertEqual(consumed, 4)
+
+
+class DocumentCatalogTest(WorkspaceTestCase):
+
+    def add_documents(self, *rows):
+        app.add_document_entries([(doc_id, template, desc, "", f"documents/{doc_id}.pdf")
+                                  for doc_id, template, desc in rows])
+
+    def catalog(self):
+        catalog = app.DocumentCatalog()
+        catalog.refresh()
+        catalog.build_search_index()
+        return catalog
+
+    def test_rows_are_read_back_by_offset(self):
+        self.add_documents(("001-01", "Offer", "first"), ("001-02", "Offer", 'a "quoted"\nmultiline one'),
+                           ("002-01", "Invoice", "third"))
+        catalog = self.catalog()
+        rows = list(catalog.rows(["002-01", "001-02"]))
+        self.assertEqual([row["Document Index Number"] for row in rows], ["002-01", "001-02"])
+        self.assertEqual(rows[1]["Short Description"], 'a "quoted"\nmultiline one')
+
+    def test_matching_ids_combines_every_criterion(self):
+        self.add_documents(("001-01", "Offer Letter", "annual review"), ("001-02", "Offer Letter", "quarterly"),
+                           ("002-01", "Invoice", "annual invoice"))
+        catalog = self.catalog()
+        self.assertIsNone(catalog.matching_ids())
+        self.assertEqual(sorted(catalog.matching_ids(index="001")), ["001-01", "001-02"])
+        self.assertEqual(sorted(catalog.matching_ids(words=["ann"])), ["001-01", "002-01"])
+        self.assertEqual(list(catalog.matching_ids(type_prefix="offer", words=["ann"])), ["001-01"])
+        self.assertEqual(list(catalog.matching_ids(index="002", type_prefix="offer")), [])
+
+    def test_appended_rows_are_parsed_incrementally(self):
+        self.add_documents(("001-01", "Offer", "first"))
+        catalog = self.catalog()
+        offset = catalog._offset
+        self.add_documents(("001-02", "Offer", "second"))
+        with open(app.DOCUMENTS_CSV, "rb") as f:
+            f.seek(offset)
+            appended = f.read()
+        self.assertTrue(catalog.refresh(notify=False))
+        self.assertEqual(catalog._offset, offset + len(appended))
+        self.assertEqual(sorted(catalog.matching_ids(words=["second"])), ["001-02"])
+        self.assertEqual([row["Short Description"] for row in catalog.rows(["001-02"])], ["second"])
+
+    def test_rewrite_removes_deleted_rows_from_the_tries(self):
+        self.add_documents(("001-01", "Offer", "first"), ("001-02", "Memo", "second"))
+        catalog = self.catalog()
+        app.update_registry(app.DOCUMENTS_CSV,
+                            lambda rows: [row for row in rows if row["Document Index Number"] != "001-02"])
+        catalog.refresh(notify=False)
+        self.assertEqual(list(catalog.matching_ids(index="001")), ["001-01"])
+        self.assertEqual(catalog.template_names, {"Offer"})
+        self.assertEqual(catalog.complete("type", "m"), [])
+
+    def test_partially_written_row_waits_for_the_next_refresh(self):
+        self.add_documents(("001-01", "Offer", "first"))
+        catalog = self.catalog()
+        with open(app.DOCUMENTS_CSV, "a", newline="") as f:
+            f.write('001-02,Offer,2025-01-01 10:00:00,"unfinished')
+        catalog.refresh(notify=False)
+        self.assertEqual(list(catalog.matching_ids(index="001-02")), [])
+        with open(app.DOCUMENTS_CSV, "a", newline="") as f:
+            f.write(' row",,\r\n')
+        catalog.refresh(notify=False)
+        self.assertEqual(list(catalog.matching_ids(index="001-02")), ["001-02"])
+
+    def test_subscribers_are_notified_only_when_asked(self):
+        self.add_documents(("001-01", "Offer", "first"))
+        catalog = app.DocumentCatalog()
+        seen = []
+        catalog.subscribe(seen.append)
+        self.assertTrue(catalog.refresh(notify=False))
+        self.assertEqual(seen, [])
+        catalog.notify()
+        self.assertEqual(seen, [catalog])
+        self.assertFalse(catalog.refresh())
+
+    def test_live_filter_candidates_are_lazy(self):
+        self.add_documents(*[(f"001-{i:04d}", "Offer", "bulk") for i in range(500)])
+        catalog = self.catalog()
+        candidates = catalog.matching_ids(words=["bulk"])
+        self.assertEqual(len(list(itertools.islice(candidates, 10))), 10)
+        self.assertEqual(sum(1 for _ in candidates), 490)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import unittest
+from datetime import datetime
+
+import app
+from tests import WorkspaceTestCase
+
+
+class SnapshotTest(WorkspaceTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.target = os.path.join(self.workspace, "backup")
+        self.pdf = self.write_file(os.path.join("documents", "OFL-01.pdf"), b"%PDF-1.5 offer")
+        self.param_file = self.write_file(os.path.join("data", "Offer_OFL-01.txt"), "Name=Ann\n")
+        self.write_file(os.path.join("templates", "Offer.tex"), "\\documentclass{article}")
+        app.add_document_entries([("OFL-01", "Offer", "", self.param_file, self.pdf, datetime(2025, 3, 7))])
+
+    def manifest(self, snapshot_id=None):
+        _, rows = app.load_snapshot_manifest(self.target, snapshot_id)
+        return {row["Path"]: row for row in rows}
+
+    def test_snapshot_stores_registries_and_files(self):
+        summary = app.create_snapshot(self.target)
+        self.assertEqual((summary["files"], summary["copied"], summary["missing"]), (3, 3, []))
+        self.assertEqual(app.list_snapshots(self.target), [summary["snapshot"]])
+        manifest = self.manifest()
+        self.assertEqual(manifest["documents.csv"]["Kind"], "registry")
+        self.assertEqual(manifest["documents/OFL-01.pdf"]["Kind"], "file")
+        with open(app.snapshot_object_path(self.target, manifest["documents/OFL-01.pdf"]["SHA-256"]), "rb") as f:
+            self.assertEqual(f.read(), b"%PDF-1.5 offer")
+
+    def test_next_snapshot_copies_only_changed_files(self):
+        first = app.create_snapshot(self.target)
+        self.write_file(self.param_file, "Name=Bob\n")
+        second = app.create_snapshot(self.target)
+        self.assertEqual((second["files"], second["copied"]), (3, 1))
+        self.assertEqual(app.list_snapshots(self.target), [first["snapshot"], second["snapshot"]])
+        self.assertNotEqual(self.manifest(first["snapshot"])["data/Offer_OFL-01.txt"]["SHA-256"],
+                            self.manifest()["data/Offer_OFL-01.txt"]["SHA-256"])
+
+    def test_files_the_registry_lost_are_reported(self):
+        os.remove(self.pdf)
+        self.assertEqual(app.create_snapshot(self.target)["missing"], [self.pdf])
+
+    def test_verify_reads_each_object_once_unless_full(self):
+        app.create_snapshot(self.target)
+        first = app.verify_snapshot(self.target)
+        self.assertEqual((first["read"], first["skipped"], first["missing"], first["corrupt"]),
+                         (first["objects"], 0, [], []))
+        self.assertEqual(app.verify_snapshot(self.target)["skipped"], first["objects"])
+        self.assertEqual(app.verify_snapshot(self.target, full=True)["read"], first["objects"])
+
+    def test_verify_finds_missing_and_corrupt_objects(self):
+        app.create_snapshot(self.target)
+        app.verify_snapshot(self.target)
+        manifest = self.manifest()
+        os.remove(app.snapshot_object_path(self.target, manifest["data/Offer_OFL-01.txt"]["SHA-256"]))
+        damaged = app.snapshot_object_path(self.target, manifest["documents/OFL-01.pdf"]["SHA-256"])
+        with open(damaged, "r+b") as f:  # same size, so only reading it can tell
+            f.write(b"%PDF-1.4")
+        stat = os.stat(damaged)
+        os.utime(damaged, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        summary = app.verify_snapshot(self.target)
+        self.assertEqual(summary["missing"], ["data/Offer_OFL-01.txt"])
+        self.assertEqual(summary["corrupt"], ["documents/OFL-01.pdf"])
+
+    def test_restore_into_an_empty_folder(self):
+        app.create_snapshot(self.target)
+        into = os.path.join(self.workspace, "restored")
+        summary = app.restore_snapshot(self.target, into=into)
+        self.assertEqual((summary["restored"], summary["unchanged"], summary["registries"]), (3, 0, 1))
+        with open(os.path.join(into, "documents", "OFL-01.pdf"), "rb") as f:
+            self.assertEqual(f.read(), b"%PDF-1.5 offer")
+        self.assertEqual(os.stat(os.path.join(into, "documents", "OFL-01.pdf")).st_mtime_ns,
+                         os.stat(self.pdf).st_mtime_ns)
+        _, rows = app.read_registry(os.path.join(into, app.DOCUMENTS_CSV))
+        self.assertEqual([row["Document Index Number"] for row in rows], ["OFL-01"])
+        self.assertEqual(app.restore_snapshot(self.target, into=into)["unchanged"], 3)
+
+    def test_restore_rolls_back_the_workspace(self):
+        snapshot_id = app.create_snapshot(self.target)["snapshot"]
+        self.write_file(self.param_file, "Name=Bob\n")
+        app.add_document_entries([("OFL-02", "Offer", "", self.param_file, self.pdf)])
+        summary = app.restore_snapshot(self.target, snapshot_id, registries_only=True)
+        self.assertEqual((summary["restored"], summary["registries"]), (0, 1))
+        _, rows = app.read_registry(app.DOCUMENTS_CSV)
+        self.assertEqual([row["Document Index Number"] for row in rows], ["OFL-01"])
+        self.assertEqual(app.restore_snapshot(self.target, snapshot_id)["restored"], 1)
+        with open(self.param_file) as f:
+            self.assertEqual(f.read(), "Name=Ann\n")
+
+    def test_corrupt_object_is_never_restored(self):
+        app.create_snapshot(self.target)
+        digest = self.manifest()["data/Offer_OFL-01.txt"]["SHA-256"]
+        with open(app.snapshot_object_path(self.target, digest), "wb") as f:
+            f.write(b"Name=Eve\n")
+        self.write_file(self.param_file, "Name=Bob!\n")
+        with self.assertRaises(ValueError):
+            app.restore_snapshot(self.target)
+        with open(self.param_file) as f:
+            self.assertEqual(f.read(), "Name=Bob!\n")
+
+    def test_unknown_snapshot_is_refused(self):
+        with self.assertRaises(ValueError):
+            app.load_snapshot_manifest(self.target)
+        app.create_snapshot(self.target)
+        with self.assertRaises(ValueError):
+            app.restore_snapshot(self.target, "19990101-000000")
+
+
+if __name__ == "__main__":
+    unittest.main()
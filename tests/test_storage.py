@@ -0,0 +1,82 @@
+import contextlib
+import hashlib
+import io
+import os
+import unittest
+from datetime import datetime
+
+import app
+from tests import WorkspaceTestCase
+
+WHEN = datetime(2025, 3, 7, 9, 30)
+
+
+class StoragePathTest(unittest.TestCase):
+
+    def test_layouts(self):
+        digest = hashlib.sha1(b"OFL-01").hexdigest()
+        expected = {
+            "flat": os.path.join("documents", "OFL-01.pdf"),
+            "template": os.path.join("documents", "OFL", "OFL-01.pdf"),
+            "month": os.path.join("documents", "2025", "03", "OFL-01.pdf"),
+            "hash": os.path.join("documents", digest[:2], digest[2:4], "OFL-01.pdf"),
+        }
+        for layout, path in expected.items():
+            with self.subTest(layout=layout):
+                self.assertEqual(app.storage_path("documents", "OFL-01.pdf", "OFL", "OFL-01", WHEN, layout), path)
+
+    def test_missing_template_index_and_document_id(self):
+        self.assertEqual(app.storage_path("data", "x.txt", layout="template"), os.path.join("data", "unknown", "x.txt"))
+        digest = hashlib.sha1(b"x.txt").hexdigest()
+        self.assertEqual(app.storage_path("data", "x.txt", layout="hash"),
+                         os.path.join("data", digest[:2], digest[2:4], "x.txt"))
+
+    def test_hash_layout_keeps_a_documents_files_together(self):
+        param_file, pdf = app.document_paths("OFL-01", "Offer", "OFL", WHEN, "hash")
+        self.assertEqual(os.path.basename(param_file), "Offer_OFL-01.txt")
+        self.assertEqual(os.path.relpath(os.path.dirname(param_file), app.DATA_DIR),
+                         os.path.relpath(os.path.dirname(pdf), app.DOCUMENTS_DIR))
+
+    def test_unknown_layout_is_refused(self):
+        with self.assertRaises(ValueError):
+            app.storage_path("documents", "x.pdf", layout="weekly")
+
+
+class MigrateStorageLayoutTest(WorkspaceTestCase):
+
+    def add_document(self, doc_id, param_file, pdf):
+        for path in (param_file, pdf):
+            if not os.path.exists(path):
+                self.write_file(path, path)
+        app.add_document_entries([(doc_id, "Offer", "", param_file, pdf, WHEN)])
+
+    def registered_paths(self):
+        _, rows = app.read_registry(app.DOCUMENTS_CSV)
+        return {row["Document Index Number"]: (row["Path to Parameter File"], row["Path to Generated PDF"])
+                for row in rows}
+
+    def test_files_are_moved_and_rows_repointed(self):
+        self.add_document("OFL-01", os.path.join("data", "Offer_OFL-01.txt"), os.path.join("documents", "OFL-01.pdf"))
+        self.assertEqual(app.migrate_storage_layout("month"), 1)
+        expected = (os.path.join("data", "2025", "03", "Offer_OFL-01.txt"),
+                    os.path.join("documents", "2025", "03", "OFL-01.pdf"))
+        self.assertEqual(self.registered_paths(), {"OFL-01": expected})
+        self.assertTrue(all(os.path.exists(path) for path in expected))
+        self.assertEqual(app.migrate_storage_layout("month"), 0)
+
+    def test_shared_file_is_moved_once_for_every_row(self):
+        shared = os.path.join("data", "Offer_shared.txt")
+        self.add_document("OFL-01", shared, os.path.join("documents", "OFL-01.pdf"))
+        self.add_document("OFL-02", shared, os.path.join("documents", "OFL-02.pdf"))
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertEqual(app.migrate_storage_layout("template", checkpoint_rows=1), 2)
+        self.assertIn("Checkpoint: 2 documents moved.", output.getvalue())
+        paths = self.registered_paths()
+        moved = os.path.join("data", "OFL", "Offer_shared.txt")
+        self.assertEqual({paths["OFL-01"][0], paths["OFL-02"][0]}, {moved})
+        self.assertTrue(os.path.exists(moved))
+        self.assertFalse(os.path.exists(shared))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+
+import app
+from tests import WorkspaceTestCase
+
+
+class ParseSweepValuesTest(WorkspaceTestCase):
+
+    def test_list_is_split_on_bars_and_stripped(self):
+        self.assertEqual(app.parse_sweep_values("North | South |  | East"), ["North", "South", "East"])
+
+    def test_double_bar_is_a_literal_bar(self):
+        self.assertEqual(app.parse_sweep_values("a || b | c"), ["a | b", "c"])
+        self.assertEqual(app.parse_sweep_values("x||y"), ["x|y"])
+
+    def test_latex_double_bar_is_left_alone(self):
+        self.assertEqual(app.parse_sweep_values(r"$\|v\|$ | $|v|$"), [r"$\|v\|$", "$", "v", "$"])
+        self.assertEqual(app.parse_sweep_values(r"\|x\|"), [r"\|x\|"])
+
+    def test_single_value_is_kept_as_typed(self):
+        self.assertEqual(app.parse_sweep_values("  Main Street 1 "), ["  Main Street 1 "])
+
+    def test_ranges_are_inclusive_with_the_precision_of_their_bounds(self):
+        self.assertEqual(app.parse_sweep_values("1..4"), ["1", "2", "3", "4"])
+        self.assertEqual(app.parse_sweep_values("3..1"), ["3", "2", "1"])
+        self.assertEqual(app.parse_sweep_values("0..1..0.25"), ["0.00", "0.25", "0.50", "0.75", "1.00"])
+        self.assertEqual(app.parse_sweep_values("0.1..0.3..0.1"), ["0.1", "0.2", "0.3"])
+
+    def test_range_that_never_ends_is_refused(self):
+        for spec in ("1..5..-1", "1..5..0"):
+            with self.assertRaises(ValueError):
+                app.parse_sweep_values(spec)
+
+    def test_csv_column_values(self):
+        self.write_file("tiers.csv", "Tier,Price\nGold, 10\n,5\n Silver ,3\n")
+        self.assertEqual(app.parse_sweep_values("@tiers.csv:Tier"), ["Gold", "Silver"])
+        with self.assertRaises(ValueError):
+            app.parse_sweep_values("@tiers.csv:Missing")
+
+
+class SweepRecordsTest(unittest.TestCase):
+
+    def test_product_covers_every_combination_in_order(self):
+        values = {"tier": ["A", "B"], "region": ["N", "S", "E"], "year": ["2025"]}
+        records = list(app.iter_sweep_records(values))
+        self.assertEqual(len(records), app.count_sweep_records(values))
+        self.assertEqual(records[:2], [{"tier": "A", "region": "N", "year": "2025"},
+                                       {"tier": "A", "region": "S", "year": "2025"}])
+        self.assertEqual(records[-1], {"tier": "B", "region": "E", "year": "2025"})
+
+    def test_zip_pairs_lists_and_repeats_single_values(self):
+        values = {"tier": ["A", "B"], "region": ["N", "S"], "year": ["2025"]}
+        self.assertEqual(list(app.iter_sweep_records(values, "zip")),
+                         [{"tier": "A", "region": "N", "year": "2025"},
+                          {"tier": "B", "region": "S", "year": "2025"}])
+        self.assertEqual(app.count_sweep_records(values, "zip"), 2)
+
+    def test_zip_of_unequal_lists_is_refused(self):
+        with self.assertRaises(ValueError):
+            list(app.iter_sweep_records({"tier": ["A", "B"], "region": ["N", "S", "E"]}, "zip"))
+
+
+class ReserveDocumentIdsTest(WorkspaceTestCase):
+
+    def test_ids_skip_registered_and_reserved_ones(self):
+        app.add_document_entries([("T-01", "Offer", "", "", "documents/T-01.pdf")])
+        holder = app.process_holder()
+        first = app.reserve_document_ids("T", holder, [None, None], custom_format="{TEMPLATE}-{seq}")
+        self.assertEqual(first, ["T-02", "T-03"])
+        second = app.reserve_document_ids("T", "pid:elsewhere:1", [None, "T-03", "T-09"],
+                                          custom_format="{TEMPLATE}-{seq}")
+        self.assertEqual(second, ["T-04", "T-05", "T-09"])
+        self.assertEqual(app.live_reserved_ids(), {"T-02", "T-03", "T-04", "T-05", "T-09"})
+
+    def test_holder_keeps_its_own_reservations(self):
+        holder = app.process_holder()
+        doc_ids = app.reserve_document_ids("T", holder, [None, None], custom_format="{TEMPLATE}-{seq}")
+        self.assertEqual(app.reserve_document_ids("T", holder, doc_ids, custom_format="{TEMPLATE}-{seq}"), doc_ids)
+        app.release_document_ids(doc_ids[:1])
+        self.assertEqual(app.live_reserved_ids(), set(doc_ids[1:]))
+
+    def test_running_out_of_ids_is_refused(self):
+        with self.assertRaises(ValueError):
+            app.reserve_document_ids("T", app.process_holder(), [None] * 3,
+                                     custom_format="{TEMPLATE}-{seq}", max_seq=2)
+
+
+if __name__ == "__main__":
+    unittest.main()